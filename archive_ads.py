@@ -0,0 +1,77 @@
+"""Перенос давно отклоненных объявлений в холодный архив ads_archive.
+
+Отклоненные объявления, статус которых не менялся дольше --older-than-days дней,
+удаляются из секции ads_rejected и тем же запросом добавляются в ads_archive;
+отзывы о них и их сводки удаляются, как при удалении объявления (delete_ad_db).
+Работает пачками, каждая пачка - короткая отдельная транзакция; строки, занятые
+другими транзакциями, пропускаются до следующего запуска. Команду можно запускать
+по расписанию (cron), повторный запуск безопасен.
+
+    python archive_ads.py --older-than-days 30 --batch-rows 1000 --pause 0.1
+"""
+import os
+import time
+import argparse
+import psycopg2.errors
+from database import transaction
+from models import AdStatus, ReviewType
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+
+# Пачек подряд, прерванных ошибкой сериализации, после которых запуск прекращается
+MAX_RETRIES = 3
+
+ARCHIVE_COLUMNS = "id, user_id, title, price, location, contact, status, created_at, updated_at, location_id"
+
+_ARCHIVE_BATCH = (
+    "WITH moved AS ("
+    "    DELETE FROM ads WHERE status = %s AND id IN ("
+    "        SELECT id FROM ads WHERE status = %s AND updated_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day' "
+    "        ORDER BY updated_at, id LIMIT %s FOR UPDATE SKIP LOCKED"
+    "    ) "
+    f"    RETURNING {ARCHIVE_COLUMNS}"
+    "), summaries AS ("
+    "    DELETE FROM review_aggregates WHERE type = %s AND ad_id IN (SELECT id FROM moved)"
+    "), reviews AS ("
+    "    DELETE FROM reviews WHERE ad_id IN (SELECT id FROM moved)"
+    ") "
+    f"INSERT INTO ads_archive ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM moved"
+)
+
+def archive_batch(older_than_days, batch_rows):
+    status = AdStatus.REJECTED.value
+    with transaction() as cur:
+        cur.execute(_ARCHIVE_BATCH, (status, status, older_than_days, batch_rows, ReviewType.AD.value))
+        return cur.rowcount
+
+def archive_rejected(older_than_days=ARCHIVE_AFTER_DAYS, batch_rows=1000, pause=0, report=None):
+    total = retries = 0
+    while True:
+        try:
+            moved = archive_batch(older_than_days, batch_rows)
+        except psycopg2.errors.SerializationFailure:
+            # Объявление пачки одновременно перенесли в другую секцию (например, опубликовали)
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise
+            continue
+        retries = 0
+        total += moved
+        if report:
+            report(f"перенесено {moved}, всего {total}")
+        if moved < batch_rows:
+            return total
+        if pause:
+            time.sleep(pause)
+
+def main(args):
+    total = archive_rejected(args.older_than_days, args.batch_rows, args.pause, report=print)
+    print(f"В архив перенесено объявлений: {total}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='сколько дней объявление должно быть отклонено')
+    parser.add_argument('--batch-rows', type=int, default=1000, help='строк в одной транзакции')
+    parser.add_argument('--pause', type=float, default=0.1, help='пауза между пачками, секунд')
+    main(parser.parse_args())
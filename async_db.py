@@ -0,0 +1,87 @@
+import asyncio
+import contextvars
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import utils
+from database import POOL_MAX_SIZE, ITER_BATCH_SIZE
+from cache import MISSING
+
+# Синхронные функции utils выполняются в ограниченном пуле потоков, чтобы
+# запросы psycopg2 не блокировали цикл событий бота. Потоков не больше, чем
+# соединений в пуле: лишние потоки все равно ждали бы свободное соединение.
+_executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=POOL_MAX_SIZE, thread_name_prefix='db')
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # Контекст копируется, чтобы contextvars обработчика были видны в потоке
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+def _take(rows, count):
+    return list(itertools.islice(rows, count))
+
+async def iterate(func, *args, batch_size=ITER_BATCH_SIZE, **kwargs):
+    # Асинхронный обход потоковой функции utils (iter_*): каждая пачка строк читается
+    # в потоке из пула, между пачками цикл событий свободен. Соединение возвращается
+    # в пул при исчерпании или закрытии итератора (contextlib.aclosing)
+    rows = func(*args, **kwargs)
+    try:
+        while batch := await run_db(_take, rows, batch_size):
+            for row in batch:
+                yield row
+    finally:
+        await run_db(rows.close)
+
+# ===== Асинхронные версии функций utils =====
+async def get_user(telegram_id):
+    # При попадании в кэш поток из пула не нужен
+    user = utils.user_cache.get(telegram_id)
+    if user is not MISSING:
+        return user
+    return await run_db(utils.load_user, telegram_id)
+
+get_user_by_id = _to_async(utils.get_user_by_id)
+create_user = _to_async(utils.create_user)
+create_ad = _to_async(utils.create_ad)
+get_user_ads = _to_async(utils.get_user_ads)
+get_ad_details = _to_async(utils.get_ad_details)
+update_ad_field = _to_async(utils.update_ad_field)
+delete_ad_db = _to_async(utils.delete_ad_db)
+create_search = _to_async(utils.create_search)
+get_matching_searches = _to_async(utils.get_matching_searches)
+find_matching_searches = _to_async(utils.find_matching_searches)
+search_ads_in_db = _to_async(utils.search_ads_in_db)
+search_ads_page = _to_async(utils.search_ads_page)
+search_price_facets = _to_async(utils.search_price_facets)
+create_review = _to_async(utils.create_review)
+get_review_summary = _to_async(utils.get_review_summary)
+get_reviews_page = _to_async(utils.get_reviews_page)
+get_ads_for_moderation = _to_async(utils.get_ads_for_moderation)
+set_ads_status = _to_async(utils.set_ads_status)
+publish_ads = _to_async(utils.publish_ads)
+find_matching_subscribers = _to_async(utils.find_matching_subscribers)
+enqueue_notifications = _to_async(utils.enqueue_notifications)
+claim_notifications = _to_async(utils.claim_notifications)
+mark_notifications_sent = _to_async(utils.mark_notifications_sent)
+reschedule_notification = _to_async(utils.reschedule_notification)
+fail_notification = _to_async(utils.fail_notification)
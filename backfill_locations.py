@@ -0,0 +1,78 @@
+"""Заполнение location_id у существующих объявлений и сохраненных поисков.
+
+Миграция 8 добавляет справочник местоположений (locations, location_aliases)
+и столбцы location_id; новые строки получают id сразу, а старые заполняет эта
+команда. Названия приводятся к виду utils.canonical_location, синонимы берутся
+из location_aliases, недостающие местоположения добавляются в справочник.
+Работает пачками по диапазонам id, каждая пачка - короткая отдельная транзакция,
+поэтому таблицы не блокируются надолго. Повторный запуск безопасен.
+
+Индекс сохраненных поисков строится при старте бота, поэтому после заполнения
+таблицы searches бота нужно перезапустить.
+
+    python backfill_locations.py --batch-rows 5000 --pause 0.1
+"""
+import argparse
+import time
+from database import execute_query, transaction
+from utils import canonical_location
+
+TABLES = ('ads', 'searches')
+
+def backfill_batch(table, first_id, last_id):
+    with transaction() as cur:
+        cur.execute(
+            f"SELECT id, location FROM {table} "
+            "WHERE id BETWEEN %s AND %s AND location_id IS NULL AND location IS NOT NULL FOR UPDATE",
+            (first_id, last_id)
+        )
+        # Канонический вид считается тем же кодом, что и у бота
+        rows = [(row_id, canonical_location(location)) for row_id, location in cur.fetchall()]
+        rows = [(row_id, name) for row_id, name in rows if name]
+        if not rows:
+            return 0
+        ids = [row_id for row_id, _ in rows]
+        names = [name for _, name in rows]
+        cur.execute(
+            "INSERT INTO locations (name) SELECT DISTINCT name FROM unnest(%s::text[]) name "
+            "WHERE NOT EXISTS (SELECT 1 FROM location_aliases WHERE alias = name) "
+            "ON CONFLICT (name) DO NOTHING",
+            (names,)
+        )
+        cur.execute(
+            f"UPDATE {table} t SET location_id = coalesce(a.location_id, l.id) "
+            "FROM unnest(%s::int[], %s::text[]) v (id, name) "
+            "LEFT JOIN location_aliases a ON a.alias = v.name "
+            "LEFT JOIN locations l ON l.name = v.name "
+            "WHERE t.id = v.id",
+            (ids, names)
+        )
+        return cur.rowcount
+
+def backfill_table(table, batch_rows=5000, pause=0, report=None):
+    bounds = execute_query(f"SELECT min(id), max(id) FROM {table}", fetch=True)
+    if not bounds or bounds[0][0] is None:
+        return 0
+    first, last = bounds[0]
+    total = 0
+    for start in range(first, last + 1, batch_rows):
+        end = min(start + batch_rows - 1, last)
+        updated = backfill_batch(table, start, end)
+        total += updated
+        if report:
+            report(f"{table} id {start}-{end}: заполнено {updated}")
+        if pause:
+            time.sleep(pause)
+    return total
+
+def main(args):
+    for table in TABLES:
+        total = backfill_table(table, args.batch_rows, args.pause, report=print)
+        print(f"{table}: заполнено {total}")
+    print("Готово")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-rows', type=int, default=5000, help='строк в одной транзакции')
+    parser.add_argument('--pause', type=float, default=0.1, help='пауза между пачками, секунд')
+    main(parser.parse_args())
@@ -0,0 +1,60 @@
+"""Пропускная способность обработчиков при N одновременных пользователях.
+
+Сравниваются два варианта вызова слоя данных из async-обработчика:
+  sync  - прямой вызов функции utils (как было раньше), блокирует цикл событий;
+  async - вызов через async_db (пул потоков), запросы разных пользователей перекрываются.
+
+По умолчанию запрос к БД моделируется блокирующей задержкой (--latency),
+с флагом --real используется настоящая БД из .env (utils.get_user).
+
+    python -m benchmarks.bench_async_db --users 50 --requests 20
+"""
+import argparse
+import asyncio
+import time
+import async_db
+import utils
+
+def make_query(args):
+    if args.real:
+        return utils.get_user, (args.telegram_id,)
+
+    def fake_query():
+        # Имитация сетевого запроса psycopg2: поток блокируется на время ответа
+        time.sleep(args.latency / 1000)
+        return (1,)
+    return fake_query, ()
+
+async def run_users(args, call):
+    async def user():
+        for _ in range(args.requests):
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(args.users)))
+    return time.perf_counter() - start
+
+async def main(args):
+    func, params = make_query(args)
+
+    async def call_sync():
+        func(*params)
+
+    async def call_async():
+        await async_db.run_db(func, *params)
+
+    total = args.users * args.requests
+    for name, call in (('sync', call_sync), ('async', call_async)):
+        elapsed = await run_users(args, call)
+        print(f"{name:5} | users={args.users} requests={total} "
+              f"time={elapsed:.2f}s throughput={total / elapsed:.1f} req/s")
+    async_db.shutdown_executor()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20, help='запросов на пользователя')
+    parser.add_argument('--latency', type=float, default=5.0, help='задержка имитируемого запроса, мс')
+    parser.add_argument('--real', action='store_true', help='использовать БД из .env')
+    parser.add_argument('--telegram-id', type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+"""Импорт каталога: COPY через временную таблицу против построчного создания объявлений.
+
+Генерирует CSV партнера на --rows строк, загружает его catalog_io.import_catalog и
+сравнивает скорость с прежним способом (utils.create_user + utils.create_ad на каждую
+строку, --baseline-rows строк). Затем выгружает каталог catalog_io.export_catalog;
+для импорта и экспорта печатается прирост пикового RSS процесса.
+
+    python -m benchmarks.bench_catalog_io --rows 1000000 --start-postgres
+"""
+import os
+import csv
+import time
+import random
+import argparse
+import resource
+import tempfile
+import utils
+from catalog_io import IMPORT_FIELDS, import_catalog, export_catalog
+from benchmarks.common import (use_bench_schema, drop_bench_schema, start_local_postgres,
+                               ITEMS, ADJECTIVES, CITIES)
+
+def max_rss_mb():
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def write_partner_file(path, rows, users, first_telegram_id=10_000_000):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(IMPORT_FIELDS)
+        for i in range(rows):
+            telegram_id = first_telegram_id + random.randrange(users)
+            writer.writerow((telegram_id, f'partner{telegram_id}', 'Имя', 'Фамилия',
+                             f"{random.choice(ITEMS).capitalize()} {random.choice(ADJECTIVES)} #{i}",
+                             random.randrange(100, 20000), random.choice(CITIES), f'@partner{telegram_id}',
+                             'active'))
+
+def baseline_import(rows, users, first_telegram_id=20_000_000):
+    # Как импорт шел бы через функции бота: запрос на пользователя и на объявление
+    for i in range(rows):
+        telegram_id = first_telegram_id + random.randrange(users)
+        user_id = utils.create_user(telegram_id, f'partner{telegram_id}', 'Имя', 'Фамилия')
+        utils.create_ad(user_id, f"{random.choice(ITEMS).capitalize()} {random.choice(ADJECTIVES)} #{i}",
+                        random.randrange(100, 20000), random.choice(CITIES), f'@partner{telegram_id}')
+
+def main(args):
+    random.seed(args.seed)
+    stop_postgres = start_local_postgres() if args.start_postgres else None
+    workdir = tempfile.mkdtemp(prefix='bench_catalog_io_')
+    source = os.path.join(workdir, 'partner.csv')
+    target = os.path.join(workdir, 'export.csv')
+    try:
+        write_partner_file(source, args.rows, args.users)
+        print(f"Файл партнера: {args.rows} строк, {os.path.getsize(source) / 2**20:.1f} МБ")
+        use_bench_schema('bench_catalog_io')
+        try:
+            utils.init_db()
+
+            if args.baseline_rows:
+                started = time.perf_counter()
+                baseline_import(args.baseline_rows, args.users)
+                elapsed = time.perf_counter() - started
+                print(f"{'create_ad по строке':<24} {args.baseline_rows / elapsed:>10.0f} строк/с")
+
+            rss = max_rss_mb()
+            started = time.perf_counter()
+            with open(source, encoding='utf-8', newline='') as f:
+                stats = import_catalog(f, 'csv')
+            elapsed = time.perf_counter() - started
+            print(f"{'COPY import_catalog':<24} {stats['imported'] / elapsed:>10.0f} строк/с "
+                  f"({elapsed:.1f} с, RSS +{max_rss_mb() - rss:.1f} МБ)")
+
+            rss = max_rss_mb()
+            started = time.perf_counter()
+            with open(target, 'w', encoding='utf-8', newline='') as f:
+                count = export_catalog(f, 'csv', batch_size=args.batch_size)
+            elapsed = time.perf_counter() - started
+            print(f"{'export_catalog':<24} {count / elapsed:>10.0f} строк/с "
+                  f"({elapsed:.1f} с, RSS +{max_rss_mb() - rss:.1f} МБ)")
+        finally:
+            drop_bench_schema('bench_catalog_io')
+    finally:
+        for path in (source, target):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(workdir)
+        if stop_postgres:
+            stop_postgres()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000, help='разных владельцев в файле')
+    parser.add_argument('--baseline-rows', type=int, default=2000, help='строк для построчного импорта (0 - пропустить)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='строк в пачке при экспорте')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--start-postgres', action='store_true', help='поднять временный кластер (initdb/pg_ctl)')
+    main(parser.parse_args())
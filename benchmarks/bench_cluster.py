@@ -0,0 +1,75 @@
+"""Пропускная способность кластера: один процесс приема и N рабочих процессов.
+
+Бот работает с локальной подделкой Bot API (benchmarks/fake_bot_api.py).
+Обработчик имитирует тяжелую работу на CPU (--work-ms), обновления идут
+пачкой от --users разных пользователей; главный процесс получает их через getUpdates.
+Замеряется время до получения всех ответов. Прирост от числа процессов
+ограничен числом ядер машины.
+
+    python -m benchmarks.bench_cluster --updates 400 --workers 1 2 4
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+import functools
+import hashlib
+from telegram.ext import Application, MessageHandler, filters
+import cluster
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+async def cpu_bound_reply(update, context):
+    deadline = time.perf_counter() + context.bot_data['work_ms'] / 1000
+    digest = update.message.text.encode()
+    while time.perf_counter() < deadline:
+        digest = hashlib.sha256(digest).digest()
+    await update.message.reply_text(update.message.text)
+
+def bench_application(token, base_url, work_ms, index):
+    # Создается в рабочем процессе
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    application = Application.builder().token(token).base_url(base_url).build()
+    application.bot_data['work_ms'] = work_ms
+    application.add_handler(MessageHandler(filters.TEXT, cpu_bound_reply))
+    return application
+
+async def measure(workers, args):
+    api = await FakeBotApi().start()
+    factory = functools.partial(bench_application, api.token, api.base_url, args.work_ms)
+    stop = asyncio.Event()
+    task = asyncio.create_task(cluster.serve_cluster(
+        factory, api.token, base_url=api.base_url, workers=workers, url=None, stop_event=stop
+    ))
+    try:
+        # Прогрев: все процессы запущены и ответили
+        for user in range(workers):
+            await api.push_update(command_update(user + 1, 'warmup', user))
+        await api.wait_sent(workers, timeout=60)
+
+        start = time.perf_counter()
+        for i in range(args.updates):
+            await api.push_update(command_update(workers + i + 1, f'message {i}', 1000 + i % args.users))
+        await api.wait_sent(workers + args.updates, timeout=300)
+        return time.perf_counter() - start
+    finally:
+        stop.set()
+        await task
+        await api.stop()
+
+async def main(args):
+    print(f"ядер: {os.cpu_count()}, обновлений: {args.updates}, работа: {args.work_ms} мс")
+    base = None
+    for workers in args.workers:
+        elapsed = await measure(workers, args)
+        base = base or elapsed
+        print(f"{workers:>3} процесс(ов): {args.updates / elapsed:8.1f} обн/с  ускорение x{base / elapsed:.2f}")
+
+if __name__ == '__main__':
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=400)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--work-ms', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,233 @@
+"""Задержка команд бота на настоящих обработчиках и настоящей PostgreSQL.
+
+Обработчики из handlers.py вызываются с синтетическими обновлениями Telegram,
+ответы бота перехватываются заглушкой, все запросы идут в БД. Для каждой
+команды считаются перцентили задержки и число обращений к серверу БД
+(execute на курсоре). Результат пишется в JSON, чтобы сравнивать коммиты:
+
+    python -m benchmarks.bench_handlers --start-postgres --output before.json
+    python -m benchmarks.bench_handlers --start-postgres --output after.json --baseline before.json
+
+Без --start-postgres используется БД из .env (схема bench пересоздается).
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import subprocess
+import time
+from types import SimpleNamespace
+from telegram import Update, Message, User, Chat
+import async_db
+import database
+import handlers
+import utils
+from benchmarks.common import (
+    CountingCursor, use_bench_schema, drop_bench_schema, seed_catalog, seed_searches,
+    seed_reviews, start_local_postgres, random_keyword, random_city, percentile
+)
+
+ADMIN_USERNAME = 'loginTG'
+FIRST_TELEGRAM_ID = 1000001
+
+class FakeBot:
+    # Ответы бота не уходят в Telegram, а только считаются
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+    async def edit_message_text(self, text, **kwargs):
+        self.sent += 1
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        pass
+
+def make_update(bot, text, telegram_id, username):
+    user = User(id=telegram_id, first_name='Bench', is_bot=False, username=username)
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=telegram_id, type='private'),
+                      text=text, from_user=user)
+    message.set_bot(bot)
+    return Update(update_id=1, message=message)
+
+def make_context(bot):
+    return SimpleNamespace(bot=bot, user_data={}, chat_data={})
+
+async def submit_ad_scenario(bot, n):
+    telegram_id = FIRST_TELEGRAM_ID + n
+    context = make_context(bot)
+    steps = [
+        (handlers.submit_ad, '/submit_ad'),
+        (handlers.submit_ad_title, f'{random_keyword()} бенчмарк {n}'),
+        (handlers.submit_ad_price, str(random.randint(100, 20000))),
+        (handlers.submit_ad_location, random_city()),
+        (handlers.submit_ad_contact, f'@bench{n}'),
+        (handlers.submit_ad_confirm, '/confirm'),
+    ]
+    for handler, text in steps:
+        await handler(make_update(bot, text, telegram_id, f'user{n}'), context)
+
+async def search_scenario(bot, n):
+    telegram_id = FIRST_TELEGRAM_ID + n
+    context = make_context(bot)
+    steps = [
+        (handlers.search_ads, '/search_ads'),
+        (handlers.search_ads_filters, '12'),
+        (handlers.search_ads_keyword, random_keyword()),
+        # Последний фильтр запускает perform_search
+        (handlers.search_ads_location, random_city()),
+    ]
+    for handler, text in steps:
+        await handler(make_update(bot, text, telegram_id, f'user{n}'), context)
+
+async def search_price_scenario(bot, n):
+    # Поиск по диапазону цены (индекс ads_active_price_idx)
+    telegram_id = FIRST_TELEGRAM_ID + n
+    context = make_context(bot)
+    low = random.randint(1, 190) * 100
+    steps = [
+        (handlers.search_ads, '/search_ads'),
+        (handlers.search_ads_filters, '3'),
+        (handlers.search_ads_price, f'{low}-{low + 500}'),
+    ]
+    for handler, text in steps:
+        await handler(make_update(bot, text, telegram_id, f'user{n}'), context)
+
+async def add_ad_scenario(bot, n, ad_ids):
+    # add_ad публикует объявления и ставит уведомления владельцам и подписчикам в очередь
+    text = '/add ' + utils.format_ad_ids(ad_ids).replace(' ', '')
+    await handlers.add_ad(make_update(bot, text, 1, ADMIN_USERNAME), make_context(bot))
+
+async def reviews_bot_scenario(bot, n):
+    # Сводка из review_aggregates и первая страница отзывов о боте
+    telegram_id = FIRST_TELEGRAM_ID + n
+    await handlers.reviews_bot(make_update(bot, '/reviews_bot', telegram_id, f'user{n}'), make_context(bot))
+
+async def reviews_content_scenario(bot, n):
+    await handlers.reviews_content(make_update(bot, '/reviews_content', 1, ADMIN_USERNAME), make_context(bot))
+
+def moderation_queue(count):
+    # Объявления, которые будет публиковать команда /add
+    rows = database.execute_query(
+        "UPDATE ads SET status = 'moderation' WHERE id IN ("
+        "    SELECT id FROM ads WHERE status = 'rejected' ORDER BY id LIMIT %s"
+        ") RETURNING id",
+        (count,), fetch=True
+    )
+    return sorted(row[0] for row in rows)
+
+async def measure(name, scenario, args, bot, ad_ids=None):
+    timings, round_trips = [], []
+    for n in range(args.warmup + args.iterations):
+        if args.cold:
+            utils.search_cache.clear()
+            utils.user_cache.clear()
+        extra = (ad_ids.pop(0),) if ad_ids is not None else ()
+        CountingCursor.round_trips = 0
+        start = time.perf_counter()
+        await scenario(bot, n % args.users, *extra)
+        elapsed = (time.perf_counter() - start) * 1000
+        if n >= args.warmup:
+            timings.append(elapsed)
+            round_trips.append(CountingCursor.round_trips)
+    result = {
+        'iterations': len(timings),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'round_trips_mean': round(sum(round_trips) / len(round_trips), 2),
+        'round_trips_max': max(round_trips),
+    }
+    print(f"{name:16} | p50={result['p50_ms']:8.2f} ms | p95={result['p95_ms']:8.2f} ms | "
+          f"p99={result['p99_ms']:8.2f} ms | round-trips={result['round_trips_mean']:6.2f}")
+    return result
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline_path} ({baseline.get('commit')}):")
+    for name, current in results.items():
+        before = baseline['commands'].get(name)
+        if not before:
+            continue
+        change = (current['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+        print(f"{name:16} | p50 {before['p50_ms']:8.2f} -> {current['p50_ms']:8.2f} ms ({change:+.1f}%) | "
+              f"round-trips {before['round_trips_mean']:6.2f} -> {current['round_trips_mean']:6.2f}")
+
+async def run(args):
+    bot = FakeBot()
+    # /add пачками по --batch объявлений; замеров меньше, чтобы хватило объявлений
+    batch_args = argparse.Namespace(**{**vars(args), 'iterations': max(args.iterations // 10, 1), 'warmup': 1})
+    single = args.warmup + args.iterations
+    batches = batch_args.warmup + batch_args.iterations
+    ad_ids = moderation_queue(single + batches * args.batch)
+    if len(ad_ids) < single + batches * args.batch:
+        raise SystemExit("Недостаточно объявлений для /add: увеличьте --ads")
+    single_ids = [[ad_id] for ad_id in ad_ids[:single]]
+    batch_ids = [ad_ids[single + i * args.batch:single + (i + 1) * args.batch] for i in range(batches)]
+    return {
+        'submit_ad': await measure('submit_ad', submit_ad_scenario, args, bot),
+        'search_ads': await measure('search_ads', search_scenario, args, bot),
+        'search_price': await measure('search_price', search_price_scenario, args, bot),
+        'add_ad': await measure('add_ad', add_ad_scenario, args, bot, single_ids),
+        f'add_ad_x{args.batch}': await measure(f'add_ad_x{args.batch}', add_ad_scenario, batch_args, bot, batch_ids),
+        'reviews_bot': await measure('reviews_bot', reviews_bot_scenario, args, bot),
+        'reviews_content': await measure('reviews_content', reviews_content_scenario, args, bot),
+    }
+
+def main(args):
+    random.seed(args.seed)
+    stop_postgres = start_local_postgres() if args.start_postgres else None
+    try:
+        use_bench_schema('bench_handlers', cursor_factory=CountingCursor)
+        try:
+            utils.init_db()
+            seed_catalog(args.ads, users=args.users, active_share=0.5)
+            seed_searches(args.searches)
+            seed_reviews(args.reviews)
+            database.execute_query("ANALYZE")
+            utils.build_search_index()
+            results = asyncio.run(run(args))
+        finally:
+            async_db.shutdown_executor()
+            drop_bench_schema('bench_handlers')
+    finally:
+        if stop_postgres:
+            stop_postgres()
+
+    output = {
+        'commit': current_commit(),
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'commands': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты записаны в {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--ads', type=int, default=20000)
+    parser.add_argument('--searches', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=3000)
+    parser.add_argument('--iterations', type=int, default=200, help='замеров на команду')
+    parser.add_argument('--warmup', type=int, default=10, help='прогонов без замера')
+    parser.add_argument('--batch', type=int, default=50, help='объявлений в одной команде /add')
+    parser.add_argument('--cold', action='store_true', help='очищать кэши перед каждым прогоном')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--start-postgres', action='store_true', help='поднять временный кластер (initdb/pg_ctl)')
+    parser.add_argument('--output', default='bench_handlers.json')
+    parser.add_argument('--baseline', help='JSON предыдущего запуска для сравнения')
+    main(parser.parse_args())
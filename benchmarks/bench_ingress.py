@@ -0,0 +1,70 @@
+"""Задержка доставки обновлений: long polling против вебхука.
+
+Бот работает с локальной подделкой Bot API (benchmarks/fake_bot_api.py).
+Замеряется время от появления обновления /help на стороне "Telegram" до
+получения ответа бота (sendMessage). Обновления отправляются по одному.
+
+    python -m benchmarks.bench_ingress --updates 300
+"""
+import argparse
+import asyncio
+import logging
+import time
+from telegram.ext import Application, CommandHandler
+import webhook
+from handlers import help_command
+from benchmarks.common import report
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+def build_application(api):
+    application = Application.builder().token(api.token).base_url(api.base_url).build()
+    application.add_handler(CommandHandler("help", help_command))
+    return application
+
+async def measure(api, count):
+    timings = []
+    for i in range(count):
+        start = time.perf_counter()
+        await api.push_update(command_update(len(api.sent) + 1, '/help', 1000 + i % 50))
+        await api.wait_sent(len(api.sent) + 1)
+        timings.append((api.sent[-1][0] - start) * 1000)
+    return timings
+
+async def bench_polling(args):
+    api = await FakeBotApi().start()
+    application = build_application(api)
+    await application.initialize()
+    await application.start()
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    try:
+        return await measure(api, args.updates)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+
+async def bench_webhook(args):
+    api = await FakeBotApi().start()
+    application = build_application(api)
+    stop = asyncio.Event()
+    task = asyncio.create_task(webhook.serve(application, host='127.0.0.1', port=0, secret='bench', stop_event=stop))
+    while not api.webhook_url:
+        await asyncio.sleep(0.01)
+    try:
+        return await measure(api, args.updates)
+    finally:
+        stop.set()
+        await task
+        await api.stop()
+
+async def main(args):
+    for name, bench in (('polling', bench_polling), ('webhook', bench_webhook)):
+        report(name, await bench(args))
+
+if __name__ == '__main__':
+    # Каждый запрос к Bot API иначе пишется в лог
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=300)
+    asyncio.run(main(parser.parse_args()))
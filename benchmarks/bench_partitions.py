@@ -0,0 +1,116 @@
+"""Запросы к активным объявлениям при растущей истории отклоненных.
+
+Заполняет каталог активными объявлениями (--ads) и очередью модерации, затем
+ступенями добавляет отклоненные объявления (--history - общее число на ступени)
+и на каждой ступени замеряет запросы бота: задержку и число прочитанных страниц
+(EXPLAIN BUFFERS). После секционирования ads по статусу (миграция 11) эти числа
+не растут вместе с историей. В конце история переносится в ads_archive
+(archive_ads.py) и печатается скорость переноса.
+
+    python -m benchmarks.bench_partitions --ads 100000 --history 0 500000 2000000 --start-postgres
+"""
+import time
+import random
+import argparse
+import utils
+from database import execute_query
+from archive_ads import archive_rejected
+from benchmarks.common import (use_bench_schema, drop_bench_schema, seed_catalog, start_local_postgres,
+                               random_keyword, timed, percentile, ITEMS, ADJECTIVES, CITIES)
+
+NEWEST_ACTIVE = "SELECT id FROM ads WHERE status = 'active' ORDER BY created_at DESC, id DESC LIMIT 6"
+MODERATION = "SELECT id FROM ads WHERE status = 'moderation' ORDER BY id LIMIT 21"
+
+def add_history(rows, users):
+    # Отклоненные год назад объявления, похожие на каталог
+    items = "ARRAY[" + ", ".join(f"'{w}'" for w in ITEMS) + "]"
+    adjectives = "ARRAY[" + ", ".join(f"'{w}'" for w in ADJECTIVES) + "]"
+    cities = "ARRAY[" + ", ".join(f"'{w}'" for w in CITIES) + "]"
+    execute_query(
+        f"""
+        INSERT INTO ads (user_id, title, price, location, contact, status, created_at, updated_at)
+        SELECT
+            (SELECT min(id) FROM users) + (g % %s),
+            ({items})[1 + (g * 3) % {len(ITEMS)}] || ' ' || ({adjectives})[1 + (g * 5) % {len(ADJECTIVES)}],
+            100 + (g * 41) % 20000,
+            ({cities})[1 + (g * 11) % {len(CITIES)}],
+            '@old' || g,
+            'rejected',
+            CURRENT_TIMESTAMP - INTERVAL '400 days',
+            CURRENT_TIMESTAMP - INTERVAL '365 days'
+        FROM generate_series(1, %s) g
+        """,
+        (users, rows)
+    )
+    execute_query("ANALYZE ads")
+
+def pages_read(query):
+    # Прочитанные страницы (из кэша и с диска) по всему плану
+    plan = execute_query("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, fetch=True)[0][0][0]['Plan']
+    return plan['Shared Hit Blocks'] + plan['Shared Read Blocks']
+
+def measure(repeat):
+    def search_keyword():
+        # Кэш поиска сбрасывается, иначе замерялся бы он, а не БД
+        utils.search_cache.clear()
+        utils.search_ads_page(keyword=random_keyword())
+
+    def search_newest():
+        utils.search_cache.clear()
+        utils.search_ads_page()
+
+    return {
+        'search_keyword': percentile(timed(search_keyword, repeat=repeat), 50),
+        'search_newest': percentile(timed(search_newest, repeat=repeat), 50),
+        'moderation': percentile(timed(utils.get_ads_for_moderation, utils.MODERATION_PAGE_SIZE + 1,
+                                       repeat=repeat), 50),
+        'pages_newest': pages_read(NEWEST_ACTIVE),
+        'pages_moderation': pages_read(MODERATION),
+    }
+
+def main(args):
+    random.seed(args.seed)
+    stop_postgres = start_local_postgres() if args.start_postgres else None
+    try:
+        use_bench_schema('bench_partitions')
+        try:
+            utils.init_db()
+            seed_catalog(args.ads, users=args.users, active_share=1.0)
+            execute_query("UPDATE ads SET status = 'moderation' WHERE id %% %s = 0", (args.moderation_every,))
+            execute_query("ANALYZE ads")
+
+            print(f"Активных объявлений: ~{args.ads}; p50 в мс, страниц - по EXPLAIN BUFFERS")
+            print(f"{'отклоненных':>12} | {'поиск слова':>11} | {'новые':>8} | {'модерация':>9} | "
+                  f"{'стр. новые':>10} | {'стр. модер.':>11}")
+            history = 0
+            for target in sorted(args.history):
+                if target > history:
+                    add_history(target - history, args.users)
+                    history = target
+                result = measure(args.repeat)
+                print(f"{history:>12} | {result['search_keyword']:>11.2f} | {result['search_newest']:>8.2f} | "
+                      f"{result['moderation']:>9.2f} | {result['pages_newest']:>10} | {result['pages_moderation']:>11}")
+
+            if history:
+                started = time.perf_counter()
+                moved = archive_rejected(older_than_days=30, batch_rows=args.archive_batch)
+                elapsed = time.perf_counter() - started
+                print(f"\nВ архив перенесено {moved} объявлений: {moved / elapsed:.0f} строк/с")
+        finally:
+            drop_bench_schema('bench_partitions')
+    finally:
+        if stop_postgres:
+            stop_postgres()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ads', type=int, default=100000, help='активных объявлений')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--history', type=int, nargs='+', default=[0, 500000, 2000000],
+                        help='отклоненных объявлений на каждой ступени')
+    parser.add_argument('--moderation-every', type=int, default=50, help='каждое N-е объявление - на модерации')
+    parser.add_argument('--archive-batch', type=int, default=5000, help='строк в пачке переноса в архив')
+    parser.add_argument('--repeat', type=int, default=50, help='замеров на запрос')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--start-postgres', action='store_true', help='поднять временный кластер (initdb/pg_ctl)')
+    main(parser.parse_args())
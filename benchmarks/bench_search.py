@@ -0,0 +1,63 @@
+"""Поиск объявлений: ILIKE по всей таблице против индексированного полнотекстового поиска.
+
+Создает схему bench в БД из .env, заполняет синтетический каталог и сравнивает
+прежний запрос (title ILIKE '%kw%' OR location ILIKE '%kw%') с utils.search_ads_in_db.
+
+    python -m benchmarks.bench_search --ads 300000
+"""
+import argparse
+import random
+import utils
+from database import execute_query
+from benchmarks.common import (use_bench_schema, drop_bench_schema, seed_catalog,
+                               random_keyword, random_city, timed, report)
+
+def legacy_search(keyword=None, location=None):
+    # Запрос в том виде, в каком он был до полнотекстового поиска
+    query = "SELECT * FROM ads WHERE status = 'active'"
+    params = []
+    if keyword:
+        query += " AND (title ILIKE %s OR location ILIKE %s)"
+        params.extend([f'%{keyword}%', f'%{keyword}%'])
+    if location:
+        query += " AND location ILIKE %s"
+        params.append(f'%{location}%')
+    return execute_query(query, params, fetch=True)
+
+def main(args):
+    random.seed(args.seed)
+    use_bench_schema()
+    try:
+        utils.init_db()
+        seed_catalog(args.ads)
+        print(f"Каталог: {args.ads} объявлений")
+
+        keywords = [random_keyword() for _ in range(args.repeat)]
+        cities = [random_city() for _ in range(args.repeat)]
+
+        def run(func, with_city):
+            calls = iter(zip(keywords, cities))
+
+            def call():
+                keyword, city = next(calls)
+                func(keyword=keyword, location=city if with_city else None)
+            return timed(call, repeat=args.repeat)
+
+        report("ILIKE keyword", run(legacy_search, False))
+        report("FTS keyword", run(utils.search_ads_in_db, False))
+        report("ILIKE keyword+location", run(legacy_search, True))
+        report("FTS keyword+location", run(utils.search_ads_in_db, True))
+
+        # Морфология: прежний поиск не находит "платья" по слову "платье"
+        legacy = legacy_search(keyword='платье') or []
+        fts = utils.search_ads_in_db(keyword='платье') or []
+        print(f"Найдено по 'платье': ILIKE={len(legacy)}, FTS={len(fts)}")
+    finally:
+        drop_bench_schema()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ads', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
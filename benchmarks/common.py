@@ -0,0 +1,205 @@
+"""Общие функции бенчмарков: отдельная схема БД и синтетические данные."""
+import os
+import glob
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import psycopg2
+import psycopg2.extensions
+import database
+import utils
+from backfill_locations import backfill_table
+
+# Словари для синтетического каталога
+ITEMS = ['платье', 'платья', 'костюм', 'пиджак', 'куртка', 'пальто', 'смокинг', 'юбка',
+         'блузка', 'рубашка', 'брюки', 'джинсы', 'шуба', 'жилет', 'свитер', 'кардиган']
+ADJECTIVES = ['вечернее', 'свадебное', 'летнее', 'зимнее', 'кожаная', 'шерстяной',
+              'классический', 'праздничный', 'детский', 'мужской', 'женский', 'новое']
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара',
+          'Нижний Новгород', 'Ростов-на-Дону', 'Краснодар', 'Воронеж', 'Пермь', 'Уфа']
+
+class CountingCursor(psycopg2.extensions.cursor):
+    # Считает обращения к серверу: каждый execute - один сетевой обмен
+    round_trips = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.round_trips += 1
+        return super().execute(query, vars)
+
+def bench_connect(schema='bench', cursor_factory=None):
+    # Функция подключения к отдельной схеме бенчмарка
+    def connect():
+        return psycopg2.connect(
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST'),
+            port=os.getenv('DB_PORT'),
+            options=f'-c search_path={schema},public',
+            application_name=database.application_name(),
+            cursor_factory=cursor_factory
+        )
+    return connect
+
+def use_bench_schema(schema='bench', cursor_factory=None, **pool_kwargs):
+    # Все запросы бенчмарка идут в отдельную схему, рабочие таблицы не затрагиваются
+    connect = bench_connect(schema, cursor_factory)
+    conn = connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        cur.execute(f"CREATE SCHEMA {schema}")
+    conn.close()
+    # Кэши процесса относятся к прежней схеме
+    for cache in (utils.user_cache, utils.location_cache, utils.search_cache):
+        cache.clear()
+    return database.init_pool(connect=connect, **pool_kwargs)
+
+def drop_bench_schema(schema='bench'):
+    database.execute_query(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    database.close_pool()
+
+def seed_catalog(ads, users=1000, active_share=0.8):
+    # Каталог генерируется на стороне сервера одним INSERT ... SELECT
+    items = "ARRAY[" + ", ".join(f"'{w}'" for w in ITEMS) + "]"
+    adjectives = "ARRAY[" + ", ".join(f"'{w}'" for w in ADJECTIVES) + "]"
+    cities = "ARRAY[" + ", ".join(f"'{w}'" for w in CITIES) + "]"
+    database.execute_query(
+        "INSERT INTO users (telegram_id, username, first_name, last_name) "
+        "SELECT 1000000 + g, 'user' || g, 'Имя', 'Фамилия' FROM generate_series(1, %s) g",
+        (users,)
+    )
+    database.execute_query(
+        f"""
+        INSERT INTO ads (user_id, title, price, location, contact, status)
+        SELECT
+            (SELECT min(id) FROM users) + (g % %s),
+            ({items})[1 + (g * 7) % {len(ITEMS)}] || ' ' || ({adjectives})[1 + (g * 13) % {len(ADJECTIVES)}],
+            100 + (g * 37) % 20000,
+            ({cities})[1 + (g * 11) % {len(CITIES)}],
+            '@owner' || g,
+            CASE WHEN random() < %s THEN 'active' ELSE 'rejected' END
+        FROM generate_series(1, %s) g
+        """,
+        (users, active_share, ads)
+    )
+    backfill_table('ads', batch_rows=50000)
+    database.execute_query("ANALYZE")
+
+def seed_searches(searches, keyword_share=0.7):
+    # Сохраненные поиски: ключевое слово, город и/или диапазон цен
+    items = "ARRAY[" + ", ".join(f"'{w}'" for w in ITEMS) + "]"
+    cities = "ARRAY[" + ", ".join(f"'{w.lower()}'" for w in CITIES) + "]"
+    database.execute_query(
+        f"""
+        INSERT INTO searches (user_id, keyword, location, min_price, max_price, created_at)
+        SELECT
+            u.id,
+            CASE WHEN random() < %s THEN ({items})[1 + (g * 5) % {len(ITEMS)}] END,
+            CASE WHEN g % 3 = 0 THEN ({cities})[1 + (g * 7) % {len(CITIES)}] END,
+            CASE WHEN g % 4 = 0 THEN (g * 31) % 10000 END,
+            CASE WHEN g % 4 = 0 THEN (g * 31) % 10000 + 500 + g % 7 END,
+            CURRENT_TIMESTAMP - g * INTERVAL '1 second'
+        FROM generate_series(1, %s) g
+        JOIN LATERAL (SELECT min(id) + g % (max(id) - min(id) + 1) AS id FROM users) u ON true
+        ON CONFLICT DO NOTHING
+        """,
+        (keyword_share, searches)
+    )
+    backfill_table('searches', batch_rows=50000)
+
+def seed_reviews(reviews):
+    # Отзывы о боте, о товарах и жалобы на контент
+    database.execute_query(
+        """
+        INSERT INTO reviews (user_id, type, ad_id, text)
+        SELECT
+            u.id,
+            (ARRAY['bot', 'ad', 'content'])[1 + g % 3],
+            CASE WHEN g % 3 = 1 THEN a.id END,
+            'Отзыв номер ' || g
+        FROM generate_series(1, %s) g
+        JOIN LATERAL (SELECT min(id) + g % (max(id) - min(id) + 1) AS id FROM users) u ON true
+        JOIN LATERAL (SELECT min(id) + g % (max(id) - min(id) + 1) AS id FROM ads) a ON true
+        """,
+        (reviews,)
+    )
+    # Отзывы вставлены в обход create_review, поэтому сводка пересчитывается целиком
+    database.execute_query(
+        """
+        INSERT INTO review_aggregates (type, ad_id, review_count, last_review_at)
+        SELECT type, coalesce(ad_id, 0), count(*), max(created_at) FROM reviews GROUP BY 1, 2
+        ON CONFLICT (type, ad_id) DO UPDATE
+        SET review_count = EXCLUDED.review_count, last_review_at = EXCLUDED.last_review_at
+        """
+    )
+
+def _find_pg_binary(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f'/usr/lib/postgresql/*/bin/{name}'))
+    if candidates:
+        return candidates[-1]
+    raise RuntimeError(f"Не найдена программа {name}: установите PostgreSQL")
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_local_postgres():
+    # Временный кластер PostgreSQL для бенчмарка; переменные DB_* указывают на него.
+    # Возвращает функцию остановки, которая удаляет кластер.
+    workdir = tempfile.mkdtemp(prefix='bench_pg_')
+    data = os.path.join(workdir, 'data')
+    port = _free_port()
+    subprocess.run(
+        [_find_pg_binary('initdb'), '-D', data, '-U', 'bench', '--auth=trust',
+         '-E', 'UTF8', '--locale=C.UTF-8'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    subprocess.run(
+        [_find_pg_binary('pg_ctl'), '-D', data, '-l', os.path.join(workdir, 'postgres.log'), '-w',
+         '-o', f"-p {port} -k {workdir} -c listen_addresses=''", 'start'],
+        check=True, stdout=subprocess.DEVNULL
+    )
+    os.environ.update({'DB_NAME': 'postgres', 'DB_USER': 'bench', 'DB_PASSWORD': '',
+                       'DB_HOST': workdir, 'DB_PORT': str(port)})
+
+    def stop():
+        database.close_pool()
+        subprocess.run([_find_pg_binary('pg_ctl'), '-D', data, '-m', 'fast', '-w', 'stop'],
+                       check=False, stdout=subprocess.DEVNULL)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return stop
+
+def random_keyword():
+    return random.choice(ITEMS)
+
+def random_city():
+    return random.choice(CITIES)
+
+def timed(func, *args, repeat=20, **kwargs):
+    # Возвращает список длительностей вызова в миллисекундах
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def report(name, timings):
+    print(f"{name:28} | p50={percentile(timings, 50):8.2f} ms | "
+          f"p95={percentile(timings, 95):8.2f} ms | max={max(timings):8.2f} ms")
@@ -0,0 +1,138 @@
+"""Локальная подделка Telegram Bot API для тестов и бенчмарков.
+
+Отвечает на запросы бота (getMe, getUpdates, setWebhook, sendMessage, ...) и
+доставляет синтетические обновления либо через getUpdates (long polling), либо
+POST-запросом на установленный вебхук. Бот подключается через
+Application.builder().base_url(fake.base_url).
+"""
+import json
+import time
+import asyncio
+from urllib.parse import parse_qsl
+import httpx
+from http_server import HttpServer
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+def command_update(update_id, text, user_id, username='bench_user'):
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': username},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}] if text.startswith('/') else [],
+        },
+    }
+
+def _params(request):
+    # PTB отправляет параметры формой, нетекстовые значения сериализованы в JSON
+    if request.headers.get('content-type', '').startswith('application/json'):
+        return json.loads(request.body or b'{}')
+    params = {}
+    for key, value in parse_qsl(request.body.decode()):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+class FakeBotApi:
+    def __init__(self, host='127.0.0.1', port=0, token='123:bench'):
+        self.token = token
+        self.http = HttpServer(self._handle, host, port)
+        self.updates = []
+        self.sent = []              # (время получения, chat_id, text)
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_rejected = 0
+        self._changed = asyncio.Condition()
+        self._message_id = 0
+        self._client = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.http.host}:{self.http.port}/bot"
+
+    async def start(self):
+        await self.http.start()
+        self._client = httpx.AsyncClient()
+        return self
+
+    async def stop(self):
+        await self._client.aclose()
+        await self.http.stop()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    # ===== Доставка обновлений боту =====
+    async def push_update(self, update):
+        if self.webhook_url:
+            response = await self._client.post(
+                self.webhook_url, json=update,
+                headers={'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret or ''}
+            )
+            if response.status_code != 200:
+                self.webhook_rejected += 1
+            return response.status_code
+        self.updates.append(update)
+        await self._notify()
+        return 200
+
+    async def wait_sent(self, count, timeout=10):
+        # Ждет, пока бот отправит count сообщений
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(lambda: len(self.sent) >= count), timeout)
+
+    # ===== Методы Bot API =====
+    async def _get_updates(self, params):
+        offset = params.get('offset') or 0
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates and params.get('timeout'):
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self.updates), params['timeout'])
+                except asyncio.TimeoutError:
+                    pass
+        return list(self.updates)
+
+    async def _send_message(self, params):
+        self._message_id += 1
+        self.sent.append((time.perf_counter(), params.get('chat_id'), params.get('text')))
+        await self._notify()
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id'), 'type': 'private'},
+            'text': str(params.get('text')),
+        }
+
+    async def _handle(self, request):
+        prefix = f"/bot{self.token}/"
+        if not request.path.startswith(prefix):
+            return 404, json.dumps({'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        method = request.path[len(prefix):]
+        params = _params(request)
+        if method == 'getMe':
+            result = BOT_USER
+        elif method == 'getUpdates':
+            result = await self._get_updates(params)
+        elif method == 'setWebhook':
+            self.webhook_url = params.get('url') or None
+            self.webhook_secret = params.get('secret_token')
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhook_url = None
+            result = True
+        elif method == 'sendMessage':
+            result = await self._send_message(params)
+        elif method in ('answerCallbackQuery', 'editMessageText', 'setMyCommands'):
+            result = True
+        else:
+            return 200, json.dumps({'ok': False, 'error_code': 400, 'description': f'Unknown method {method}'}), 'application/json'
+        return 200, json.dumps({'ok': True, 'result': result}), 'application/json'
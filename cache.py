@@ -0,0 +1,88 @@
+import time
+import threading
+from collections import OrderedDict, Counter
+
+MISSING = object()
+
+class LRUCache:
+    # Потокобезопасный LRU-кэш с необязательным временем жизни записей и
+    # ограничением суммарного размера (размер записи считает функция sizeof).
+    # clear() увеличивает поколение: значение, прочитанное из БД до сброса,
+    # не попадет в кэш после него (set с устаревшим generation игнорируется).
+    def __init__(self, max_entries, ttl=None, max_size=None, sizeof=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.clock = clock
+        self.generation = 0
+        self._data = OrderedDict()   # key -> (value, expires_at, size)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return default
+            value, expires_at, _ = entry
+            if expires_at is not None and expires_at <= self.clock():
+                self._pop(key)
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        size = self.sizeof(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if self.max_size is not None and size > self.max_size:
+                return False
+            if key in self._data:
+                self._pop(key)
+            expires_at = self.clock() + self.ttl if self.ttl else None
+            self._data[key] = (value, expires_at, size)
+            self._size += size
+            while len(self._data) > self.max_entries or (
+                    self.max_size is not None and self._size > self.max_size):
+                oldest = next(iter(self._data))
+                self._pop(oldest)
+                self._stats['evictions'] += 1
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+                self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats['invalidations'] += len(self._data)
+            self._data.clear()
+            self._size = 0
+            self.generation += 1
+
+    def _pop(self, key):
+        _, _, size = self._data.pop(key)
+        self._size -= size
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._data)
+            stats['size'] = self._size
+        return stats
+
+def rows_size(rows):
+    # Приблизительный объем строк результата: сумма длин значений
+    return sum(len(str(column)) for row in rows for column in row) + 64
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import select
+import logging
+import threading
+from collections import Counter
+import database
+import metrics
+import utils
+from search_index import search_index
+
+logger = logging.getLogger(__name__)
+
+# Канал задан в триггерах notify_cache_event (миграция 9)
+CACHE_BUS_CHANNEL = 'cache_events'
+# 0 - шина выключена (например, бот работает в одном процессе и БД больше никто не меняет)
+CACHE_BUS_ENABLED = os.getenv('CACHE_BUS', '1') != '0'
+# Пауза перед повторным подключением после обрыва
+CACHE_BUS_RECONNECT_DELAY = float(os.getenv('CACHE_BUS_RECONNECT_DELAY', 5))
+# Без событий дольше этого времени соединение проверяется через SELECT 1
+CACHE_BUS_HEARTBEAT = float(os.getenv('CACHE_BUS_HEARTBEAT', 30))
+# Сколько при старте ждать подключения шины перед построением индекса поисков
+CACHE_BUS_CONNECT_TIMEOUT = float(os.getenv('CACHE_BUS_CONNECT_TIMEOUT', 10))
+# События поисков, пришедшие до построения индекса, больше которых индекс просто перестраивается
+EARLY_SEARCH_EVENTS_LIMIT = 1000
+
+# События поисков, пришедшие, пока индекс еще не построен; применяются после построения
+_early_searches = []
+_early_lock = threading.Lock()
+
+def apply_event(event):
+    # Событие другого процесса: сбрасываются затронутые кэши этого процесса
+    table = event['table']
+    if table == 'ads':
+        # Кэш поиска зависит только от активных объявлений
+        if event['active']:
+            utils.search_cache.clear()
+    elif table == 'searches':
+        with _early_lock:
+            if search_index.ready:
+                apply_search_event(event)
+            elif len(_early_searches) < EARLY_SEARCH_EVENTS_LIMIT:
+                _early_searches.append(event)
+            else:
+                _early_searches[:] = [{'table': 'searches', 'op': 'update', 'ids': None}]
+    elif table == 'location_aliases':
+        utils.location_cache.clear()
+
+def apply_search_event(event):
+    ids = event['ids']
+    if ids is None:
+        utils.build_search_index()
+    elif event['op'] == 'delete':
+        for search_id in ids:
+            search_index.remove(search_id)
+    else:
+        utils.refresh_search_index(ids)
+
+def build_search_index():
+    # Индекс поисков строится после подключения шины: изменения других процессов,
+    # пришедшие во время построения, применяются к уже готовому индексу
+    with _early_lock:
+        if not utils.build_search_index():
+            return False
+        for event in _early_searches:
+            apply_search_event(event)
+        _early_searches.clear()
+    return True
+
+def flush_caches():
+    # Пока соединения не было, события могли потеряться: сбрасывается все
+    utils.search_cache.clear()
+    utils.location_cache.clear()
+    utils.user_cache.clear()
+    if search_index.ready:
+        utils.build_search_index()
+
+class CacheBus:
+    # Фоновый поток со своим соединением (LISTEN не работает через пул): принимает
+    # события изменений из канала и сбрасывает кэши. После каждого подключения,
+    # в том числе повторного, кэши сбрасываются целиком.
+    def __init__(self, connect=database.get_connection, apply=apply_event, flush=flush_caches,
+                 reconnect_delay=CACHE_BUS_RECONNECT_DELAY, heartbeat=CACHE_BUS_HEARTBEAT, poll_interval=1.0):
+        self._connect = connect
+        self._apply = apply
+        self._flush = flush
+        self.reconnect_delay = reconnect_delay
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self.origin = database.application_name()
+        self.stats = Counter()
+        self.last_lag = 0.0
+        self.connected = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='cache-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CACHE_BUS_CHANNEL}")
+                self._flush()
+                self.stats['flushes'] += 1
+                self.connected.set()
+                self._listen(conn)
+            except Exception as e:
+                self.stats['disconnects'] += 1
+                logger.warning(f"Шина кэшей: соединение потеряно ({e}), повтор через {self.reconnect_delay} с")
+            finally:
+                self.connected.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stopping.wait(self.reconnect_delay)
+
+    def _listen(self, conn):
+        idle_since = time.monotonic()
+        while not self._stopping.is_set():
+            if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                if time.monotonic() - idle_since > self.heartbeat:
+                    # Обрыв без закрытия сокета иначе не заметить
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                    idle_since = time.monotonic()
+                continue
+            conn.poll()
+            idle_since = time.monotonic()
+            while conn.notifies:
+                self.handle(conn.notifies.pop(0).payload)
+
+    def handle(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            self.stats['errors'] += 1
+            logger.error(f"Шина кэшей: некорректное событие {payload[:200]!r}")
+            return
+        self.stats['events'] += 1
+        # Часы БД и процесса могут немного расходиться, поэтому задержка не меньше нуля
+        self.last_lag = max(time.time() - event['at'], 0.0)
+        if metrics.enabled:
+            metrics.cache_bus_lag.observe(self.last_lag)
+        if event.get('origin') == self.origin:
+            # Свои изменения процесс уже учел в момент записи
+            self.stats['skipped'] += 1
+            return
+        try:
+            self._apply(event)
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Шина кэшей: ошибка обработки события {event['table']}: {e}")
+
+    def metrics(self):
+        stats = dict(self.stats)
+        stats['connected'] = int(self.connected.is_set())
+        stats['last_lag_seconds'] = self.last_lag
+        return stats
+
+_bus = None
+
+def start_cache_bus(**kwargs):
+    global _bus
+    if not CACHE_BUS_ENABLED or _bus is not None:
+        return _bus
+    _bus = CacheBus(**kwargs)
+    _bus.start()
+    return _bus
+
+def wait_connected(timeout=CACHE_BUS_CONNECT_TIMEOUT):
+    # До подключения (LISTEN) события других процессов не приходят
+    if _bus is not None and not _bus.connected.wait(timeout):
+        logger.warning(f"Шина кэшей не подключилась за {timeout} с, кэши сбросятся после подключения")
+
+def stop_cache_bus():
+    global _bus
+    if _bus is not None:
+        _bus.stop()
+        _bus = None
+
+def cache_bus_stats():
+    return _bus.metrics() if _bus is not None else {}
@@ -0,0 +1,276 @@
+"""Массовый импорт и потоковый экспорт каталога объявлений.
+
+Импорт читает CSV (с заголовком) или JSONL с полями telegram_id, username,
+first_name, last_name, title, price, location, contact и необязательным status.
+Стоимость и контакт проверяются теми же правилами, что и в диалоге /submit_ad
+(utils.parse_price, utils.is_valid_contact); отклоненные строки с причиной
+пишутся в --rejects. Прошедшие проверку строки загружаются через COPY во
+временную таблицу, после чего владельцы (users), местоположения и объявления
+добавляются одной транзакцией: либо загружается весь файл, либо ничего.
+Подписчики сохраненных поисков об импортированных объявлениях не уведомляются.
+
+Экспорт читает каталог серверным курсором пачками, поэтому память не зависит
+от размера каталога. Формат экспорта совместим с импортом.
+
+    python catalog_io.py import partner.csv --status active --rejects rejects.csv
+    python catalog_io.py export catalog.jsonl --status active
+"""
+import io
+import sys
+import csv
+import json
+import argparse
+from collections import Counter
+from database import get_pool, transaction
+from models import AdStatus
+from utils import parse_price, is_valid_contact, canonical_location
+
+IMPORT_FIELDS = ('telegram_id', 'username', 'first_name', 'last_name',
+                 'title', 'price', 'location', 'contact', 'status')
+EXPORT_FIELDS = ('id',) + IMPORT_FIELDS + ('created_at',)
+
+# Ограничения столбцов users и ads (миграция 1)
+MAX_TEXT_LENGTH = 255
+MAX_CONTACT_LENGTH = 50
+
+# Строк в одной пачке серверного курсора при экспорте
+EXPORT_BATCH_SIZE = 10000
+
+STATUSES = {status.value for status in AdStatus}
+
+STAGING_COLUMNS = ('line', 'telegram_id', 'username', 'first_name', 'last_name',
+                   'title', 'price', 'location', 'location_name', 'contact', 'status')
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+def _text(record, field):
+    value = record.get(field)
+    if value is None:
+        return None
+    return str(value).strip() or None
+
+def validate_record(record, status=AdStatus.MODERATION.value):
+    # (строка для COPY без номера строки, None) или (None, причина отказа)
+    telegram_id = _text(record, 'telegram_id')
+    if telegram_id is None or not telegram_id.isdigit():
+        return None, "telegram_id: ожидается число"
+    names = [_text(record, field) for field in ('username', 'first_name', 'last_name')]
+    if any(name is not None and len(name) > MAX_TEXT_LENGTH for name in names):
+        return None, f"имя пользователя длиннее {MAX_TEXT_LENGTH}"
+    title = _text(record, 'title')
+    if title is None or len(title) > MAX_TEXT_LENGTH:
+        return None, f"title: пусто или длиннее {MAX_TEXT_LENGTH}"
+    price = parse_price(_text(record, 'price'))
+    if price is None:
+        return None, "price: ожидается число"
+    location = _text(record, 'location')
+    if location is None or len(location) > MAX_TEXT_LENGTH:
+        return None, f"location: пусто или длиннее {MAX_TEXT_LENGTH}"
+    location_name = canonical_location(location)
+    if location_name is None:
+        # "г.", "." - в справочнике locations такого названия быть не может
+        return None, "location: нет названия местоположения"
+    contact = _text(record, 'contact')
+    if contact is None or len(contact) > MAX_CONTACT_LENGTH or not is_valid_contact(contact):
+        return None, "contact: телефон 89111111111 или @username"
+    status = _text(record, 'status') or status
+    if status not in STATUSES:
+        return None, f"status: одно из {', '.join(sorted(STATUSES))}"
+    return (int(telegram_id), *names, title, repr(price), location, location_name, contact, status), None
+
+def read_records(stream, fmt):
+    # (номер строки, запись); запись None - строку не удалось разобрать
+    if fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = None
+            yield line, record if isinstance(record, dict) else None
+        return
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+class CopyStream:
+    # Файлоподобный объект для COPY FROM STDIN: строки формируются по мере чтения,
+    # поэтому файл любого размера не загружается в память целиком
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+_CREATE_STAGING = (
+    "CREATE TEMP TABLE ad_import ("
+    "    line INTEGER, telegram_id BIGINT, username TEXT, first_name TEXT, last_name TEXT,"
+    "    title TEXT, price NUMERIC, location TEXT, location_name TEXT, contact TEXT, status TEXT"
+    ") ON COMMIT DROP"
+)
+
+_MERGE_USERS = (
+    # Существующие пользователи не меняются: данные партнера не перезаписывают профиль
+    "INSERT INTO users (telegram_id, username, first_name, last_name) "
+    "SELECT DISTINCT ON (telegram_id) telegram_id, username, first_name, last_name "
+    "FROM ad_import ORDER BY telegram_id, line "
+    "ON CONFLICT (telegram_id) DO NOTHING"
+)
+
+_MERGE_LOCATIONS = (
+    "INSERT INTO locations (name) SELECT DISTINCT location_name FROM ad_import i "
+    "WHERE NOT EXISTS (SELECT 1 FROM location_aliases WHERE alias = i.location_name) "
+    "ON CONFLICT (name) DO NOTHING"
+)
+
+_MERGE_ADS = (
+    "INSERT INTO ads (user_id, title, price, location, location_id, contact, status) "
+    "SELECT u.id, i.title, i.price, i.location, coalesce(a.location_id, l.id), i.contact, i.status "
+    "FROM ad_import i JOIN users u ON u.telegram_id = i.telegram_id "
+    "LEFT JOIN location_aliases a ON a.alias = i.location_name "
+    "LEFT JOIN locations l ON l.name = i.location_name "
+    "ORDER BY i.line"
+)
+
+def import_catalog(stream, fmt='csv', status=AdStatus.MODERATION.value, rejects=None):
+    # rejects - csv.writer для отклоненных строк (номер строки, причина)
+    stats = Counter()
+
+    def staged():
+        for line, record in read_records(stream, fmt):
+            row, error = validate_record(record, status) if record is not None else (None, "строка не разобрана")
+            if error:
+                stats['rejected'] += 1
+                if rejects is not None:
+                    rejects.writerow((line, error))
+                continue
+            stats['staged'] += 1
+            yield (line,) + row
+
+    with transaction() as cur:
+        cur.execute(_CREATE_STAGING)
+        cur.copy_expert(
+            f"COPY ad_import ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            CopyStream(_csv_lines(staged()))
+        )
+        # У временной таблицы нет статистики, без нее соединения планируются вслепую
+        cur.execute("ANALYZE ad_import")
+        cur.execute(_MERGE_USERS)
+        stats['users_created'] = cur.rowcount
+        cur.execute(_MERGE_LOCATIONS)
+        stats['locations_created'] = cur.rowcount
+        cur.execute(_MERGE_ADS)
+        stats['imported'] = cur.rowcount
+    return stats
+
+_EXPORT_QUERY = (
+    "SELECT a.id, u.telegram_id, u.username, u.first_name, u.last_name, "
+    "a.title, a.price, a.location, a.contact, a.status, a.created_at "
+    "FROM ads a JOIN users u ON u.id = a.user_id"
+)
+
+def _export_value(value):
+    if value is None or isinstance(value, (int, str)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    # NUMERIC (Decimal): в JSON - число
+    return float(value)
+
+def export_catalog(out, fmt='csv', status=None, batch_size=EXPORT_BATCH_SIZE):
+    query = _EXPORT_QUERY
+    params = None
+    if status:
+        query += " WHERE a.status = %s"
+        params = (status,)
+    query += " ORDER BY a.id"
+
+    if fmt == 'jsonl':
+        def write(row):
+            out.write(json.dumps(dict(zip(EXPORT_FIELDS, map(_export_value, row))), ensure_ascii=False) + '\n')
+    else:
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(EXPORT_FIELDS)
+
+        def write(row):
+            writer.writerow(map(_export_value, row))
+
+    count = 0
+    with get_pool().connection() as conn:
+        # Именованный (серверный) курсор: клиент получает строки пачками по batch_size
+        with conn.cursor(name='catalog_export') as cur:
+            cur.itersize = batch_size
+            cur.execute(query, params)
+            for row in cur:
+                write(row)
+                count += 1
+        conn.rollback()
+    return count
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    return open(path, mode, encoding='utf-8', newline='')
+
+def main(args):
+    fmt = detect_format(args.path, args.format)
+    if args.command == 'export':
+        out = _open(args.path, 'w')
+        try:
+            count = export_catalog(out, fmt, args.status, args.batch_size)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"Выгружено объявлений: {count}", file=sys.stderr)
+        return
+
+    rejects_file = _open(args.rejects, 'w') if args.rejects else None
+    try:
+        rejects = csv.writer(rejects_file, lineterminator='\n') if rejects_file else None
+        if rejects:
+            rejects.writerow(('line', 'reason'))
+        with _open(args.path, 'r') as stream:
+            stats = import_catalog(stream, fmt, args.status or AdStatus.MODERATION.value, rejects)
+    finally:
+        if rejects_file is not None and rejects_file is not sys.stdout:
+            rejects_file.close()
+    print(f"Загружено объявлений: {stats['imported']}, новых пользователей: {stats['users_created']}, "
+          f"новых местоположений: {stats['locations_created']}, отклонено строк: {stats['rejected']}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('path', help="файл CSV или JSONL ('-' - stdin/stdout)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию - по расширению файла')
+    parser.add_argument('--status', choices=sorted(STATUSES),
+                        help='импорт: статус строк без поля status (по умолчанию moderation); '
+                             'экспорт: только объявления в этом статусе')
+    parser.add_argument('--rejects', help='CSV с отклоненными строками (импорт)')
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help='строк в пачке (экспорт)')
+    main(parser.parse_args())
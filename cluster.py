@@ -0,0 +1,227 @@
+import os
+import time
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from urllib.parse import urlparse
+from telegram import Bot, Update
+from telegram.error import TelegramError
+import webhook
+
+logger = logging.getLogger(__name__)
+
+# Число рабочих процессов; 1 - обычный режим в одном процессе
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', 1))
+# Обновлений в очереди одного процесса; при переполнении прием приостанавливается
+CLUSTER_QUEUE_SIZE = int(os.getenv('CLUSTER_QUEUE_SIZE', 1000))
+# Процесс, не обновлявший отметку дольше этого времени, считается зависшим и перезапускается
+CLUSTER_HEARTBEAT_TIMEOUT = float(os.getenv('CLUSTER_HEARTBEAT_TIMEOUT', 30))
+HEARTBEAT_INTERVAL = 1.0
+MONITOR_INTERVAL = 1.0
+STOP_TIMEOUT = 30
+
+def routing_key(data):
+    # Пользователь из любого типа обновления (message, callback_query, ...), иначе чат.
+    # Ключ стабилен между перезапусками, поэтому диалог пользователя всегда в одном процессе.
+    for value in data.values():
+        if isinstance(value, dict):
+            if isinstance(value.get('from'), dict):
+                return value['from']['id']
+            if isinstance(value.get('chat'), dict):
+                return value['chat']['id']
+    return data['update_id']
+
+# ===== Рабочий процесс =====
+def _worker_main(index, updates, heartbeat, factory):
+    # Ctrl+C получает вся группа процессов; останавливает рабочих только главный процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, updates, heartbeat, factory))
+
+async def _run_worker(index, updates, heartbeat, factory):
+    application = factory(index)
+    loop = asyncio.get_running_loop()
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    await application.initialize()
+    beat_task = asyncio.create_task(beat())
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        beat_task.cancel()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+# ===== Главный процесс =====
+class Cluster:
+    # Запускает рабочие процессы и распределяет между ними обновления по пользователю.
+    # factory(index) создается в рабочем процессе и возвращает Application со всеми обработчиками.
+    def __init__(self, factory, workers=CLUSTER_WORKERS, queue_size=CLUSTER_QUEUE_SIZE,
+                 heartbeat_timeout=CLUSTER_HEARTBEAT_TIMEOUT):
+        if workers < 1:
+            raise ValueError("Нужен хотя бы один рабочий процесс")
+        self.factory = factory
+        self.workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.queue_size = queue_size
+        # spawn: рабочие процессы не наследуют соединения и потоки главного
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._heartbeats = [self._context.Value('d', 0.0) for _ in range(workers)]
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self.stats = {'dispatched': 0, 'restarts': 0}
+
+    def _spawn(self, index):
+        self._heartbeats[index].value = 0.0
+        process = self._context.Process(
+            target=_worker_main, name=f'bot-worker-{index}', daemon=True,
+            args=(index, self._queues[index], self._heartbeats[index], self.factory)
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.time()
+        logger.info(f"Запущен рабочий процесс {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def worker_for(self, data):
+        return routing_key(data) % self.workers
+
+    async def dispatch(self, data):
+        target = self._queues[self.worker_for(data)]
+        try:
+            target.put_nowait(data)
+        except queue.Full:
+            # Рабочий не успевает: ждем место, не блокируя цикл событий
+            await asyncio.get_running_loop().run_in_executor(None, target.put, data)
+        self.stats['dispatched'] += 1
+
+    def _is_stuck(self, index):
+        # Процесс считается зависшим, если давно не обновлял отметку (с учетом времени запуска)
+        last_beat = self._heartbeats[index].value or self._started_at[index]
+        return time.time() - last_beat > self.heartbeat_timeout
+
+    def check_workers(self):
+        # Упавшие и зависшие процессы перезапускаются
+        for index, process in enumerate(self._processes):
+            if process.is_alive() and not self._is_stuck(index):
+                continue
+            if process.is_alive():
+                logger.error(f"Рабочий процесс {index} не отвечает, перезапуск")
+                process.kill()
+            else:
+                logger.error(f"Рабочий процесс {index} завершился с кодом {process.exitcode}, перезапуск")
+            process.join()
+            # Процесс мог погибнуть, удерживая блокировку чтения очереди, поэтому новому
+            # процессу нужна новая очередь; необработанные обновления из старой теряются
+            old = self._queues[index]
+            try:
+                lost = old.qsize()
+            except NotImplementedError:
+                lost = '?'
+            if lost:
+                logger.error(f"Потеряно обновлений из очереди процесса {index}: {lost}")
+            old.close()
+            self._queues[index] = self._context.Queue(self.queue_size)
+            self.stats['restarts'] += 1
+            self._spawn(index)
+
+    def healthy(self):
+        return all(p is not None and p.is_alive() and not self._is_stuck(i) for i, p in enumerate(self._processes))
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            self.check_workers()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        # Рабочие дорабатывают свою очередь до метки остановки
+        for updates in self._queues:
+            updates.put(None)
+        deadline = time.time() + timeout
+        for index, process in enumerate(self._processes):
+            process.join(max(0, deadline - time.time()))
+            if process.is_alive():
+                logger.error(f"Рабочий процесс {index} не остановился, завершение")
+                process.kill()
+                process.join()
+
+    def worker_stats(self):
+        stats = dict(self.stats)
+        stats['alive'] = sum(1 for p in self._processes if p is not None and p.is_alive())
+        for index, updates in enumerate(self._queues):
+            try:
+                stats[f'queue_{index}'] = updates.qsize()
+            except NotImplementedError:
+                pass
+        return stats
+
+# ===== Прием обновлений =====
+async def poll_updates(bot, cluster, stop_event, timeout=10):
+    # getUpdates в главном процессе; обработка - в рабочих
+    await bot.delete_webhook()
+    offset = None
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, read_timeout=timeout + 5,
+                                            allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await cluster.dispatch(update.to_dict())
+            offset = update.update_id + 1
+
+async def serve_cluster(factory, token, base_url=None, workers=CLUSTER_WORKERS, url=webhook.WEBHOOK_URL,
+                        host=webhook.WEBHOOK_LISTEN, port=webhook.WEBHOOK_PORT, secret=webhook.WEBHOOK_SECRET,
+                        stop_event=None):
+    stop_event = stop_event or asyncio.Event()
+    webhook.stop_on_signals(stop_event)
+    bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+    cluster = Cluster(factory, workers)
+    cluster.start()
+    monitor = asyncio.create_task(cluster.monitor())
+    server = None
+    try:
+        async with bot:
+            if url:
+                server = webhook.WebhookServer(cluster.dispatch, secret, urlparse(url).path, host, port,
+                                               is_healthy=cluster.healthy)
+                await server.start()
+                await webhook.set_webhook(bot, server, url, secret)
+                await stop_event.wait()
+            else:
+                polling = asyncio.create_task(poll_updates(bot, cluster, stop_event))
+                await stop_event.wait()
+                polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        if server is not None:
+            await server.stop()
+        monitor.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, cluster.stop)
+    return cluster
+
+def run_cluster(factory, token, **kwargs):
+    asyncio.run(serve_cluster(factory, token, **kwargs))
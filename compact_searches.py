@@ -0,0 +1,83 @@
+"""Разовое сжатие таблицы searches.
+
+Приводит сохраненные поиски к нормальному виду (ключевое слово - нижний регистр
+без пробелов по краям, местонахождение - utils.canonical_location, как при
+сохранении поиска), удаляет повторы (остается самый свежий) и лишние поиски сверх
+SEARCH_LIMIT_PER_USER. Работает пачками по диапазонам user_id, каждая пачка -
+короткая отдельная транзакция, поэтому таблица не блокируется надолго.
+
+    python compact_searches.py --batch-users 500 --pause 0.1
+"""
+import argparse
+import time
+from database import execute_query, transaction
+from utils import SEARCH_LIMIT_PER_USER, canonical_location
+
+NORMALIZED_KEYWORD = "nullif(lower(btrim(keyword)), '')"
+# Канонический вид местонахождения строк пачки (c); строки, добавленные ботом после
+# чтения пачки, уже сохранены в каноническом виде
+NORMALIZED_LOCATION = "CASE WHEN c.id IS NULL THEN s.location ELSE c.location END"
+
+def compact_batch(first_user_id, last_user_id, limit):
+    with transaction() as cur:
+        cur.execute(
+            "SELECT id, location FROM searches WHERE user_id BETWEEN %s AND %s FOR UPDATE",
+            (first_user_id, last_user_id)
+        )
+        # Канонический вид считается тем же кодом, что и у бота
+        rows = cur.fetchall()
+        ids = [row_id for row_id, _ in rows]
+        locations = [canonical_location(location) for _, location in rows]
+        # Сначала удаляются повторы по нормализованному ключу и поиски сверх лимита,
+        # после этого нормализация не может нарушить уникальность
+        cur.execute(
+            f"""
+            DELETE FROM searches USING (
+                SELECT s.id,
+                    row_number() OVER (
+                        PARTITION BY s.user_id, {NORMALIZED_KEYWORD}, {NORMALIZED_LOCATION}, s.min_price, s.max_price
+                        ORDER BY s.created_at DESC, s.id DESC
+                    ) AS duplicate_rank,
+                    row_number() OVER (PARTITION BY s.user_id ORDER BY s.created_at DESC, s.id DESC) AS user_rank
+                FROM searches s LEFT JOIN unnest(%s::int[], %s::text[]) c (id, location) ON c.id = s.id
+                WHERE s.user_id BETWEEN %s AND %s
+            ) ranked
+            WHERE searches.id = ranked.id AND (ranked.duplicate_rank > 1 OR ranked.user_rank > %s)
+            """,
+            (ids, locations, first_user_id, last_user_id, limit)
+        )
+        deleted = cur.rowcount
+        cur.execute(
+            f"""
+            UPDATE searches s SET keyword = {NORMALIZED_KEYWORD}, location = c.location
+            FROM unnest(%s::int[], %s::text[]) c (id, location)
+            WHERE s.id = c.id
+              AND (s.keyword IS DISTINCT FROM {NORMALIZED_KEYWORD} OR s.location IS DISTINCT FROM c.location)
+            """,
+            (ids, locations)
+        )
+        return deleted, cur.rowcount
+
+def main(args):
+    bounds = execute_query("SELECT min(user_id), max(user_id) FROM searches", fetch=True)
+    if not bounds or bounds[0][0] is None:
+        print("Таблица searches пуста")
+        return
+    first, last = bounds[0]
+    total_deleted = total_normalized = 0
+    for start in range(first, last + 1, args.batch_users):
+        end = min(start + args.batch_users - 1, last)
+        deleted, normalized = compact_batch(start, end, args.limit)
+        total_deleted += deleted
+        total_normalized += normalized
+        print(f"user_id {start}-{end}: удалено {deleted}, нормализовано {normalized}")
+        if args.pause:
+            time.sleep(args.pause)
+    print(f"Готово: удалено {total_deleted}, нормализовано {total_normalized}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-users', type=int, default=500, help='пользователей в одной транзакции')
+    parser.add_argument('--limit', type=int, default=SEARCH_LIMIT_PER_USER, help='поисков на пользователя')
+    parser.add_argument('--pause', type=float, default=0.1, help='пауза между пачками, секунд')
+    main(parser.parse_args())
@@ -1,40 +1,358 @@
 import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.errors
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
 
+# Размеры пула и параметры проверки соединений
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN', 1))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+# Соединение, простоявшее без дела дольше этого времени, проверяется через SELECT 1
+POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', 30))
+# Соединение старше этого времени пересоздается
+POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 3600))
+
+# Сколько раз повторяется запрос execute_query, прерванный ошибкой сериализации
+DB_SERIALIZATION_RETRIES = int(os.getenv('DB_SERIALIZATION_RETRIES', 3))
+
+# Строк в одной пачке fetchmany при потоковом чтении (iter_query)
+ITER_BATCH_SIZE = int(os.getenv('DB_ITER_BATCH_SIZE', 500))
+
+# Имя соединений в pg_stat_activity; с pid процесса оно же - источник событий шины кэшей
+APPLICATION_NAME = os.getenv('DB_APPLICATION_NAME', 'ads-bot')
+
+def application_name():
+    return f"{APPLICATION_NAME}:{os.getpid()}"
+
 def get_connection():
     return psycopg2.connect(
         dbname=os.getenv('DB_NAME'),
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASSWORD'),
         host=os.getenv('DB_HOST'),
-        port=os.getenv('DB_PORT')
+        port=os.getenv('DB_PORT'),
+        application_name=application_name()
     )
 
-def execute_query(query, params=None, fetch=False):
-    conn = None
-    try:
-        conn = get_connection()
-        with conn.cursor() as cur:
-            if params:
-                cur.execute(query, params)
-            else:
-                cur.execute(query)
-                
-            if fetch:
-                result = cur.fetchall()
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 check_idle=POOL_CHECK_IDLE, max_lifetime=POOL_MAX_LIFETIME, connect=get_connection):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Некорректные размеры пула")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self.max_lifetime = max_lifetime
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = []            # [(conn, created_at, released_at)]
+        self._born = {}            # id(conn) -> created_at для выданных соединений
+        self._size = 0
+        self._closed = False
+        self._stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'waiting': 0,
+                       'timeouts': 0, 'recycled': 0, 'failed_checks': 0}
+
+    # ===== Создание и проверка соединений =====
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    def _is_alive(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['failed_checks'] += 1
+            return False
+
+    def fill(self):
+        # Прогрев пула до минимального размера
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._new_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic(), time.monotonic()))
+                self._cond.notify()
+
+    # ===== Выдача и возврат соединений =====
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Пул соединений закрыт")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout("Нет свободных соединений в пуле")
+                    self._stats['waiting'] += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._stats['waiting'] -= 1
+                    if self._closed:
+                        raise PoolTimeout("Пул соединений закрыт")
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                else:
+                    conn, created_at, released_at = None, None, None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
             else:
-                result = True
-                
+                now = time.monotonic()
+                expired = now - created_at > self.max_lifetime
+                if conn.closed or expired or (now - released_at > self.check_idle and not self._is_alive(conn)):
+                    self._discard(conn)
+                    continue
+
+            with self._cond:
+                self._born[id(conn)] = created_at
+                self._stats['checkouts'] += 1
+            return conn
+
+    def putconn(self, conn, broken=False):
+        with self._cond:
+            created_at = self._born.pop(id(conn), time.monotonic())
+        if not broken and not conn.closed:
+            try:
+                # Возвращаем соединение в пул только в чистом состоянии
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken or conn.closed or self._closed:
+            if broken:
+                with self._cond:
+                    self._stats['recycled'] += 1
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.Error as e:
+            # После ошибок уровня соединения (обрыв, рестарт сервера) соединение пересоздается;
+            # откат транзакции (ошибка сериализации, взаимоблокировка) - подкласс OperationalError,
+            # но соединение после него исправно
+            broken = conn.closed != 0 or (
+                isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                and not isinstance(e, psycopg2.extensions.TransactionRollbackError)
+            )
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def metrics(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['checked_out'] = len(self._born)
+        return stats
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def init_pool(**kwargs):
+    # Позволяет переопределить параметры пула (например, в бенчмарках)
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool = ConnectionPool(**kwargs)
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def pool_metrics():
+    return get_pool().metrics()
+
+@contextmanager
+def transaction():
+    # Несколько запросов в одной транзакции; ошибки пробрасываются вызывающему
+    observed = metrics.enabled
+    if observed:
+        # Кадр 1 - __enter__ из contextlib, кадр 2 - функция, открывшая транзакцию
+        helper = sys._getframe(2).f_code.co_name
+        start = time.perf_counter()
+    error = None
+    try:
+        with get_pool().connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        pass
+                raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        if observed:
+            metrics.observe_query(helper, time.perf_counter() - start, 'transaction', error)
+
+def _execute(query, params, fetch):
+    # Смена статуса переносит строку ads в другую секцию; если строку, которую запрос
+    # ждал, за это время перенес другой запрос, PostgreSQL прерывает запрос ошибкой
+    # сериализации. execute_query - одна транзакция из одного запроса, она уже откачена,
+    # поэтому запрос можно повторить: новый снимок увидит строку на новом месте
+    for attempt in range(DB_SERIALIZATION_RETRIES + 1):
+        try:
+            return _execute_once(query, params, fetch)
+        except psycopg2.errors.SerializationFailure:
+            if attempt == DB_SERIALIZATION_RETRIES:
+                raise
+
+def _execute_once(query, params, fetch):
+    with get_pool().connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                if params:
+                    cur.execute(query, params)
+                else:
+                    cur.execute(query)
+
+                if fetch:
+                    result = cur.fetchall()
+                else:
+                    result = True
+
             conn.commit()
             return result
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    pass
+            raise
+
+def _iter_rows(query, params, batch_size, helper):
+    # Соединение берется из пула при первом чтении и возвращается, как только строки
+    # закончились или обход прерван (close() генератора)
+    elapsed = 0.0
+    error = None
+    try:
+        with get_pool().connection() as conn:
+            # Именованный (серверный) курсор: результат остается в БД, клиент читает его пачками
+            with conn.cursor(name='iter_query') as cur:
+                start = time.perf_counter()
+                cur.execute(query, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    elapsed += time.perf_counter() - start
+                    if not rows:
+                        break
+                    yield from rows
+                    start = time.perf_counter()
     except Exception as e:
+        error = e
+        print(f"Database error: {e}")
+        raise
+    finally:
+        if helper is not None:
+            metrics.observe_query(helper, elapsed, query, error)
+
+def iter_query(query, params=None, batch_size=ITER_BATCH_SIZE):
+    # Потоковый вариант execute_query(fetch=True): строки по одной без загрузки всего
+    # результата в память. В отличие от execute_query ошибки пробрасываются: строки
+    # уже могли быть обработаны, и молча оборвать вывод нельзя
+    helper = sys._getframe(1).f_code.co_name if metrics.enabled else None
+    return _iter_rows(query, params, batch_size, helper)
+
+def execute_query(query, params=None, fetch=False):
+    if not metrics.enabled:
+        try:
+            return _execute(query, params, fetch)
+        except Exception as e:
+            print(f"Database error: {e}")
+            return None
+
+    # Время запроса учитывается по имени вызвавшей функции (например, search_ads_page)
+    helper = sys._getframe(1).f_code.co_name
+    start = time.perf_counter()
+    error = None
+    try:
+        return _execute(query, params, fetch)
+    except Exception as e:
+        error = e
         print(f"Database error: {e}")
-        if conn:
-            conn.rollback()
         return None
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        metrics.observe_query(helper, time.perf_counter() - start, query, error)
@@ -1,10 +1,18 @@
 import re
 import logging
-from telegram import Update
+from contextlib import aclosing
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
 from telegram.ext import ContextTypes, ConversationHandler
 from database import execute_query
 from models import AdStatus, ReviewType
 from utils import *
+from async_db import (
+    get_user, create_user, create_ad, get_user_ads, get_ad_details,
+    update_ad_field, delete_ad_db, create_search, search_ads_page, search_price_facets,
+    create_review, get_review_summary, get_reviews_page, get_ads_for_moderation, set_ads_status, publish_ads, enqueue_notifications, iterate
+)
+from notifications import wake_dispatcher
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,7 +20,7 @@ logger = logging.getLogger(__name__)
 # ===== Основные команды =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
-    create_user(user.id, user.username, user.first_name, user.last_name)
+    await create_user(user.id, user.username, user.first_name, user.last_name)
     await update.message.reply_text(
         "Привет, это бот по аренде одежды. Напиши /help и я предоставлю тебе набор команд как со мной взаимодействовать"
     )
@@ -39,14 +47,13 @@ async def submit_ad_title(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return SUBMIT_STATE_PRICE
 
 async def submit_ad_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        price = float(update.message.text)
-        context.user_data['price'] = price
-        await update.message.reply_text("Введите местонахождение товара")
-        return SUBMIT_STATE_LOCATION
-    except ValueError:
+    price = parse_price(update.message.text)
+    if price is None:
         await update.message.reply_text("Неверный формат стоимости. Введите число.")
         return SUBMIT_STATE_PRICE
+    context.user_data['price'] = price
+    await update.message.reply_text("Введите местонахождение товара")
+    return SUBMIT_STATE_LOCATION
 
 async def submit_ad_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['location'] = update.message.text
@@ -55,7 +62,7 @@ async def submit_ad_location(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def submit_ad_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     contact = update.message.text
-    if contact.startswith('@') or (contact.startswith('89') and len(contact) == 11 and contact.isdigit()):
+    if is_valid_contact(contact):
         context.user_data['contact'] = contact
         ad_data = context.user_data
         response = (
@@ -74,9 +81,9 @@ async def submit_ad_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return SUBMIT_STATE_CONTACT
 
 async def submit_ad_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = get_user(update.message.from_user.id)
+    user = await get_user(update.message.from_user.id)
     if user:
-        ad_id = create_ad(
+        ad_id = await create_ad(
             user_id=user[0],
             title=context.user_data['title'],
             price=context.user_data['price'],
@@ -101,12 +108,12 @@ async def submit_ad_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===== Редактирование объявления =====
 async def edit_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
-    user = get_user(update.message.from_user.id)
+    user = await get_user(update.message.from_user.id)
     if not user:
         await update.message.reply_text("Пользователь не найден")
         return ConversationHandler.END
     
-    ads = get_user_ads(user[0])
+    ads = await get_user_ads(user[0])
     if not ads:
         await update.message.reply_text("У вас нет объявлений.")
         return ConversationHandler.END
@@ -128,8 +135,8 @@ async def edit_ad_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return EDIT_STATE_ACTION
     
     ad_id = int(match.group(1))
-    user = get_user(update.message.from_user.id)
-    ad = get_ad_details(ad_id)
+    user = await get_user(update.message.from_user.id)
+    ad = await get_ad_details(ad_id)
     
     if not ad or ad[1] != user[0]:
         await update.message.reply_text("Объявление не найдено или не принадлежит вам.")
@@ -168,26 +175,18 @@ async def edit_ad_get_new_value(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Валидация для цены
     if field_num == 2:
-        try:
-            new_value = float(new_value)
-        except ValueError:
+        new_value = parse_price(new_value)
+        if new_value is None:
             await update.message.reply_text("Неверный формат стоимости. Введите число.")
             return EDIT_STATE_GET_VALUE
     
     # Валидация для контактов
     if field_num == 4:
-        is_valid_contact = (
-            new_value.startswith('@') or 
-            (new_value.startswith('89') and 
-             len(new_value) == 11 and 
-             new_value.isdigit())
-        )
-        
-        if not is_valid_contact:
+        if not is_valid_contact(new_value):
             await update.message.reply_text("Неверный формат. Введите телефон (89111111111) или @username.")
             return EDIT_STATE_GET_VALUE
     
-    if update_ad_field(ad_id, field_num, new_value):
+    if await update_ad_field(ad_id, field_num, new_value):
         await update.message.reply_text("Информация обновлена. Для изменения другого поля повторите /edit_ad [ID]")
     else:
         await update.message.reply_text("Ошибка при обновлении")
@@ -204,11 +203,11 @@ async def delete_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     ad_id = int(match.group(1))
-    user = get_user(update.message.from_user.id)
-    ad = get_ad_details(ad_id)
+    user = await get_user(update.message.from_user.id)
+    ad = await get_ad_details(ad_id)
     
     if ad and ad[1] == user[0]:
-        if delete_ad_db(ad_id): 
+        if await delete_ad_db(ad_id): 
             await update.message.reply_text("Объявление удалено")
         else:
             await update.message.reply_text("Ошибка при удалении")
@@ -266,7 +265,9 @@ async def process_next_filter(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Введите местонахождение:")
         return SEARCH_STATE_LOCATION
     elif filter_type == '3':
-        await update.message.reply_text("Введите стоимость аренды (одно число):")
+        await update.message.reply_text(
+            "Введите стоимость аренды: диапазон (1000-3000), от (1000-) или до (-3000)"
+        )
         return SEARCH_STATE_PRICE
 
 async def search_ads_keyword(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -278,14 +279,12 @@ async def search_ads_location(update: Update, context: ContextTypes.DEFAULT_TYPE
     return await process_next_filter(update, context)
 
 async def search_ads_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        price = float(update.message.text)
-        context.user_data['min_price'] = price
-        context.user_data['max_price'] = price
-    except ValueError:
-        await update.message.reply_text("Неверный формат. Введите одно число.")
+    price_range = parse_price_range(update.message.text)
+    if price_range is None:
+        await update.message.reply_text("Неверный формат. Примеры: 1000-3000, 1000-, -3000")
         return SEARCH_STATE_PRICE
     
+    context.user_data['min_price'], context.user_data['max_price'] = price_range
     return await process_next_filter(update, context)
 
 async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -297,30 +296,123 @@ async def perform_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     }
     
     # Сохраняем поиск
-    user = get_user(update.message.from_user.id)
+    user = await get_user(update.message.from_user.id)
     if user:
-        create_search(user[0], **params)
+        await create_search(user[0], **params)
     
-    # Выполняем поиск
-    results = search_ads_in_db(**params)
+    # Выполняем поиск (первая страница)
+    results, has_more = await search_ads_page(**params)
     
     if not results:
         await update.message.reply_text("Объявления не найдены")
     else:
-        response = "Результаты поиска:\n\n"
-        for ad in results:
-            response += (
-                f"ID: {ad[0]}\n"
-                f"Товар: {ad[2]}\n"
-                f"Цена: {ad[3]}\n"
-                f"Место: {ad[4]}\n"
-                f"Контакты: {ad[5]}\n\n"
-            )
-        await update.message.reply_text(response)
+        # Состояние листания хранится в chat_data, в кнопках - только номер поиска
+        search_id = context.chat_data.get('search_seq', 0) + 1
+        context.chat_data['search_seq'] = search_id
+        context.chat_data['search'] = {'id': search_id, 'params': params, 'page': 0, 'facets': []}
+        # Много результатов без фильтра цены: сколько объявлений в каждом ценовом диапазоне
+        if has_more and params['min_price'] is None and params['max_price'] is None:
+            facets = await search_price_facets(**params) or []
+            context.chat_data['search']['facets'] = [facet for facet in facets if facet[2]]
+        await update.message.reply_text(
+            render_search_page(context.chat_data['search'], results),
+            reply_markup=search_page_keyboard(context.chat_data['search'], has_more)
+        )
     
     context.user_data.clear()
     return ConversationHandler.END
 
+def render_search_page(state, results):
+    state['first'] = (results[0][0], results[0][1])
+    state['last'] = (results[-1][0], results[-1][1])
+    response = f"Результаты поиска (страница {state['page'] + 1}):\n\n"
+    for ad in results:
+        response += (
+            f"ID: {ad[1]}\n"
+            f"Товар: {ad[2]}\n"
+            f"Цена: {ad[3]}\n"
+            f"Место: {ad[4]}\n"
+            f"Контакты: {ad[5]}\n\n"
+        )
+    if state.get('facets'):
+        response += "Уточнить цену:"
+    return response
+
+def format_price_range(low, high):
+    if low is None:
+        return f"до {high:g}"
+    if high is None:
+        return f"от {low:g}"
+    return f"{low:g}-{high:g}"
+
+def search_page_keyboard(state, has_next):
+    buttons = []
+    if state['page'] > 0:
+        buttons.append(InlineKeyboardButton("◀ Назад", callback_data=f"search:{state['id']}:prev"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далее ▶", callback_data=f"search:{state['id']}:next"))
+    # Кнопки ценовых диапазонов с числом объявлений, по три в ряд
+    facets = [
+        InlineKeyboardButton(f"{format_price_range(low, high)} ({count})",
+                             callback_data=f"search:{state['id']}:price:{i}")
+        for i, (low, high, count) in enumerate(state.get('facets', []))
+    ]
+    rows = ([buttons] if buttons else []) + [facets[i:i + 3] for i in range(0, len(facets), 3)]
+    return InlineKeyboardMarkup(rows) if rows else None
+
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, search_id, direction = query.data.split(':')
+    state = context.chat_data.get('search')
+    if not state or state['id'] != int(search_id):
+        await query.answer("Поиск устарел. Повторите: /search_ads")
+        return
+    
+    if direction == 'next':
+        results, has_more = await search_ads_page(**state['params'], after=state['last'])
+    else:
+        results, has_more = await search_ads_page(**state['params'], before=state['first'])
+    
+    if not results:
+        await query.answer("Больше объявлений нет")
+        return
+    
+    if direction == 'next':
+        state['page'] += 1
+        has_next = has_more
+    else:
+        # Если перед страницей ничего нет, это первая страница
+        state['page'] = state['page'] - 1 if has_more else 0
+        has_next = True
+    await query.answer()
+    await query.edit_message_text(
+        render_search_page(state, results),
+        reply_markup=search_page_keyboard(state, has_next)
+    )
+
+async def search_narrow(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Повтор поиска в выбранном ценовом диапазоне, с первой страницы
+    query = update.callback_query
+    _, search_id, _, facet = query.data.split(':')
+    state = context.chat_data.get('search')
+    if not state or state['id'] != int(search_id) or int(facet) >= len(state.get('facets', [])):
+        await query.answer("Поиск устарел. Повторите: /search_ads")
+        return
+    
+    low, high, _ = state['facets'][int(facet)]
+    params = {**state['params'], 'min_price': low, 'max_price': high}
+    results, has_more = await search_ads_page(**params)
+    if not results:
+        await query.answer("Объявления не найдены")
+        return
+    
+    state.update(params=params, page=0, facets=[])
+    await query.answer()
+    await query.edit_message_text(
+        render_search_page(state, results),
+        reply_markup=search_page_keyboard(state, has_more)
+    )
+
 # ===== Отзывы =====
 async def reviews(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -329,15 +421,25 @@ async def reviews(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/reviews_ad [ID] - о товаре"
     )
 
+async def reply_streamed(message, rows, render, header, empty):
+    # rows - iterate(iter_*): строки выводятся по мере чтения из БД сообщениями не длиннее
+    # лимита Telegram, поэтому ни строки, ни текст ответа не накапливаются целиком.
+    # iter_* читают пачки короткими запросами, поэтому пока сообщение отправляется
+    # (в том числе ожидание RetryAfter), соединение из пула не занято
+    text, count = header, 0
+    async with aclosing(rows):
+        async for row in rows:
+            line = render(row)[:MessageLimit.MAX_TEXT_LENGTH]
+            if len(text) + len(line) > MessageLimit.MAX_TEXT_LENGTH:
+                await message.reply_text(text)
+                text = ''
+            text += line
+            count += 1
+    await message.reply_text(text if count else empty)
+    return count
+
 async def reviews_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    reviews = get_reviews(ReviewType.BOT.value)
-    if not reviews:
-        await update.message.reply_text("Отзывы о боте отсутствуют")
-    else:
-        response = "Отзывы о боте:\n\n"
-        for review in reviews:
-            response += f"- {review[4]}\n"  
-        await update.message.reply_text(response)
+    await show_reviews(update, context, ReviewType.BOT.value, None, "Отзывы о боте")
 
 async def reviews_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.split()
@@ -346,14 +448,78 @@ async def reviews_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     ad_id = int(text[1])
-    reviews = get_reviews(ReviewType.AD.value, ad_id)
-    if not reviews:
-        await update.message.reply_text(f"Отзывы о товаре (ID: {ad_id}) отсутствуют")
+    await show_reviews(update, context, ReviewType.AD.value, ad_id, f"Отзывы о товаре (ID: {ad_id})")
+
+async def show_reviews(update, context, review_type, ad_id, title):
+    # Сводка из review_aggregates и первая страница отзывов (новые первыми)
+    count, last_review_at = await get_review_summary(review_type, ad_id)
+    results, has_more = await get_reviews_page(review_type, ad_id) if count else (None, False)
+    if not results:
+        await update.message.reply_text(f"{title} отсутствуют")
+        return
+    
+    # Как у поиска: состояние листания в chat_data, в кнопках - только номер списка
+    list_id = context.chat_data.get('reviews_seq', 0) + 1
+    context.chat_data['reviews_seq'] = list_id
+    context.chat_data['reviews'] = {
+        'id': list_id, 'type': review_type, 'ad_id': ad_id, 'title': title,
+        'count': count, 'last_review_at': last_review_at, 'page': 0
+    }
+    await update.message.reply_text(
+        render_reviews_page(context.chat_data['reviews'], results),
+        reply_markup=reviews_page_keyboard(context.chat_data['reviews'], has_more)
+    )
+
+def render_reviews_page(state, results):
+    state['first'] = (results[0][0], results[0][1])
+    state['last'] = (results[-1][0], results[-1][1])
+    response = f"{state['title']}: {state['count']}"
+    if state['last_review_at']:
+        response += f", последний {state['last_review_at']:%d.%m.%Y}"
+    response += f"\nСтраница {state['page'] + 1}:\n\n"
+    for _, _, text in results:
+        if len(text) > REVIEW_PREVIEW_LENGTH:
+            text = text[:REVIEW_PREVIEW_LENGTH] + "…"
+        response += f"- {text}\n"
+    return response
+
+def reviews_page_keyboard(state, has_next):
+    buttons = []
+    if state['page'] > 0:
+        buttons.append(InlineKeyboardButton("◀ Назад", callback_data=f"reviews:{state['id']}:prev"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далее ▶", callback_data=f"reviews:{state['id']}:next"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def reviews_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    _, list_id, direction = query.data.split(':')
+    state = context.chat_data.get('reviews')
+    if not state or state['id'] != int(list_id):
+        await query.answer("Список устарел. Повторите: /reviews")
+        return
+    
+    if direction == 'next':
+        results, has_more = await get_reviews_page(state['type'], state['ad_id'], after=state['last'])
     else:
-        response = f"Отзывы о товаре (ID: {ad_id}):\n\n"
-        for review in reviews:
-            response += f"- {review[4]}\n" 
-        await update.message.reply_text(response)
+        results, has_more = await get_reviews_page(state['type'], state['ad_id'], before=state['first'])
+    
+    if not results:
+        await query.answer("Больше отзывов нет")
+        return
+    
+    if direction == 'next':
+        state['page'] += 1
+        has_next = has_more
+    else:
+        # Если перед страницей ничего нет, это первая страница
+        state['page'] = state['page'] - 1 if has_more else 0
+        has_next = True
+    await query.answer()
+    await query.edit_message_text(
+        render_reviews_page(state, results),
+        reply_markup=reviews_page_keyboard(state, has_next)
+    )
 
 # ===== Обратная связь =====
 async def report(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -396,11 +562,11 @@ async def report_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     report_type = context.user_data['report_type']
     text = update.message.text
-    user = get_user(update.message.from_user.id)
+    user = await get_user(update.message.from_user.id)
     ad_id = context.user_data.get('ad_id', None)
     
     if user:
-        success = create_review(
+        success = await create_review(
             user_id=user[0],
             review_type=report_type.value,
             text=text,
@@ -430,15 +596,50 @@ async def moderated(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас недостаточно прав")
         return
     
-    ads = get_ads_for_moderation()
+    # Одним запросом на одну строку больше, чтобы узнать, что показаны не все
+    ads = await get_ads_for_moderation(MODERATION_PAGE_SIZE + 1)
     if not ads:
         await update.message.reply_text("Нет объявлений на модерации")
     else:
+        shown = ads[:MODERATION_PAGE_SIZE]
         response = "Объявления на модерации:\n\n"
-        for ad in ads:
+        for ad in shown:
             response += f"ID: {ad[0]}\nТовар: {ad[2]}\nЦена: {ad[3]}\nМесто: {ad[4]}\n\n"
             response += f"Подтвердить: /add {ad[0]}\nОтклонить: /deny {ad[0]}\n\n"
-        await update.message.reply_text(response)
+        if len(ads) > MODERATION_PAGE_SIZE:
+            response += f"Показаны первые {MODERATION_PAGE_SIZE}.\n"
+        response += "Несколько объявлений сразу: /add 1,5,7 или /add 10-40 (так же /deny)"
+        # Кнопка публикует ровно показанные объявления; в кнопке - только номер списка
+        list_id = context.chat_data.get('moderation_seq', 0) + 1
+        context.chat_data['moderation_seq'] = list_id
+        context.chat_data['moderation'] = {'id': list_id, 'ids': [ad[0] for ad in shown]}
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton(f"Опубликовать все показанные ({len(shown)})",
+                                 callback_data=f"moderation:{list_id}:approve")
+        ]])
+        await update.message.reply_text(response, reply_markup=keyboard)
+
+def moderation_report(ad_ids, ads, verb, missing="Не найдены"):
+    # Ответ на команду модерации: что изменено и какие номера пропущены
+    done = [ad[0] for ad in ads]
+    if len(ad_ids) == 1:
+        return f"Объявление {ad_ids[0]} {verb}" if done else f"Объявление {ad_ids[0]} не найдено"
+    response = f"{verb.capitalize()} объявлений: {len(done)}"
+    if done:
+        response += f" (ID: {format_ad_ids(done)})"
+    skipped = set(ad_ids) - set(done)
+    if skipped:
+        response += f"\n{missing}: {format_ad_ids(skipped)}"
+    return response
+
+async def approve_ads(ad_ids, from_status=None):
+    ads = await publish_ads(ad_ids, from_status)
+    if ads is None:
+        return "Ошибка при публикации объявлений"
+    # Уже активные объявления повторно не рассылаются
+    await notify_published([ad for ad in ads if ad[4] != AdStatus.ACTIVE.value])
+    return moderation_report(ad_ids, ads, "опубликовано",
+                             "Не найдены" if from_status is None else "Уже не на модерации")
 
 async def add_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
@@ -446,32 +647,15 @@ async def add_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас недостаточно прав")
         return
     
-    text = update.message.text.split()
-    if len(text) < 2 or not text[1].isdigit():
-        await update.message.reply_text("Используйте: /add [ID]")
+    ad_ids = parse_ad_ids(update.message.text.split()[1:])
+    if not ad_ids:
+        await update.message.reply_text(
+            f"Используйте: /add [ID], например /add 5, /add 5,7,9 или /add 10-40 "
+            f"(не больше {MODERATION_BATCH_LIMIT} объявлений)"
+        )
         return
     
-    ad_id = int(text[1])
-    if update_ad_status(ad_id, AdStatus.ACTIVE.value):
-        # Уведомление пользователя
-        ad = get_ad_details(ad_id)
-        if ad:
-            user_info = get_user_by_id(ad[1])
-            if user_info:
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_info[1],  # telegram_id
-                        text=f"Ваше объявление (ID: {ad_id}) опубликовано"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка отправки уведомления: {e}")
-                    
-        # Уведомление для поисков
-        await notify_matching_searches(context.bot, ad_id)
-        
-        await update.message.reply_text(f"Объявление {ad_id} опубликовано")
-    else:
-        await update.message.reply_text("Ошибка при публикации объявления")
+    await update.message.reply_text(await approve_ads(ad_ids))
 
 async def deny_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
@@ -479,16 +663,35 @@ async def deny_ad(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас недостаточно прав")
         return
     
-    text = update.message.text.split()
-    if len(text) < 2 or not text[1].isdigit():
-        await update.message.reply_text("Используйте: /deny [ID]")
+    ad_ids = parse_ad_ids(update.message.text.split()[1:])
+    if not ad_ids:
+        await update.message.reply_text(
+            f"Используйте: /deny [ID], например /deny 5, /deny 5,7,9 или /deny 10-40 "
+            f"(не больше {MODERATION_BATCH_LIMIT} объявлений)"
+        )
         return
     
-    ad_id = int(text[1])
-    if update_ad_status(ad_id, AdStatus.REJECTED.value):
-        await update.message.reply_text(f"Объявление {ad_id} отклонено")
+    ads = await set_ads_status(ad_ids, AdStatus.REJECTED.value)
+    if ads is None:
+        await update.message.reply_text("Ошибка при отклонении объявлений")
     else:
-        await update.message.reply_text("Ошибка при отклонении объявления")
+        await update.message.reply_text(moderation_report(ad_ids, ads, "отклонено"))
+
+async def approve_shown(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not is_admin(query.from_user.username):
+        await query.answer("У вас недостаточно прав")
+        return
+    _, list_id, _ = query.data.split(':')
+    state = context.chat_data.get('moderation')
+    if not state or state['id'] != int(list_id):
+        await query.answer("Список устарел. Повторите: /moderated")
+        return
+    
+    context.chat_data.pop('moderation')
+    await query.answer()
+    # Объявления, которые за это время уже обработал другой администратор, не меняются
+    await query.edit_message_text(await approve_ads(state['ids'], from_status=AdStatus.MODERATION.value))
 
 async def reviews_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.message.from_user
@@ -496,33 +699,24 @@ async def reviews_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("У вас недостаточно прав")
         return
     
-    reports = get_content_reports()
-    if not reports:
-        await update.message.reply_text("Жалобы на контент отсутствуют")
-    else:
-        response = "Жалобы на контент:\n\n"
-        for report in reports:
-            user_info = get_user_by_id(report[1])
-            if user_info:
-                response += f"Пользователь: @{user_info[2]}\nТекст: {report[4]}\n\n"
-        await update.message.reply_text(response)
+    await reply_streamed(
+        update.message, iterate(iter_content_reports), lambda row: f"Пользователь: @{row[0]}\nТекст: {row[1]}\n\n",
+        "Жалобы на контент:\n\n", "Жалобы на контент отсутствуют"
+    )
 
 # ===== Уведомления =====
-async def notify_matching_searches(bot, ad_id):
-    ad = get_ad_details(ad_id)
-    if not ad:
+async def notify_published(ads):
+    # ads - строки publish_ads: владелец и подписчики уже известны. Уведомления всех
+    # объявлений ставятся в очередь одной пачкой, рассылка идет в фоне
+    if not ads:
         return
-    
-    title, price, location = ad[2], ad[3], ad[4]
-    matching_searches = get_matching_searches(title, location, price)
-    
-    for search in matching_searches:
-        user_info = get_user_by_id(search[1])
-        if user_info:
-            try:
-                await bot.send_message(
-                    chat_id=user_info[1],
-                    text=f"По вашему запросу доступен новый товар: {title} (ID: {ad_id})\nПовторите поиск: /search_ads"
-                )
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления: {e}")
+    messages = []
+    for ad_id, title, price, location, _, owner_telegram_id, subscribers in ads:
+        messages.append((owner_telegram_id, f"Ваше объявление (ID: {ad_id}) опубликовано"))
+        text = f"По вашему запросу доступен новый товар: {title} (ID: {ad_id})\nПовторите поиск: /search_ads"
+        messages.extend((chat_id, text) for chat_id in subscribers)
+    
+    if await enqueue_notifications(messages):
+        wake_dispatcher()
+    else:
+        logger.error(f"Не удалось поставить уведомления в очередь (ID: {format_ad_ids(ad[0] for ad in ads)})")
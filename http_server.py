@@ -0,0 +1,144 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Минимальный HTTP/1.1-сервер на asyncio для служебных эндпоинтов бота
+# (метрики, вебхук). Поддерживает keep-alive и тело запроса по Content-Length.
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+class BadRequest(Exception):
+    # Некорректная строка запроса или заголовки: ответ 400
+    pass
+
+class PayloadTooLarge(Exception):
+    # Тело больше MAX_BODY_SIZE: ответ 413
+    pass
+
+class Request:
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+async def _read_line(reader):
+    try:
+        return await reader.readline()
+    except ValueError:
+        # Строка длиннее лимита буфера StreamReader
+        raise BadRequest("Слишком длинная строка запроса или заголовка")
+
+async def read_request(reader):
+    # None - клиент закрыл соединение
+    request_line = await _read_line(reader)
+    if not request_line.strip():
+        return None
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise BadRequest("Некорректная строка запроса")
+    method, target, _ = parts
+    headers = {}
+    while True:
+        line = await _read_line(reader)
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, colon, value = line.decode('latin-1').partition(':')
+        if not colon or not name.strip():
+            raise BadRequest("Некорректный заголовок")
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not (length.isascii() and length.isdigit()):
+        raise BadRequest("Некорректный Content-Length")
+    length = int(length)
+    if length > MAX_BODY_SIZE:
+        raise PayloadTooLarge("Слишком большое тело запроса")
+    try:
+        body = await reader.readexactly(length) if length else b''
+    except asyncio.IncompleteReadError:
+        # Клиент закрыл соединение, не передав тело целиком
+        return None
+    path, _, query = target.partition('?')
+    return Request(method, path, query, headers, body)
+
+def write_response(writer, status, body=b'', content_type='text/plain; charset=utf-8', keep_alive=True):
+    if isinstance(body, str):
+        body = body.encode()
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+    )
+
+class HttpServer:
+    # handler(request) -> (status, body) или (status, body, content_type)
+    def __init__(self, handler, host, port):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server = None
+        self._connections = set()
+        self._busy = set()
+        self._stopping = False
+
+    async def _serve(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest:
+                    write_response(writer, 400, keep_alive=False)
+                    break
+                except PayloadTooLarge:
+                    write_response(writer, 413, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                self._busy.add(task)
+                try:
+                    status, body, *content_type = await self.handler(request)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки {request.method} {request.path}: {e}")
+                    status, body, content_type = 500, b'', []
+                finally:
+                    self._busy.discard(task)
+                keep_alive = not self._stopping and request.headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, body, *content_type, keep_alive=keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        # При port=0 порт выбирает система
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self, timeout=5):
+        # Новые соединения не принимаются, запросы в обработке получают время на ответ,
+        # простаивающие keep-alive соединения закрываются сразу
+        if self._server is None:
+            return
+        self._stopping = True
+        self._server.close()
+        for task in self._connections - self._busy:
+            task.cancel()
+        if self._connections:
+            _, pending = await asyncio.wait(set(self._connections), timeout=timeout)
+            for task in pending:
+                task.cancel()
+        await self._server.wait_closed()
+        self._server = None
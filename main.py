@@ -1,12 +1,24 @@
 import os
+import asyncio
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ConversationHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ConversationHandler
 from dotenv import load_dotenv
 from handlers import *
-from utils import init_db
+from utils import init_db, search_cache
+from database import get_pool, close_pool, pool_metrics
+from async_db import shutdown_executor
+from notifications import start_dispatcher, stop_dispatcher, dispatcher_stats
+from cache_bus import start_cache_bus, stop_cache_bus, cache_bus_stats, wait_connected, build_search_index
+import metrics
+import webhook
+from scheduler import ScheduledApplication, UPDATE_MAX_PENDING
+from persistence import PostgresPersistence
+from cluster import CLUSTER_WORKERS, run_cluster
 
 load_dotenv()
 TOKEN = os.getenv('TOKEN')
+# Адрес Bot API (например, локальный сервер); по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -14,9 +26,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main() -> None:
-    init_db()
-    application = Application.builder().token(TOKEN).build()
+def build_application(worker=None) -> Application:
+    # worker - номер рабочего процесса в режиме кластера (None - бот в одном процессе)
+    async def post_init(application: Application) -> None:
+        # Фоновая рассылка уведомлений из очереди notification_outbox (в кластере - одна на все процессы)
+        if not worker:
+            start_dispatcher(application.bot)
+        if metrics.enabled:
+            await metrics.start_server(port=metrics.METRICS_PORT + (worker + 1 if worker is not None else 0))
+
+    async def post_shutdown(application: Application) -> None:
+        await stop_dispatcher()
+        stop_cache_bus()
+        await metrics.stop_server()
+
+    builder = Application.builder().token(TOKEN)
+    if TELEGRAM_API_URL:
+        builder.base_url(TELEGRAM_API_URL)
+    application = (
+        builder
+        # Обновления разных пользователей обрабатываются параллельно, одного - по порядку.
+        # Ограниченная очередь приостанавливает прием обновлений при перегрузке.
+        .application_class(ScheduledApplication)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_MAX_PENDING))
+        # Шаги диалогов и user_data переживают перезапуск бота
+        .persistence(PostgresPersistence())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Основные команды
     application.add_handler(CommandHandler("start", start))
@@ -24,6 +62,8 @@ def main() -> None:
     
     # Создание объявления
     application.add_handler(ConversationHandler(
+        name="submit_ad",
+        persistent=True,
         entry_points=[CommandHandler("submit_ad", submit_ad)],
         states={
             SUBMIT_STATE_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, submit_ad_title)],
@@ -40,6 +80,8 @@ def main() -> None:
     
     # Редактирование объявления
     application.add_handler(ConversationHandler(
+        name="edit_ad",
+        persistent=True,
         entry_points=[CommandHandler("edit_ad", edit_ad)],
         states={
             EDIT_STATE_ACTION: [
@@ -57,6 +99,8 @@ def main() -> None:
     
     # Поиск объявлений
     application.add_handler(ConversationHandler(
+        name="search_ads",
+        persistent=True,
         entry_points=[CommandHandler("search_ads", search_ads)],
         states={
             SEARCH_STATE_FILTERS: [MessageHandler(filters.TEXT & ~filters.COMMAND, search_ads_filters)],
@@ -66,12 +110,16 @@ def main() -> None:
         },
         fallbacks=[]
     ))
+    application.add_handler(CallbackQueryHandler(search_page, pattern=r'^search:\d+:(next|prev)$'))
+    application.add_handler(CallbackQueryHandler(search_narrow, pattern=r'^search:\d+:price:\d+$'))
     
     # Команды обратной связи
     application.add_handler(CommandHandler("report", report))
     
     # Обработчик отчетов
     report_conv = ConversationHandler(
+        name="report",
+        persistent=True,
         entry_points=[
             CommandHandler("report_bot", report_bot),
             CommandHandler("report_ad", report_ad),
@@ -88,13 +136,63 @@ def main() -> None:
     application.add_handler(CommandHandler("reviews", reviews))
     application.add_handler(CommandHandler("reviews_bot", reviews_bot))
     application.add_handler(CommandHandler("reviews_ad", reviews_ad))
+    application.add_handler(CallbackQueryHandler(reviews_page, pattern=r'^reviews:\d+:(next|prev)$'))
     application.add_handler(CommandHandler("delete_ad", delete_ad))
     application.add_handler(CommandHandler("moderated", moderated))
     application.add_handler(CommandHandler("add", add_ad))
     application.add_handler(CommandHandler("deny", deny_ad))
+    application.add_handler(CallbackQueryHandler(approve_shown, pattern=r'^moderation:\d+:approve$'))
     application.add_handler(CommandHandler("reviews_content", reviews_content))
     
-    application.run_polling()
+    # Метрики: время и число запросов к БД на каждый обработчик (METRICS_PORT)
+    if metrics.enabled:
+        metrics.instrument_application(application)
+        metrics.register_gauges('bot_db_pool', pool_metrics,
+                                counters=('created', 'closed', 'checkouts', 'failed_checks', 'timeouts', 'recycled'))
+        metrics.register_gauges('bot_search_cache', search_cache.stats,
+                                counters=('hits', 'misses', 'expirations', 'evictions', 'invalidations'))
+        metrics.register_gauges('bot_notifications', dispatcher_stats,
+                                counters=('sent', 'throttled', 'failed', 'retried'))
+        metrics.register_gauges('bot_scheduler', application.scheduler.stats,
+                                counters=('submitted', 'processed', 'failed', 'backpressure_waits'))
+        metrics.register_gauges('bot_cache_bus', cache_bus_stats,
+                                counters=('events', 'skipped', 'errors', 'flushes', 'disconnects'))
+    return application
+
+def start_caches():
+    # Индекс поисков строится, когда шина уже слушает канал: изменения, сделанные
+    # другими процессами во время построения, не теряются
+    start_cache_bus()
+    wait_connected()
+    build_search_index()
+
+def worker_application(worker):
+    # Рабочий процесс кластера: свой пул соединений и свои кэши, которые
+    # шина изменений (cache_bus.py) сбрасывает при записи в других процессах
+    get_pool().fill()
+    start_caches()
+    return build_application(worker)
+
+def main() -> None:
+    get_pool().fill()
+    init_db()
+    if CLUSTER_WORKERS > 1:
+        # Соединения не должны достаться рабочим процессам
+        close_pool()
+        run_cluster(worker_application, TOKEN, base_url=TELEGRAM_API_URL)
+        return
+
+    start_caches()
+    application = build_application()
+    try:
+        # С WEBHOOK_URL обновления принимает встроенный HTTP-сервер, иначе - long polling
+        if webhook.WEBHOOK_URL:
+            webhook.run_webhook(application)
+        else:
+            application.run_polling()
+    finally:
+        shutdown_executor()
+        close_pool()
 
 if __name__ == '__main__':
     main()
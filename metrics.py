@@ -0,0 +1,227 @@
+import os
+import time
+import logging
+import functools
+import threading
+import contextvars
+from collections import defaultdict
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Порт HTTP-эндпоинта /metrics; 0 - метрики выключены и ничего не замеряется
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+# Запросы дольше порога пишутся в лог
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', 200))
+
+enabled = METRICS_PORT > 0
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        # labels -> [счетчики по корзинам..., сумма, количество]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            data = self._values.get(labels)
+            return data[-1] if data else 0
+
+    def total(self, *labels):
+        with self._lock:
+            data = self._values.get(labels)
+            return data[-2] if data else 0
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        names = self.label_names + ('le',)
+        with self._lock:
+            for labels, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {data[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(data[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {data[-1]}")
+        return lines
+
+# ===== Метрики бота =====
+query_duration = Histogram('bot_db_query_duration_seconds', 'Время обращения к БД по функции-вызывающему', ('helper',))
+query_errors = Counter('bot_db_query_errors_total', 'Ошибки обращений к БД', ('helper', 'error'))
+slow_queries = Counter('bot_db_slow_queries_total', 'Обращения к БД дольше DB_SLOW_QUERY_MS', ('helper',))
+update_duration = Histogram('bot_handler_duration_seconds', 'Время обработки обновления', ('handler',))
+update_queries = Histogram('bot_handler_db_queries', 'Обращений к БД на одно обновление', ('handler',), COUNT_BUCKETS)
+handler_errors = Counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler', 'error'))
+scheduler_wait = Histogram('bot_scheduler_wait_seconds', 'Ожидание обновления в очереди планировщика')
+cache_bus_lag = Histogram('bot_cache_bus_lag_seconds', 'Задержка от изменения в БД до получения события шиной кэшей')
+
+METRICS = [query_duration, query_errors, slow_queries, update_duration, update_queries, handler_errors,
+           scheduler_wait, cache_bus_lag]
+
+# Дополнительные значения (пул соединений, кэш, очередь уведомлений):
+# префикс -> (функция, возвращающая dict, ключи-счетчики)
+_gauges = {}
+
+def register_gauges(prefix, collect, counters=()):
+    # counters - ключи, значения которых только растут (попадания, созданные соединения):
+    # отдаются как counter с суффиксом _total, чтобы rate() учитывал перезапуски.
+    # Остальные ключи - текущие значения (gauge)
+    _gauges[prefix] = (collect, frozenset(counters))
+
+def reset():
+    for metric in METRICS:
+        metric.clear()
+
+# Счетчик обращений к БД текущего обновления. run_db копирует контекст в поток,
+# поэтому счетчик (изменяемый список) общий для обработчика и его запросов.
+_update_counter = contextvars.ContextVar('update_counter', default=None)
+
+def observe_query(helper, seconds, query, error=None):
+    query_duration.observe(seconds, helper)
+    counter = _update_counter.get()
+    if counter is not None:
+        counter[0] += 1
+    if error is not None:
+        query_errors.inc(helper, type(error).__name__)
+    if seconds * 1000 >= DB_SLOW_QUERY_MS:
+        slow_queries.inc(helper)
+        logger.warning(f"Медленный запрос в {helper}: {seconds * 1000:.1f} мс: {' '.join(str(query).split())[:300]}")
+
+def instrument(callback):
+    # Обертка обработчика: время, число обращений к БД и исключения на одно обновление
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        counter = [0]
+        token = _update_counter.set(counter)
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            _update_counter.reset(token)
+            update_duration.observe(time.perf_counter() - start, name)
+            update_queries.observe(counter[0], name)
+    return wrapper
+
+def _iter_handlers(handlers):
+    for handler in handlers:
+        # ConversationHandler хранит обработчики шагов внутри себя
+        if hasattr(handler, 'entry_points'):
+            yield from _iter_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                yield from _iter_handlers(state_handlers)
+            yield from _iter_handlers(handler.fallbacks)
+        else:
+            yield handler
+
+def instrument_application(application):
+    seen = set()
+    for group in application.handlers.values():
+        for handler in _iter_handlers(group):
+            if id(handler) not in seen:
+                seen.add(id(handler))
+                handler.callback = instrument(handler.callback)
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for prefix, (collect, counters) in sorted(_gauges.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            logger.error(f"Ошибка сбора метрик {prefix}: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            if key in counters:
+                lines.append(f"# TYPE {prefix}_{key}_total counter")
+                lines.append(f"{prefix}_{key}_total {_number(value)}")
+            else:
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+# ===== HTTP-эндпоинт =====
+async def _handle(request):
+    if request.method == 'GET' and request.path == '/metrics':
+        return 200, render(), 'text/plain; version=0.0.4; charset=utf-8'
+    return 404, 'Not found\n'
+
+_server = None
+
+async def start_server(port=METRICS_PORT, host=METRICS_HOST):
+    global _server
+    _server = await HttpServer(_handle, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{_server.port}/metrics")
+    return _server
+
+async def stop_server():
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
@@ -0,0 +1,395 @@
+import logging
+import psycopg2
+import psycopg2.errors
+from database import get_pool, transaction
+
+logger = logging.getLogger(__name__)
+
+def _require_compacted_searches(cur):
+    # Уникальный индекс нельзя построить поверх дубликатов. Их удаляет отдельная
+    # команда (python compact_searches.py) небольшими пачками без долгих блокировок.
+    cur.execute(
+        "SELECT 1 FROM searches "
+        "GROUP BY user_id, keyword, location, min_price, max_price HAVING count(*) > 1 LIMIT 1"
+    )
+    if cur.fetchone():
+        raise RuntimeError(
+            "В таблице searches есть повторяющиеся поиски. "
+            "Выполните python compact_searches.py и перезапустите бота."
+        )
+
+# Версионированные миграции схемы. Каждая выполняется в отдельной транзакции
+# и записывается в schema_migrations. Уже выпущенные шаги не меняются:
+# изменения схемы добавляются новым шагом в конец списка.
+MIGRATIONS = [
+    (1, "Начальная схема", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ads (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            price NUMERIC NOT NULL,
+            location VARCHAR(255) NOT NULL,
+            contact VARCHAR(50) NOT NULL,
+            status VARCHAR(20) DEFAULT 'moderation',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS searches (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) NOT NULL,
+            keyword VARCHAR(255),
+            location VARCHAR(255),
+            min_price NUMERIC,
+            max_price NUMERIC,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS reviews (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) NOT NULL,
+            type VARCHAR(20) NOT NULL,
+            ad_id INTEGER REFERENCES ads(id),
+            text TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Полнотекстовый поиск по объявлениям", [
+        # Вектор поддерживается самой БД при вставке и изменении
+        """
+        ALTER TABLE ads ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(location, '')), 'B')
+        ) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS ads_search_vector_idx ON ads USING GIN (search_vector) WHERE status = 'active'",
+        # Триграммы для фильтра по местонахождению (ILIKE '%...%')
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ads_location_trgm_idx ON ads USING GIN (location gin_trgm_ops) WHERE status = 'active'",
+    ]),
+    (3, "Очередь уведомлений", [
+        """
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            status VARCHAR(10) NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS notification_outbox_due_idx ON notification_outbox (next_attempt_at) WHERE status = 'pending'",
+    ]),
+    (4, "Индексы для частых запросов", [
+        # get_user: index-only scan без обращения к таблице
+        "CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id_covering_idx ON users (telegram_id) INCLUDE (id)",
+        # get_user_ads
+        "CREATE INDEX IF NOT EXISTS ads_user_id_idx ON ads (user_id)",
+        # search_ads_page без ключевого слова: новые активные объявления первыми
+        "CREATE INDEX IF NOT EXISTS ads_active_created_idx ON ads (created_at DESC, id DESC) WHERE status = 'active'",
+        # get_ads_for_moderation
+        "CREATE INDEX IF NOT EXISTS ads_moderation_idx ON ads (id) WHERE status = 'moderation'",
+        # iter_reviews, iter_content_reports
+        "CREATE INDEX IF NOT EXISTS reviews_type_ad_id_idx ON reviews (type, ad_id)",
+        # delete_ad_db удаляет отзывы по ad_id
+        "CREATE INDEX IF NOT EXISTS reviews_ad_id_idx ON reviews (ad_id)",
+        # build_search_index и лимиты поисков пользователя
+        "CREATE INDEX IF NOT EXISTS searches_user_id_idx ON searches (user_id)",
+    ]),
+    (5, "Уникальные сохраненные поиски", [
+        _require_compacted_searches,
+        # NULLS NOT DISTINCT (PostgreSQL 15): поиск без цены тоже уникален
+        "CREATE UNIQUE INDEX IF NOT EXISTS searches_user_unique_idx "
+        "ON searches (user_id, keyword, location, min_price, max_price) NULLS NOT DISTINCT",
+        # Вытеснение самых старых поисков пользователя
+        "CREATE INDEX IF NOT EXISTS searches_user_created_idx ON searches (user_id, created_at DESC, id DESC)",
+    ]),
+    (6, "Состояние диалогов бота", [
+        # Данные сериализуются pickle (persistence.py)
+        """
+        CREATE TABLE IF NOT EXISTS persistence_user_data (
+            user_id BIGINT PRIMARY KEY,
+            data BYTEA NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS persistence_chat_data (
+            chat_id BIGINT PRIMARY KEY,
+            data BYTEA NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS persistence_conversations (
+            name VARCHAR(64) NOT NULL,
+            key BIGINT[] NOT NULL,
+            state BYTEA NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (name, key)
+        )
+        """,
+    ]),
+    (7, "Поиск по диапазону цены", [
+        # Фильтр цены в search_ads_page и подсчет по ценовым диапазонам (search_price_facets)
+        "CREATE INDEX IF NOT EXISTS ads_status_price_idx ON ads (status, price)",
+    ]),
+    (8, "Справочник местоположений", [
+        # Названия в каноническом виде utils.canonical_location: "г. Москва " -> "москва"
+        """
+        CREATE TABLE IF NOT EXISTS locations (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) UNIQUE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS location_aliases (
+            alias VARCHAR(255) PRIMARY KEY,
+            location_id INTEGER REFERENCES locations(id) NOT NULL
+        )
+        """,
+        "INSERT INTO locations (name) VALUES ('москва'), ('санкт-петербург') ON CONFLICT (name) DO NOTHING",
+        """
+        INSERT INTO location_aliases (alias, location_id)
+        SELECT a.alias, l.id FROM (VALUES
+            ('мск', 'москва'), ('спб', 'санкт-петербург'), ('питер', 'санкт-петербург'),
+            ('санкт петербург', 'санкт-петербург')
+        ) a (alias, name) JOIN locations l ON l.name = a.name
+        ON CONFLICT (alias) DO NOTHING
+        """,
+        # Существующие строки заполняет python backfill_locations.py пачками
+        "ALTER TABLE ads ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES locations(id)",
+        "ALTER TABLE searches ADD COLUMN IF NOT EXISTS location_id INTEGER REFERENCES locations(id)",
+        # Фильтр по местонахождению - равенство по location_id вместо ILIKE по тексту
+        "CREATE INDEX IF NOT EXISTS ads_active_location_idx ON ads (location_id, created_at DESC, id DESC) "
+        "WHERE status = 'active'",
+        "CREATE INDEX IF NOT EXISTS searches_location_id_idx ON searches (location_id)",
+        "DROP INDEX IF EXISTS ads_location_trgm_idx",
+    ]),
+    (9, "События изменений для сброса кэшей", [
+        # Одно уведомление на оператор (не на строку) в канал cache_events; его слушают
+        # все процессы бота (cache_bus.py). Доставляется после фиксации транзакции.
+        # ids - затронутые id (NULL - слишком много, затронута вся таблица), active - среди
+        # объявлений до или после изменения есть активные (от них зависит кэш поиска),
+        # origin - application_name соединения, чтобы процесс пропускал свои же события
+        """
+        CREATE OR REPLACE FUNCTION notify_cache_event() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            ids INTEGER[];
+            active BOOLEAN := FALSE;
+        BEGIN
+            IF TG_TABLE_NAME <> 'location_aliases' THEN
+                SELECT array_agg(id) INTO ids FROM (SELECT id FROM changed LIMIT 501) c;
+                IF ids IS NULL THEN
+                    RETURN NULL;
+                END IF;
+                IF array_length(ids, 1) > 500 THEN
+                    ids := NULL;
+                END IF;
+                IF TG_TABLE_NAME = 'ads' THEN
+                    active := EXISTS (SELECT 1 FROM changed WHERE status = 'active');
+                    IF TG_OP = 'UPDATE' AND NOT active THEN
+                        active := EXISTS (SELECT 1 FROM previous WHERE status = 'active');
+                    END IF;
+                END IF;
+            END IF;
+            PERFORM pg_notify('cache_events', json_build_object(
+                'table', TG_TABLE_NAME,
+                'op', lower(TG_OP),
+                'ids', ids,
+                'active', active,
+                'at', extract(epoch FROM clock_timestamp()),
+                'origin', current_setting('application_name')
+            )::text);
+            RETURN NULL;
+        END
+        $$
+        """,
+        "CREATE OR REPLACE TRIGGER ads_cache_insert AFTER INSERT ON ads "
+        "REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE OR REPLACE TRIGGER ads_cache_update AFTER UPDATE ON ads "
+        "REFERENCING OLD TABLE AS previous NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE OR REPLACE TRIGGER ads_cache_delete AFTER DELETE ON ads "
+        "REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE OR REPLACE TRIGGER searches_cache_insert AFTER INSERT ON searches "
+        "REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE OR REPLACE TRIGGER searches_cache_update AFTER UPDATE ON searches "
+        "REFERENCING OLD TABLE AS previous NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE OR REPLACE TRIGGER searches_cache_delete AFTER DELETE ON searches "
+        "REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        # Синонимы местоположений меняются вручную; кэш справочника сбрасывается целиком
+        "CREATE OR REPLACE TRIGGER location_aliases_cache AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE "
+        "ON location_aliases FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+    ]),
+    (10, "Сводка и постраничный вывод отзывов", [
+        # Число отзывов и время последнего по типу и товару; ad_id = 0 - отзывы без товара
+        # (о боте, жалобы). Обновляется тем же запросом, что добавляет отзыв (create_review)
+        """
+        CREATE TABLE IF NOT EXISTS review_aggregates (
+            type VARCHAR(20) NOT NULL,
+            ad_id INTEGER NOT NULL DEFAULT 0,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            last_review_at TIMESTAMP,
+            PRIMARY KEY (type, ad_id)
+        )
+        """,
+        # До конца миграции отзывы не добавляются, иначе сводка разойдется с таблицей
+        "LOCK TABLE reviews IN SHARE MODE",
+        """
+        INSERT INTO review_aggregates (type, ad_id, review_count, last_review_at)
+        SELECT type, coalesce(ad_id, 0), count(*), max(created_at) FROM reviews GROUP BY 1, 2
+        ON CONFLICT (type, ad_id) DO UPDATE
+        SET review_count = EXCLUDED.review_count, last_review_at = EXCLUDED.last_review_at
+        """,
+        # get_reviews_page: новые первыми, keyset по (created_at, id)
+        "CREATE INDEX IF NOT EXISTS reviews_listing_idx ON reviews (type, ad_id, created_at DESC, id DESC)",
+        "DROP INDEX IF EXISTS reviews_type_ad_id_idx",
+    ]),
+    (11, "Секционирование объявлений по статусу", [
+        # Активные объявления (весь поиск) лежат в своей секции и не делят таблицу и индексы
+        # с отклоненными; смена статуса сама переносит строку в нужную секцию. Первичный
+        # ключ секционированной таблицы включает ключ секционирования, поэтому он (id, status),
+        # а внешний ключ reviews.ad_id снимается: id по-прежнему выдает одна ads_id_seq,
+        # объявление отзыва проверяет utils.create_review, отзывы архивных удаляет archive_ads.py.
+        # Таблица переписывается целиком под блокировкой - на время миграции бот остановлен
+        "LOCK TABLE ads IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE reviews DROP CONSTRAINT IF EXISTS reviews_ad_id_fkey",
+        "ALTER SEQUENCE ads_id_seq OWNED BY NONE",
+        "ALTER TABLE ads RENAME TO ads_unpartitioned",
+        "ALTER INDEX ads_pkey RENAME TO ads_unpartitioned_pkey",
+        """
+        CREATE TABLE ads (
+            id INTEGER NOT NULL DEFAULT nextval('ads_id_seq'),
+            user_id INTEGER REFERENCES users(id) NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            price NUMERIC NOT NULL,
+            location VARCHAR(255) NOT NULL,
+            contact VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'moderation',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('russian', coalesce(location, '')), 'B')
+            ) STORED,
+            location_id INTEGER REFERENCES locations(id),
+            PRIMARY KEY (id, status)
+        ) PARTITION BY LIST (status)
+        """,
+        "CREATE TABLE ads_active PARTITION OF ads FOR VALUES IN ('active')",
+        "CREATE TABLE ads_pending PARTITION OF ads FOR VALUES IN ('moderation', 'draft')",
+        "CREATE TABLE ads_rejected PARTITION OF ads FOR VALUES IN ('rejected')",
+        "CREATE TABLE ads_other PARTITION OF ads DEFAULT",
+        """
+        INSERT INTO ads (id, user_id, title, price, location, contact, status, created_at, updated_at, location_id)
+        SELECT id, user_id, title, price, location, contact, coalesce(status, 'moderation'),
+               created_at, updated_at, location_id
+        FROM ads_unpartitioned
+        """,
+        "DROP TABLE ads_unpartitioned",
+        "ALTER SEQUENCE ads_id_seq OWNED BY ads.id",
+        # get_user_ads: индекс на каждой секции
+        "CREATE INDEX ads_user_id_idx ON ads (user_id)",
+        # Индексы поиска - только на секции активных, условие status = 'active' больше не нужно
+        "CREATE INDEX ads_active_created_idx ON ads_active (created_at DESC, id DESC)",
+        "CREATE INDEX ads_active_location_idx ON ads_active (location_id, created_at DESC, id DESC)",
+        "CREATE INDEX ads_active_price_idx ON ads_active (price)",
+        "CREATE INDEX ads_search_vector_idx ON ads_active USING GIN (search_vector)",
+        "CREATE INDEX ads_moderation_idx ON ads_pending (id) WHERE status = 'moderation'",
+        # archive_ads.py: самые давно отклоненные первыми
+        "CREATE INDEX ads_rejected_updated_idx ON ads_rejected (updated_at, id)",
+        # Триггеры шины кэшей (миграция 9) удалены вместе с прежней таблицей
+        "CREATE TRIGGER ads_cache_insert AFTER INSERT ON ads "
+        "REFERENCING NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE TRIGGER ads_cache_update AFTER UPDATE ON ads "
+        "REFERENCING OLD TABLE AS previous NEW TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        "CREATE TRIGGER ads_cache_delete AFTER DELETE ON ads "
+        "REFERENCING OLD TABLE AS changed FOR EACH STATEMENT EXECUTE FUNCTION notify_cache_event()",
+        # Холодный архив давно отклоненных объявлений (archive_ads.py)
+        """
+        CREATE TABLE IF NOT EXISTS ads_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            price NUMERIC NOT NULL,
+            location VARCHAR(255) NOT NULL,
+            contact VARCHAR(50) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            location_id INTEGER REFERENCES locations(id),
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "ANALYZE ads",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Ключ advisory-блокировки: несколько процессов не применяют миграции одновременно
+MIGRATION_LOCK_KEY = 727001
+
+def current_version():
+    # Одна проверка при старте; отсутствие таблицы означает пустую БД
+    with get_pool().connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT coalesce(max(version), 0) FROM schema_migrations")
+                return cur.fetchone()[0]
+        except psycopg2.errors.UndefinedTable:
+            return 0
+        finally:
+            conn.rollback()
+
+def migrate(migrations=MIGRATIONS):
+    latest = migrations[-1][0]
+    version = current_version()
+    if version >= latest:
+        return version
+
+    with transaction() as cur:
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "    version INTEGER PRIMARY KEY,"
+            "    name TEXT NOT NULL,"
+            "    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+            ")"
+        )
+
+    for step, name, statements in migrations:
+        if step <= version:
+            continue
+        with transaction() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            # Другой процесс мог применить шаг, пока мы ждали блокировку
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (step,))
+            if cur.fetchone():
+                continue
+            logger.info(f"Применяется миграция {step}: {name}")
+            for statement in statements:
+                if callable(statement):
+                    statement(cur)
+                else:
+                    cur.execute(statement)
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (step, name))
+        version = step
+    return version
@@ -0,0 +1,159 @@
+import os
+import asyncio
+import logging
+from collections import Counter
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from async_db import (claim_notifications, mark_notifications_sent,
+                      reschedule_notification, fail_notification)
+
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+NOTIFY_GLOBAL_RATE = float(os.getenv('NOTIFY_GLOBAL_RATE', 30))
+NOTIFY_CHAT_RATE = float(os.getenv('NOTIFY_CHAT_RATE', 1))
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 10))
+NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', 100))
+NOTIFY_POLL_INTERVAL = float(os.getenv('NOTIFY_POLL_INTERVAL', 5))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', 5))
+# Сколько секунд захваченная пачка недоступна другим процессам
+NOTIFY_LEASE = float(os.getenv('NOTIFY_LEASE', 60))
+
+class RateLimiter:
+    # Равномерно распределяет события: не чаще rate в секунду
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._next = max(self._next, loop.time() + seconds)
+
+    async def acquire(self):
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class ChatRateLimiter:
+    def __init__(self, rate):
+        self.rate = rate
+        self._chats = {}
+
+    async def acquire(self, chat_id):
+        limiter = self._chats.get(chat_id)
+        if limiter is None:
+            if len(self._chats) > 10000:
+                self._cleanup()
+            limiter = self._chats[chat_id] = RateLimiter(self.rate)
+        await limiter.acquire()
+
+    def _cleanup(self):
+        now = asyncio.get_running_loop().time()
+        self._chats = {chat_id: limiter for chat_id, limiter in self._chats.items() if limiter._next > now}
+
+class NotificationDispatcher:
+    def __init__(self, bot, global_rate=NOTIFY_GLOBAL_RATE, chat_rate=NOTIFY_CHAT_RATE,
+                 concurrency=NOTIFY_CONCURRENCY, batch_size=NOTIFY_BATCH_SIZE,
+                 poll_interval=NOTIFY_POLL_INTERVAL, max_attempts=NOTIFY_MAX_ATTEMPTS,
+                 lease=NOTIFY_LEASE):
+        self.bot = bot
+        self.global_limiter = RateLimiter(global_rate)
+        self.chat_limiter = ChatRateLimiter(chat_rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.stats = Counter()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                claimed = await self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки уведомлений: {e}")
+                claimed = 0
+            if claimed < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def dispatch_once(self):
+        batch = await claim_notifications(self.batch_size, self.lease)
+        if not batch:
+            return 0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*(self._send(semaphore, item) for item in batch))
+        sent_ids = [item[0] for item, ok in zip(batch, results) if ok]
+        await mark_notifications_sent(sent_ids)
+        return len(batch)
+
+    async def _send(self, semaphore, item):
+        notification_id, chat_id, text, attempts = item
+        async with semaphore:
+            await self.chat_limiter.acquire(chat_id)
+            await self.global_limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                self.stats['sent'] += 1
+                return True
+            except RetryAfter as e:
+                # Флуд-контроль действует на весь бот: приостанавливаем все отправки
+                delay = float(e.retry_after)
+                self.global_limiter.pause(delay)
+                self.stats['throttled'] += 1
+                await reschedule_notification(notification_id, delay, str(e))
+            except (Forbidden, BadRequest) as e:
+                # Бот заблокирован или чат не существует: повтор не поможет
+                self.stats['failed'] += 1
+                await fail_notification(notification_id, str(e))
+            except Exception as e:
+                if attempts + 1 >= self.max_attempts:
+                    self.stats['failed'] += 1
+                    await fail_notification(notification_id, str(e))
+                else:
+                    self.stats['retried'] += 1
+                    await reschedule_notification(notification_id, min(5 * 2 ** attempts, 3600), str(e))
+                logger.error(f"Ошибка отправки уведомления: {e}")
+            return False
+
+_dispatcher = None
+
+def start_dispatcher(bot, **kwargs):
+    global _dispatcher
+    _dispatcher = NotificationDispatcher(bot, **kwargs)
+    _dispatcher.start()
+    return _dispatcher
+
+async def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+def wake_dispatcher():
+    if _dispatcher is not None:
+        _dispatcher.wake()
+
+def dispatcher_stats():
+    return dict(_dispatcher.stats) if _dispatcher is not None else {}
@@ -0,0 +1,214 @@
+import os
+import pickle
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+from psycopg2.extras import execute_values
+from database import execute_query, transaction
+from async_db import run_db
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передает измененные данные в хранилище, секунд
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', 5))
+# Изменения, пришедшие почти одновременно (один проход Application), пишутся одной транзакцией
+FLUSH_DELAY = 0.05
+
+def dumps(data):
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+def loads(blob):
+    return pickle.loads(bytes(blob))
+
+def load_data(chat_id=None, user_id=None):
+    # Данные чата и пользователя одним запросом (в личном чате chat_id == user_id).
+    # None - ошибка БД: данные не считаются загруженными и запрашиваются повторно.
+    rows = execute_query(
+        "SELECT 'chat', data FROM persistence_chat_data WHERE chat_id = %s "
+        "UNION ALL SELECT 'user', data FROM persistence_user_data WHERE user_id = %s",
+        (chat_id, user_id), fetch=True
+    )
+    if rows is None:
+        return None
+    return {kind: loads(data) for kind, data in rows}
+
+def load_conversations(name):
+    rows = execute_query(
+        "SELECT key, state FROM persistence_conversations WHERE name = %s", (name,), fetch=True
+    )
+    # Состояние хранится как кортеж из одного элемента, чтобы отличать его от удаления
+    return {tuple(key): loads(state)[0] for key, state in rows or []}
+
+def write_batch(users, chats, conversations):
+    # users/chats: id -> сериализованные данные или None (удалить);
+    # conversations: (name, key) -> сериализованное состояние или None (диалог завершен)
+    with transaction() as cur:
+        for table, column, changes in (('persistence_user_data', 'user_id', users),
+                                       ('persistence_chat_data', 'chat_id', chats)):
+            upserts = [(key, data) for key, data in changes.items() if data is not None]
+            deletes = [key for key, data in changes.items() if data is None]
+            if upserts:
+                execute_values(
+                    cur,
+                    f"INSERT INTO {table} ({column}, data) VALUES %s "
+                    f"ON CONFLICT ({column}) DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP",
+                    upserts
+                )
+            if deletes:
+                cur.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", (deletes,))
+
+        upserts = [(name, list(key), state) for (name, key), state in conversations.items() if state is not None]
+        deletes = [(name, list(key)) for (name, key), state in conversations.items() if state is None]
+        if upserts:
+            execute_values(
+                cur,
+                "INSERT INTO persistence_conversations (name, key, state) VALUES %s "
+                "ON CONFLICT (name, key) DO UPDATE SET state = EXCLUDED.state, updated_at = CURRENT_TIMESTAMP",
+                upserts,
+                template="(%s, %s::bigint[], %s)"
+            )
+        if deletes:
+            execute_values(
+                cur,
+                "DELETE FROM persistence_conversations c USING (VALUES %s) AS d (name, key) "
+                "WHERE c.name = d.name AND c.key = d.key",
+                deletes,
+                template="(%s, %s::bigint[])"
+            )
+
+class PostgresPersistence(BasePersistence):
+    # Состояния ConversationHandler, user_data и chat_data в PostgreSQL.
+    # Состояния диалогов загружаются при старте (их немного), user_data и chat_data -
+    # при первом обновлении от пользователя/чата. Записи копятся в памяти и пишутся
+    # пачкой, поэтому обычное сообщение не добавляет обращений к БД.
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self._loaded_users = set()
+        self._loaded_chats = set()
+        self._prefetched = {}
+        # Хэш последней переданной на запись версии: неизмененные данные повторно не пишутся
+        self._written = {}
+        self._dirty_users = {}
+        self._dirty_chats = {}
+        self._dirty_conversations = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    # ===== Загрузка =====
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return await run_db(load_conversations, name)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        # Вызывается перед refresh_user_data; в личном чате заодно загружается user_data
+        if chat_id in self._loaded_chats:
+            return
+        user_id = chat_id if chat_id > 0 and chat_id not in self._loaded_users else None
+        stored = await run_db(load_data, chat_id, user_id)
+        if stored is None:
+            return
+        self._loaded_chats.add(chat_id)
+        self._apply('chat', chat_id, chat_data, stored.get('chat'))
+        if user_id is not None:
+            self._prefetched[user_id] = stored.get('user')
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded_users:
+            return
+        if user_id in self._prefetched:
+            stored = self._prefetched.pop(user_id)
+        else:
+            loaded = await run_db(load_data, None, user_id)
+            if loaded is None:
+                return
+            stored = loaded.get('user')
+        self._loaded_users.add(user_id)
+        self._apply('user', user_id, user_data, stored)
+
+    def _apply(self, kind, key, data, stored):
+        if stored:
+            self._written[(kind, key)] = hash(dumps(stored))
+            # Данные, измененные до загрузки, важнее сохраненных
+            data.update({name: value for name, value in stored.items() if name not in data})
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ===== Запись =====
+    def _mark(self, dirty, kind, key, data):
+        blob = dumps(data) if data else None
+        digest = hash(blob)
+        if self._written.get((kind, key)) == digest:
+            return
+        dirty[key] = blob
+        self._written[(kind, key)] = digest
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def update_user_data(self, user_id, data):
+        self._mark(self._dirty_users, 'user', user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark(self._dirty_chats, 'chat', chat_id, data)
+
+    async def update_conversation(self, name, key, new_state):
+        self._mark(self._dirty_conversations, 'conversation', (name, key),
+                   None if new_state is None else (new_state,))
+
+    async def drop_user_data(self, user_id):
+        self._mark(self._dirty_users, 'user', user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark(self._dirty_chats, 'chat', chat_id, None)
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self._write()
+
+    async def _write(self):
+        async with self._write_lock:
+            users, self._dirty_users = self._dirty_users, {}
+            chats, self._dirty_chats = self._dirty_chats, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not (users or chats or conversations):
+                return
+            try:
+                await run_db(write_batch, users, chats, conversations)
+            except Exception as e:
+                logger.error(f"Ошибка записи состояния бота: {e}")
+                # Возвращаем изменения, если за это время не пришли более новые
+                for dirty, failed in ((self._dirty_users, users), (self._dirty_chats, chats),
+                                      (self._dirty_conversations, conversations)):
+                    for key, blob in failed.items():
+                        dirty.setdefault(key, blob)
+                self._written.clear()
+                asyncio.get_running_loop().call_later(self.update_interval, self._schedule_flush)
+
+    async def flush(self):
+        # Вызывается в Application.stop() после последнего update_persistence
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._write()
@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from telegram.ext import Application
+# Сигнал остановки, который Application.stop() кладет в update_queue (версия PTB закреплена)
+from telegram.ext._application import _STOP_SIGNAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно (разных пользователей)
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 8))
+# Сколько обновлений может ждать обработки; при переполнении прием новых приостанавливается
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', 1000))
+
+def update_key(update):
+    # Обновления одного пользователя (или чата, если пользователя нет) обрабатываются строго
+    # по порядку: от этого зависят шаги ConversationHandler
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return ('user', user.id)
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return ('chat', chat.id)
+    return ('update', id(update))
+
+class UpdateScheduler:
+    def __init__(self, process, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING, key=update_key):
+        if workers < 1 or max_pending < 1:
+            raise ValueError("Некорректные параметры планировщика")
+        self._process = process
+        self._key = key
+        self.workers = workers
+        self.max_pending = max_pending
+        # key -> очередь (обновление, время постановки). Ключ присутствует, пока у пользователя
+        # есть необработанные обновления; в _ready он стоит не более одного раза.
+        self._queues = {}
+        self._ready = asyncio.Queue()
+        self._pending = 0
+        self._changed = asyncio.Condition()
+        self._tasks = []
+        self._stats = {'submitted': 0, 'processed': 0, 'failed': 0, 'backpressure_waits': 0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, update):
+        async with self._changed:
+            if self._pending >= self.max_pending:
+                self._stats['backpressure_waits'] += 1
+                await self._changed.wait_for(lambda: self._pending < self.max_pending)
+            self._pending += 1
+            self._stats['submitted'] += 1
+        key = self._key(update)
+        queue = self._queues.get(key)
+        if queue is None:
+            self._queues[key] = deque([(update, time.monotonic())])
+            self._ready.put_nowait(key)
+        else:
+            queue.append((update, time.monotonic()))
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            update, enqueued_at = queue.popleft()
+            if metrics.enabled:
+                metrics.scheduler_wait.observe(time.monotonic() - enqueued_at)
+            try:
+                await self._process(update)
+                self._stats['processed'] += 1
+            except Exception as e:
+                self._stats['failed'] += 1
+                logger.error(f"Ошибка обработки обновления: {e}")
+            # Следующее обновление этого пользователя встает в конец общей очереди,
+            # чтобы активный пользователь не занимал обработчик надолго
+            if queue:
+                self._ready.put_nowait(key)
+            else:
+                del self._queues[key]
+            async with self._changed:
+                self._pending -= 1
+                self._changed.notify_all()
+
+    async def join(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._pending == 0)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['pending'] = self._pending
+        stats['active_keys'] = len(self._queues)
+        return stats
+
+class ScheduledApplication(Application):
+    # Application, в котором обновления разных пользователей обрабатываются параллельно
+    # пулом из UPDATE_WORKERS задач, а обновления одного пользователя - по порядку.
+    # Подключается через Application.builder().application_class(ScheduledApplication).
+    def __init__(self, *, workers=UPDATE_WORKERS, max_pending=UPDATE_MAX_PENDING, **kwargs):
+        super().__init__(**kwargs)
+        self.scheduler = UpdateScheduler(self._process_scheduled, workers, max_pending)
+
+    async def _process_scheduled(self, update):
+        try:
+            await self.process_update(update)
+        finally:
+            self.update_queue.task_done()
+
+    async def _update_fetcher(self):
+        self.scheduler.start()
+        while True:
+            try:
+                update = await self.update_queue.get()
+                if update is _STOP_SIGNAL:
+                    # Application.stop(): дорабатываем принятые обновления
+                    await self.scheduler.join()
+                    await self.scheduler.stop()
+                    self.update_queue.task_done()
+                    return
+                await self.scheduler.submit(update)
+            except asyncio.CancelledError:
+                # Как и в Application: цикл завершается только через stop()
+                logger.warning("Получение обновлений прервано; остановка возможна только через Application.stop")
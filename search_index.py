@@ -0,0 +1,247 @@
+import re
+import threading
+from collections import Counter
+
+# Индекс сохраненных поисков для обратного сопоставления: по новому объявлению
+# находит поиски, которые оно удовлетворяет, с той же семантикой, что и
+# utils.get_matching_searches:
+#   (keyword IS NOT NULL AND (title ILIKE '%kw%' OR location ILIKE '%kw%'))
+#   OR location_id = ad_location_id
+#   OR ((min_price IS NOT NULL OR max_price IS NOT NULL)
+#       AND price BETWEEN coalesce(min_price, -inf) AND coalesce(max_price, +inf))
+# Строка поиска: (id, user_id, keyword, location_id, min_price, max_price, ...)
+
+LIKE_SPECIAL = ('%', '_', '\\')
+
+NEG_INF = float('-inf')
+POS_INF = float('inf')
+
+def like_to_regex(pattern):
+    # Перевод шаблона LIKE в регулярное выражение (экранирование через '\')
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        if c == '%':
+            parts.append('.*')
+        elif c == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+class SubstringIndex:
+    # Иглы (подстроки) -> id поисков. Текст проверяется окнами только тех длин,
+    # которые есть среди игл, поэтому стоимость не зависит от числа поисков.
+    def __init__(self):
+        self._needles = {}
+        self._lengths = Counter()
+        # Иглы со спецсимволами LIKE сопоставляются регулярным выражением
+        self._patterns = {}
+
+    def add(self, needle, search_id):
+        if any(c in needle for c in LIKE_SPECIAL):
+            self._patterns[search_id] = like_to_regex('%' + needle + '%')
+            return
+        key = needle.lower()
+        ids = self._needles.setdefault(key, set())
+        if not ids:
+            self._lengths[len(key)] += 1
+        ids.add(search_id)
+
+    def remove(self, needle, search_id):
+        if self._patterns.pop(search_id, None) is not None:
+            return
+        key = needle.lower()
+        ids = self._needles.get(key)
+        if not ids:
+            return
+        ids.discard(search_id)
+        if not ids:
+            del self._needles[key]
+            self._lengths[len(key)] -= 1
+            if not self._lengths[len(key)]:
+                del self._lengths[len(key)]
+
+    def match(self, text, result):
+        if text is None:
+            return
+        low = text.lower()
+        for length in self._lengths:
+            if length > len(low):
+                continue
+            seen = set()
+            for i in range(len(low) - length + 1):
+                window = low[i:i + length]
+                if window in seen:
+                    continue
+                seen.add(window)
+                ids = self._needles.get(window)
+                if ids:
+                    result.update(ids)
+        for search_id, regex in self._patterns.items():
+            if regex.fullmatch(text):
+                result.add(search_id)
+
+class IntervalTree:
+    # Статическое центрированное дерево интервалов [lo, hi]
+    def __init__(self, intervals):
+        self._root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(p for lo, hi, _ in intervals for p in (lo, hi))
+        center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for item in intervals:
+            if item[1] < center:
+                left.append(item)
+            elif item[0] > center:
+                right.append(item)
+            else:
+                here.append(item)
+        return (
+            center,
+            sorted(here, key=lambda item: item[0]),
+            sorted(here, key=lambda item: item[1], reverse=True),
+            self._build(left),
+            self._build(right),
+        )
+
+    def stab(self, point, result):
+        node = self._root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for lo, hi, value in by_start:
+                    if lo > point:
+                        break
+                    result.add(value)
+                node = left
+            elif point > center:
+                for lo, hi, value in by_end:
+                    if hi < point:
+                        break
+                    result.add(value)
+                node = right
+            else:
+                result.update(value for _, _, value in by_start)
+                return
+
+class PriceIndex:
+    # Дерево интервалов, которое перестраивается лениво: новые интервалы сначала
+    # попадают в небольшой буфер, удаленные и измененные отсекаются по множеству id,
+    # чья запись в дереве устарела (id, добавленный заново, ищется в буфере)
+    def __init__(self):
+        self._intervals = {}
+        self._tree = IntervalTree([])
+        self._pending = {}
+        self._stale = set()
+
+    def add(self, lo, hi, search_id):
+        self.remove(search_id)
+        if lo > hi:
+            return
+        self._intervals[search_id] = (lo, hi)
+        self._pending[search_id] = (lo, hi)
+
+    def remove(self, search_id):
+        if self._intervals.pop(search_id, None) is not None:
+            if self._pending.pop(search_id, None) is None:
+                self._stale.add(search_id)
+
+    def _maybe_rebuild(self):
+        limit = 64 + int(len(self._intervals) ** 0.5)
+        if len(self._pending) > limit or len(self._stale) > limit:
+            self._tree = IntervalTree((lo, hi, i) for i, (lo, hi) in self._intervals.items())
+            self._pending = {}
+            self._stale = set()
+
+    def match(self, point, result):
+        if point is None:
+            return
+        self._maybe_rebuild()
+        found = set()
+        self._tree.stab(point, found)
+        if self._stale:
+            found.difference_update(self._stale)
+        result.update(found)
+        for search_id, (lo, hi) in self._pending.items():
+            if lo <= point <= hi:
+                result.add(search_id)
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        self._rows = {}
+        self._keywords = SubstringIndex()
+        # location_id -> id поисков
+        self._locations = {}
+        self._prices = PriceIndex()
+
+    def rebuild(self, rows):
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._add(row)
+            self.ready = True
+
+    def add(self, row):
+        with self._lock:
+            self._remove(row[0])
+            self._add(row)
+
+    def remove(self, search_id):
+        with self._lock:
+            self._remove(search_id)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _add(self, row):
+        search_id, _, keyword, location_id, min_price, max_price = row[:6]
+        self._rows[search_id] = row
+        if keyword is not None:
+            self._keywords.add(keyword, search_id)
+        if location_id is not None:
+            self._locations.setdefault(location_id, set()).add(search_id)
+        # Открытая граница диапазона цены - бесконечность
+        if min_price is not None or max_price is not None:
+            self._prices.add(NEG_INF if min_price is None else min_price,
+                             POS_INF if max_price is None else max_price, search_id)
+
+    def _remove(self, search_id):
+        row = self._rows.pop(search_id, None)
+        if row is None:
+            return
+        if row[2] is not None:
+            self._keywords.remove(row[2], search_id)
+        ids = self._locations.get(row[3])
+        if ids is not None:
+            ids.discard(search_id)
+            if not ids:
+                del self._locations[row[3]]
+        self._prices.remove(search_id)
+
+    def match(self, title, location, price, location_id=None):
+        # location - текст объявления (для ключевых слов), location_id - его id в справочнике
+        found = set()
+        with self._lock:
+            self._keywords.match(title, found)
+            self._keywords.match(location, found)
+            found.update(self._locations.get(location_id, ()))
+            self._prices.match(price, found)
+            return [self._rows[search_id] for search_id in sorted(found)]
+
+# Общий индекс процесса; заполняется utils.build_search_index() при старте
+search_index = SearchIndex()
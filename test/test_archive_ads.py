@@ -0,0 +1,84 @@
+import os
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+import psycopg2.errors
+from archive_ads import archive_rejected
+
+class FakeCursor:
+    def __init__(self, results):
+        self.results = results
+        self.params = []
+        self.rowcount = 0
+
+    def execute(self, query, params):
+        self.params.append(params)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        self.rowcount = result
+
+class TestArchiveRejected(unittest.TestCase):
+    def run_archive(self, results, **kwargs):
+        cursor = FakeCursor(results)
+
+        @contextmanager
+        def transaction():
+            yield cursor
+
+        with patch('archive_ads.transaction', transaction):
+            return archive_rejected(**kwargs), cursor
+
+    def test_batches_until_a_short_one(self):
+        total, cursor = self.run_archive([100, 100, 30], older_than_days=30, batch_rows=100)
+        self.assertEqual(total, 230)
+        self.assertEqual(cursor.params, [('rejected', 'rejected', 30, 100, 'ad')] * 3)
+
+    def test_serialization_failure_repeats_the_batch(self):
+        moved = psycopg2.errors.SerializationFailure()
+        total, cursor = self.run_archive([moved, 10], batch_rows=100)
+        self.assertEqual((total, len(cursor.params)), (10, 2))
+        with self.assertRaises(psycopg2.errors.SerializationFailure):
+            self.run_archive([moved] * 4, batch_rows=100)
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestPartitionsAgainstDatabase(unittest.TestCase):
+    def test_status_change_moves_row_and_archive_takes_old_rejected(self):
+        import utils
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        def partition(ad_id):
+            rows = execute_query("SELECT tableoid::regclass::text FROM ads WHERE id = %s", (ad_id,), fetch=True)
+            return rows[0][0] if rows else None
+
+        use_bench_schema('test_archive_ads')
+        try:
+            utils.init_db()
+            user_id = utils.create_user(8001, 'owner', 'Имя', None)
+            ad_ids = [utils.create_ad(user_id, f'Платье {i}', 1000, 'Москва', '@owner') for i in range(3)]
+            self.assertEqual(partition(ad_ids[0]), 'ads_pending')
+            utils.publish_ads(ad_ids[:1])
+            self.assertEqual(partition(ad_ids[0]), 'ads_active')
+            utils.set_ads_status(ad_ids[1:], 'rejected')
+            self.assertEqual(partition(ad_ids[1]), 'ads_rejected')
+
+            self.assertTrue(utils.create_review(user_id, 'ad', "отзыв", ad_id=ad_ids[1]))
+
+            # Отклонено давно только одно объявление
+            execute_query("UPDATE ads SET updated_at = updated_at - INTERVAL '40 days' WHERE id = %s", (ad_ids[1],))
+            self.assertEqual(archive_rejected(older_than_days=30, batch_rows=1), 1)
+            self.assertIsNone(partition(ad_ids[1]))
+            self.assertEqual(partition(ad_ids[2]), 'ads_rejected')
+            self.assertEqual(execute_query("SELECT id, status FROM ads_archive", fetch=True), [(ad_ids[1], 'rejected')])
+            # Отзывы перенесенного объявления удалены вместе со сводкой, новые не принимаются
+            self.assertEqual(execute_query("SELECT count(*) FROM reviews WHERE ad_id = %s", (ad_ids[1],), fetch=True),
+                             [(0,)])
+            self.assertEqual(utils.get_review_summary('ad', ad_ids[1]), (0, None))
+            self.assertFalse(utils.create_review(user_id, 'ad', "поздно", ad_id=ad_ids[1]))
+            self.assertEqual(archive_rejected(older_than_days=30), 0)
+        finally:
+            drop_bench_schema('test_archive_ads')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,52 @@
+import datetime
 import unittest
 from unittest.mock import patch, MagicMock, AsyncMock
+import handlers
 from handlers import *
 from utils import *
 from telegram import Update, Message, User, Chat
 from models import *
 
 # Вспомогательные функции для создания объектов Telegram
+class FakeMessage(Message):
+    # Подкласс без __slots__, чтобы подменить reply_text моком
+    pass
+
 def make_update(text: str, user_id: int, username: str = "test_user") -> Update:
     user = User(id=user_id, first_name="Test", is_bot=False, username=username)
-    message = Message(message_id=1, date=None, chat=Chat(id=1, type='private'), text=text)
-    message.from_user = user
+    message = FakeMessage(message_id=1, date=None, chat=Chat(id=1, type='private'), text=text, from_user=user)
+    with message._unfrozen():
+        message.reply_text = AsyncMock()
     return Update(update_id=1, message=message)
 
+def iter_rows(rows):
+    # Как iter_query: генератор с close()
+    yield from rows
+
 class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
         # Мокируем все функции работы с базой данных
         self.patchers = [
-            patch('handlers.create_user', return_value=None),
-            patch('handlers.get_user', return_value=[1]),
-            patch('handlers.get_user_ads', return_value=[(1, "Платье", "active")]),
-            patch('handlers.get_ad_details', return_value=(1, 1, "Платье", 1500, "Москва", "@contact", "active")),
-            patch('handlers.update_ad_field', return_value=True),
-            patch('handlers.delete_ad_db', return_value=True),
-            patch('handlers.create_ad', return_value=1),
-            patch('handlers.search_ads_in_db', return_value=[]),
-            patch('handlers.create_search', return_value=True),
-            patch('handlers.get_reviews', return_value=[]),
-            patch('handlers.create_review', return_value=True),
-            patch('handlers.get_ads_for_moderation', return_value=[(1, 1, "Платье", 1500, "Москва", "@contact", "moderation")]),
-            patch('handlers.update_ad_status', return_value=True),
-            patch('handlers.get_content_reports', return_value=[]),
-            patch('handlers.get_user_by_id', return_value=(1, 123, "test_user", "Test", "User")),
+            patch('handlers.create_user', new_callable=AsyncMock, return_value=None),
+            patch('handlers.get_user', new_callable=AsyncMock, return_value=[1]),
+            patch('handlers.get_user_ads', new_callable=AsyncMock, return_value=[(1, "Платье", "active")]),
+            patch('handlers.get_ad_details', new_callable=AsyncMock, return_value=(1, 1, "Платье", 1500, "Москва", "@contact", "active")),
+            patch('handlers.update_ad_field', new_callable=AsyncMock, return_value=True),
+            patch('handlers.delete_ad_db', new_callable=AsyncMock, return_value=True),
+            patch('handlers.create_ad', new_callable=AsyncMock, return_value=1),
+            patch('handlers.search_ads_page', new_callable=AsyncMock, return_value=([], False)),
+            patch('handlers.search_price_facets', new_callable=AsyncMock, return_value=[]),
+            patch('handlers.create_search', new_callable=AsyncMock, return_value=True),
+            patch('handlers.get_review_summary', new_callable=AsyncMock, return_value=(0, None)),
+            patch('handlers.get_reviews_page', new_callable=AsyncMock, return_value=([], False)),
+            patch('handlers.create_review', new_callable=AsyncMock, return_value=True),
+            patch('handlers.get_ads_for_moderation', new_callable=AsyncMock, return_value=[(1, 1, "Платье", 1500, "Москва", "@contact", "moderation")]),
+            patch('handlers.set_ads_status', new_callable=AsyncMock,
+                  side_effect=lambda ad_ids, status, from_status=None: [(1, "Платье", 1500, "Москва", "moderation", 123)]),
+            patch('handlers.iter_content_reports', side_effect=lambda: iter_rows([])),
+            patch('handlers.publish_ads', new_callable=AsyncMock,
+                  return_value=[(1, "Платье", 1500, "Москва", "moderation", 123, [555])]),
+            patch('handlers.enqueue_notifications', new_callable=AsyncMock, return_value=True),
             patch('handlers.is_admin', side_effect=lambda username: username == "admin_user")
         ]
         
@@ -217,7 +233,7 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         update.message.reply_text.assert_called_with("Неверный формат. Используйте цифры 1,2,3 (например: 12)")
         
         # Выбор фильтров (корректный)
-        update = make_update("12", user_id=123)
+        update = make_update("123", user_id=123)
         state = await search_ads_filters(update, context)
         self.assertEqual(state, SEARCH_STATE_KEYWORD)
         update.message.reply_text.assert_called_with("Введите ключевое слово:")
@@ -236,16 +252,17 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         update = make_update("не число", user_id=123)
         state = await search_ads_price(update, context)
         self.assertEqual(state, SEARCH_STATE_PRICE)
-        update.message.reply_text.assert_called_with("Неверный формат. Введите одно число.")
+        update.message.reply_text.assert_called_with("Неверный формат. Примеры: 1000-3000, 1000-, -3000")
         
-        # Ввод цены (корректный)
-        update = make_update("2000", user_id=123)
+        # Ввод цены (корректный диапазон)
+        update = make_update("1000-2000", user_id=123)
         state = await search_ads_price(update, context)
         
         # Проверка выполнения поиска
-        self.assertTrue(hasattr(context, 'user_data'))
-        self.assertEqual(context.user_data['min_price'], 2000)
-        self.assertEqual(context.user_data['max_price'], 2000)
+        self.assertEqual(state, ConversationHandler.END)
+        handlers.search_ads_page.assert_awaited_with(
+            keyword="платье", location="Москва", min_price=1000, max_price=2000
+        )
         
         # Проверка вывода результатов
         update = make_update("", user_id=123)
@@ -253,6 +270,73 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         args, _ = update.message.reply_text.call_args
         self.assertIn("Объявления не найдены", args[0])
 
+    async def test_search_pagination(self):
+        page1 = [(0.9, 3, "Платье", 1500, "Москва", "@a"), (0.5, 2, "Платье синее", 900, "Москва", "@b")]
+        page2 = [(0.1, 1, "Платья", 700, "Казань", "@c")]
+        handlers.search_ads_page.return_value = (page1, True)
+        
+        # Первая страница с кнопкой "Далее"
+        update = make_update("", user_id=123)
+        context = MagicMock()
+        context.user_data = {'keyword': 'платье'}
+        context.chat_data = {}
+        await perform_search(update, context)
+        args, kwargs = update.message.reply_text.call_args
+        self.assertIn("Результаты поиска (страница 1)", args[0])
+        self.assertIn("ID: 3", args[0])
+        buttons = kwargs['reply_markup'].inline_keyboard[0]
+        self.assertEqual([b.callback_data for b in buttons], ["search:1:next"])
+        
+        # Переход на следующую страницу: запрос от курсора последней строки
+        handlers.search_ads_page.return_value = (page2, False)
+        callback = MagicMock()
+        callback.callback_query.data = "search:1:next"
+        callback.callback_query.answer = AsyncMock()
+        callback.callback_query.edit_message_text = AsyncMock()
+        await search_page(callback, context)
+        handlers.search_ads_page.assert_awaited_with(
+            keyword='платье', location=None, min_price=None, max_price=None, after=(0.5, 2)
+        )
+        args, kwargs = callback.callback_query.edit_message_text.call_args
+        self.assertIn("страница 2", args[0])
+        self.assertIn("ID: 1", args[0])
+        buttons = kwargs['reply_markup'].inline_keyboard[0]
+        self.assertEqual([b.callback_data for b in buttons], ["search:1:prev"])
+        
+        # Кнопка устаревшего поиска
+        callback.callback_query.data = "search:7:next"
+        await search_page(callback, context)
+        callback.callback_query.answer.assert_awaited_with("Поиск устарел. Повторите: /search_ads")
+
+    async def test_search_price_facets_narrow_results(self):
+        page = [(0.9, 3, "Платье", 1500, "Москва", "@a")]
+        handlers.search_ads_page.return_value = (page, True)
+        handlers.search_price_facets.return_value = [(None, 1000.0, 4), (1000.0, 3000.0, 0), (3000.0, None, 2)]
+        
+        # Без фильтра цены под результатами - диапазоны с числом объявлений (пустые скрыты)
+        update = make_update("", user_id=123)
+        context = MagicMock()
+        context.user_data = {'keyword': 'платье'}
+        context.chat_data = {}
+        await perform_search(update, context)
+        _, kwargs = update.message.reply_text.call_args
+        facets = kwargs['reply_markup'].inline_keyboard[1]
+        self.assertEqual([b.text for b in facets], ["до 1000 (4)", "от 3000 (2)"])
+        self.assertEqual(facets[1].callback_data, "search:1:price:1")
+        
+        # Выбор диапазона: поиск заново с первой страницы и с границами цены
+        handlers.search_ads_page.return_value = (page, False)
+        callback = MagicMock()
+        callback.callback_query.data = facets[1].callback_data
+        callback.callback_query.answer = AsyncMock()
+        callback.callback_query.edit_message_text = AsyncMock()
+        await search_narrow(callback, context)
+        handlers.search_ads_page.assert_awaited_with(
+            keyword='платье', location=None, min_price=3000.0, max_price=None
+        )
+        _, kwargs = callback.callback_query.edit_message_text.call_args
+        self.assertIsNone(kwargs['reply_markup'])
+
     async def test_reviews_commands(self):
         # Общий запрос отзывов
         update = make_update("/reviews", user_id=123)
@@ -280,6 +364,64 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         await reviews_ad(update, context)
         update.message.reply_text.assert_called_with(f"Отзывы о товаре (ID: 1) отсутствуют")
 
+    async def test_reviews_are_paginated_with_summary(self):
+        created = datetime.datetime(2024, 3, 5, 12, 0)
+        first = [(created, 9, "Отличная вещь"), (created, 8, "х" * (REVIEW_PREVIEW_LENGTH + 1))]
+        handlers.get_review_summary.return_value = (3, created)
+        handlers.get_reviews_page.side_effect = [(first, True), ([(created, 4, "Старый отзыв")], False),
+                                                 (first, False)]
+        context = MagicMock()
+        context.chat_data = {}
+        update = make_update("/reviews_ad 7", user_id=123)
+        await reviews_ad(update, context)
+        handlers.get_review_summary.assert_called_with(ReviewType.AD.value, 7)
+        handlers.get_reviews_page.assert_called_with(ReviewType.AD.value, 7)
+        text = update.message.reply_text.call_args.args[0]
+        self.assertTrue(text.startswith("Отзывы о товаре (ID: 7): 3, последний 05.03.2024\nСтраница 1:\n\n"))
+        self.assertIn("- Отличная вещь\n", text)
+        self.assertIn("х" * REVIEW_PREVIEW_LENGTH + "…\n", text)
+
+        # Следующая страница - после последнего показанного отзыва
+        callback = MagicMock()
+        callback.callback_query.data = f"reviews:{context.chat_data['reviews']['id']}:next"
+        callback.callback_query.answer = AsyncMock()
+        callback.callback_query.edit_message_text = AsyncMock()
+        await reviews_page(callback, context)
+        handlers.get_reviews_page.assert_called_with(ReviewType.AD.value, 7, after=(created, 8))
+        text, = callback.callback_query.edit_message_text.call_args.args
+        self.assertIn("Страница 2:", text)
+        self.assertIn("- Старый отзыв", text)
+
+        # Назад - перед первым отзывом страницы; дальше назад листать некуда
+        callback.callback_query.data = callback.callback_query.data.replace('next', 'prev')
+        await reviews_page(callback, context)
+        handlers.get_reviews_page.assert_called_with(ReviewType.AD.value, 7, before=(created, 4))
+        self.assertIn("Страница 1:", callback.callback_query.edit_message_text.call_args.args[0])
+
+        callback.callback_query.data = "reviews:0:next"
+        await reviews_page(callback, context)
+        callback.callback_query.answer.assert_awaited_with("Список устарел. Повторите: /reviews")
+
+    async def test_long_listing_is_split_into_messages(self):
+        rows = [("user", f"жалоба {i} " + "х" * 100) for i in range(100)]
+        handlers.iter_content_reports.side_effect = lambda: iter_rows(rows)
+        update = make_update("/reviews_content", user_id=123, username="admin_user")
+        await reviews_content(update, MagicMock())
+
+        texts = [call.args[0] for call in update.message.reply_text.call_args_list]
+        self.assertGreater(len(texts), 1)
+        self.assertTrue(all(len(text) <= 4096 for text in texts))
+        self.assertTrue(texts[0].startswith("Жалобы на контент:\n\nПользователь: @user\nТекст: жалоба 0 "))
+        self.assertEqual(''.join(texts).count("Текст: жалоба "), 100)
+
+    async def test_content_reports_are_rendered_from_one_query(self):
+        handlers.iter_content_reports.side_effect = lambda: iter_rows([("spammer", "Спам в объявлении")])
+        update = make_update("/reviews_content", user_id=123, username="admin_user")
+        await reviews_content(update, MagicMock())
+        update.message.reply_text.assert_called_once_with(
+            "Жалобы на контент:\n\nПользователь: @spammer\nТекст: Спам в объявлении\n\n"
+        )
+
     async def test_report_commands(self):
         # Общий запрос отчетов
         update = make_update("/report", user_id=123)
@@ -371,14 +513,13 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         
         # Одобрение объявления
         update = make_update("/add 1", user_id=123, username="admin_user")
-        context.bot.send_message = AsyncMock()
         await add_ad(update, context)
         
-        # Проверка уведомления пользователя
-        context.bot.send_message.assert_any_call(
-            chat_id=123,
-            text=f"Ваше объявление (ID: 1) опубликовано"
-        )
+        # Уведомления владельцу и подписчикам ставятся в очередь одной пачкой
+        handlers.enqueue_notifications.assert_called_once_with([
+            (123, "Ваше объявление (ID: 1) опубликовано"),
+            (555, "По вашему запросу доступен новый товар: Платье (ID: 1)\nПовторите поиск: /search_ads"),
+        ])
         update.message.reply_text.assert_called_with("Объявление 1 опубликовано")
         
         # Отклонение объявления
@@ -386,10 +527,70 @@ class TestBotFunctionality(unittest.IsolatedAsyncioTestCase):
         await deny_ad(update, context)
         update.message.reply_text.assert_called_with("Объявление 1 отклонено")
         
+        # Несколько объявлений одной командой: один запрос на всю пачку
+        handlers.set_ads_status.reset_mock()
+        update = make_update("/deny 1,2 5-6", user_id=123, username="admin_user")
+        await deny_ad(update, context)
+        handlers.set_ads_status.assert_called_once_with([1, 2, 5, 6], AdStatus.REJECTED.value)
+        update.message.reply_text.assert_called_with("Отклонено объявлений: 1 (ID: 1)\nНе найдены: 2, 5-6")
+        
+        update = make_update("/add 5-x", user_id=123, username="admin_user")
+        await add_ad(update, context)
+        self.assertIn("Используйте: /add [ID]", update.message.reply_text.call_args[0][0])
+        
         # Просмотр жалоб на контент
         update = make_update("/reviews_content", user_id=123, username="admin_user")
         await reviews_content(update, context)
         update.message.reply_text.assert_called_with("Жалобы на контент отсутствуют")
 
+    async def test_approve_shown_ads(self):
+        update = make_update("/moderated", user_id=123, username="admin_user")
+        context = MagicMock()
+        context.chat_data = {}
+        await moderated(update, context)
+        _, kwargs = update.message.reply_text.call_args
+        button = kwargs['reply_markup'].inline_keyboard[0][0]
+        self.assertEqual(button.callback_data, "moderation:1:approve")
+        
+        # Публикуются только показанные объявления, которые все еще на модерации
+        callback = MagicMock()
+        callback.callback_query.data = button.callback_data
+        callback.callback_query.from_user.username = "admin_user"
+        callback.callback_query.answer = AsyncMock()
+        callback.callback_query.edit_message_text = AsyncMock()
+        await approve_shown(callback, context)
+        handlers.publish_ads.assert_awaited_once_with([1], AdStatus.MODERATION.value)
+        callback.callback_query.edit_message_text.assert_awaited_with("Объявление 1 опубликовано")
+        
+        # Повторное нажатие: список уже обработан
+        await approve_shown(callback, context)
+        callback.callback_query.answer.assert_awaited_with("Список устарел. Повторите: /moderated")
+        self.assertEqual(handlers.publish_ads.await_count, 1)
+
+class TestParsePriceRange(unittest.TestCase):
+    def test_ranges_and_open_bounds(self):
+        self.assertEqual(parse_price_range("1000-3000"), (1000, 3000))
+        self.assertEqual(parse_price_range("от 1 000 до 3 000"), (1000, 3000))
+        self.assertEqual(parse_price_range("1000-"), (1000, None))
+        self.assertEqual(parse_price_range("от 1000"), (1000, None))
+        self.assertEqual(parse_price_range("-3000"), (None, 3000))
+        self.assertEqual(parse_price_range("2500,5"), (None, 2500.5))
+
+    def test_invalid(self):
+        for text in ("", "-", "дорого", "3000-1000", "10-20-30"):
+            self.assertIsNone(parse_price_range(text), text)
+
+class TestParseAdIds(unittest.TestCase):
+    def test_lists_and_ranges(self):
+        self.assertEqual(parse_ad_ids(["5"]), [5])
+        self.assertEqual(parse_ad_ids(["7,5", "10-12", "5"]), [5, 7, 10, 11, 12])
+        self.assertEqual(format_ad_ids([5, 7, 10, 11, 12]), "5, 7, 10-12")
+
+    def test_invalid_or_too_large(self):
+        for args in ([], ["x"], ["5-"], ["-5"], ["9-3"], ["1,a"]):
+            self.assertIsNone(parse_ad_ids(args), args)
+        self.assertIsNone(parse_ad_ids(["1-11"], limit=10))
+        self.assertEqual(len(parse_ad_ids(["1-10"], limit=10)), 10)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
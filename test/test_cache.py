@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import patch
+import utils
+from cache import LRUCache, MISSING
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestLRUCache(unittest.TestCase):
+    def test_lru_eviction_by_entries(self):
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_eviction_by_total_size(self):
+        cache = LRUCache(max_entries=10, max_size=10, sizeof=len)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'yyyy')
+        cache.set('c', 'zzzz')
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual(cache.stats()['size'], 8)
+        # Значение больше всего кэша не сохраняется
+        self.assertFalse(cache.set('d', 'x' * 11))
+
+    def test_ttl_expiration(self):
+        clock = FakeClock()
+        cache = LRUCache(max_entries=10, ttl=5, clock=clock)
+        cache.set('a', 1)
+        clock.now = 4.9
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 5
+        self.assertIs(cache.get('a'), MISSING)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expirations']), (1, 1, 1))
+
+    def test_stale_generation_is_not_stored(self):
+        cache = LRUCache(max_entries=10)
+        generation = cache.generation
+        cache.clear()
+        self.assertFalse(cache.set('a', 1, generation=generation))
+        self.assertTrue(cache.set('a', 1, generation=cache.generation))
+
+class TestSearchCacheInvalidation(unittest.TestCase):
+    def setUp(self):
+        utils.search_cache.clear()
+        self.rows = [(1, 1, "Платье", 1500, "Москва", "@a", "active", None, None)]
+
+    def test_repeated_search_hits_cache(self):
+        with patch('utils.execute_query', return_value=self.rows) as query:
+            self.assertEqual(utils.search_ads_in_db(keyword="Платье "), self.rows)
+            self.assertEqual(utils.search_ads_in_db(keyword="платье"), self.rows)
+        self.assertEqual(query.call_count, 1)
+
+    def test_status_change_to_or_from_active_invalidates(self):
+        with patch('utils.execute_query', return_value=self.rows):
+            utils.search_ads_in_db(keyword="платье")
+        row = (2, "Костюм", 900, "Казань", 'moderation', 123)
+        with patch('utils.execute_query', return_value=[row]):
+            utils.set_ads_status([2], 'rejected')
+        self.assertEqual(len(utils.search_cache), 1)
+        with patch('utils.execute_query', return_value=[row]):
+            utils.set_ads_status([2], 'active')
+        self.assertEqual(len(utils.search_cache), 0)
+
+    def test_price_facets_are_one_cached_query(self):
+        with patch('utils.execute_query', return_value=[(3, 0, 1, 0, 2)]) as query:
+            facets = utils.search_price_facets(keyword="платье", min_price=500)
+            self.assertEqual(utils.search_price_facets(keyword="Платье", min_price=500), facets)
+        query.assert_called_once()
+        self.assertEqual(facets[0], (None, utils.PRICE_FACETS[0], 3))
+        self.assertEqual(facets[-1], (utils.PRICE_FACETS[-1], None, 2))
+
+    def test_edit_and_delete_of_active_ad_invalidate(self):
+        for action in (lambda: utils.update_ad_field(1, 1, "Новое"), lambda: utils.delete_ad_db(1)):
+            with patch('utils.execute_query', return_value=self.rows):
+                utils.search_ads_in_db(keyword="платье")
+            with patch('utils.execute_query', return_value=[('active',)]):
+                action()
+            self.assertEqual(len(utils.search_cache), 0)
+
+class TestUserCache(unittest.TestCase):
+    def setUp(self):
+        utils.user_cache.clear()
+
+    def test_get_user_queries_once(self):
+        with patch('utils.execute_query', return_value=[(7,)]) as query:
+            self.assertEqual(utils.get_user(123), (7,))
+            self.assertEqual(utils.get_user(123), (7,))
+        self.assertEqual(query.call_count, 1)
+
+    def test_unknown_user_is_not_cached(self):
+        with patch('utils.execute_query', return_value=[]) as query:
+            self.assertIsNone(utils.get_user(123))
+            self.assertIsNone(utils.get_user(123))
+        self.assertEqual(query.call_count, 2)
+
+    def test_create_user_warms_cache(self):
+        with patch('utils.execute_query', return_value=[(7,)]) as query:
+            self.assertEqual(utils.create_user(123, "user", "Имя", "Фамилия"), 7)
+            self.assertEqual(utils.get_user(123), (7,))
+        self.assertEqual(query.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import socket
+import unittest
+import multiprocessing
+from unittest.mock import patch
+import psycopg2
+import psycopg2.extensions
+import utils
+import cache_bus
+from cache_bus import CacheBus, CACHE_BUS_CHANNEL, apply_event
+from search_index import SearchIndex
+
+def event(table, op='update', ids=(1,), active=False, origin='other', at=None):
+    return json.dumps({'table': table, 'op': op, 'ids': list(ids) if ids is not None else None,
+                       'active': active, 'at': time.time() if at is None else at, 'origin': origin})
+
+class FakeConnection:
+    # Соединение для LISTEN: данные приходят через socketpair, чтобы работал select
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.notifies = []
+        self.autocommit = False
+        self.queries = []
+        self.broken = False
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.queries.append(query)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def poll(self):
+        self.reader.recv(4096)
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def send(self, payload):
+        self.notifies.append(psycopg2.extensions.Notify(0, CACHE_BUS_CHANNEL, payload))
+        self.writer.send(b'x')
+
+    def drop(self):
+        self.broken = True
+        self.writer.send(b'x')
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("условие не выполнено")
+        time.sleep(0.01)
+
+class TestApplyEvent(unittest.TestCase):
+    def setUp(self):
+        utils.search_cache.clear()
+        utils.search_cache.set('key', ((), False))
+        self.index = SearchIndex()
+        self.index.rebuild([(1, 1, 'шуба', None, None, None, None, 1001), (2, 1, 'платье', None, None, None, None, 1001)])
+        self.patcher = patch('cache_bus.search_index', self.index)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_only_changes_of_active_ads_clear_search_cache(self):
+        apply_event(json.loads(event('ads', active=False)))
+        self.assertEqual(len(utils.search_cache), 1)
+        apply_event(json.loads(event('ads', active=True)))
+        self.assertEqual(len(utils.search_cache), 0)
+
+    def test_saved_searches_are_refreshed_by_id(self):
+        with patch('utils.refresh_search_index') as refresh, patch('utils.build_search_index') as build:
+            apply_event(json.loads(event('searches', op='insert', ids=[3])))
+            refresh.assert_called_once_with([3])
+            apply_event(json.loads(event('searches', op='update', ids=None)))
+            build.assert_called_once()
+        apply_event(json.loads(event('searches', op='delete', ids=[1])))
+        self.assertEqual([row[0] for row in self.index.match('Шуба платье', None, None)], [2])
+
+    def test_refresh_reads_rows_and_drops_missing(self):
+        row = (2, 1, 'костюм', None, None, None, None, 1001)
+        with patch('utils.execute_query', return_value=[row]), patch('utils.search_index', self.index):
+            self.assertTrue(utils.refresh_search_index([1, 2]))
+        self.assertEqual(self.index.match('Шуба', None, None), [])
+        self.assertEqual(self.index.match('Костюм', None, None), [row])
+
+    def test_search_events_before_index_is_built_are_applied_after(self):
+        index = SearchIndex()
+        rows = [(1, 1, 'шуба', None, None, None, None, 1001)]
+        with patch('cache_bus.search_index', index), patch('utils.search_index', index), \
+                patch('utils.refresh_search_index') as refresh:
+            apply_event(json.loads(event('searches', op='insert', ids=[3])))
+            apply_event(json.loads(event('searches', op='delete', ids=[1])))
+            refresh.assert_not_called()
+            with patch('utils.execute_query', return_value=rows):
+                self.assertTrue(cache_bus.build_search_index())
+            refresh.assert_called_once_with([3])
+        self.assertEqual(index.match('Шуба', None, None), [])
+        self.assertEqual(cache_bus._early_searches, [])
+
+    def test_too_many_early_search_events_rebuild_the_index(self):
+        index = SearchIndex()
+        with patch('cache_bus.search_index', index), patch('cache_bus.EARLY_SEARCH_EVENTS_LIMIT', 2), \
+                patch('utils.build_search_index', return_value=True) as build, \
+                patch('utils.refresh_search_index') as refresh:
+            for i in range(3):
+                apply_event(json.loads(event('searches', op='insert', ids=[i])))
+            self.assertTrue(cache_bus.build_search_index())
+        self.assertEqual(build.call_count, 2)
+        refresh.assert_not_called()
+        self.assertEqual(cache_bus._early_searches, [])
+
+class TestCacheBus(unittest.TestCase):
+    def setUp(self):
+        self.connections = []
+        self.applied = []
+        self.flushes = 0
+
+    def connect(self):
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def flush(self):
+        self.flushes += 1
+
+    def make_bus(self):
+        bus = CacheBus(connect=self.connect, apply=self.applied.append, flush=self.flush,
+                       reconnect_delay=0.01, poll_interval=0.01)
+        bus.start()
+        self.addCleanup(bus.stop)
+        wait_for(bus.connected.is_set)
+        return bus
+
+    def test_events_of_other_processes_are_applied(self):
+        bus = self.make_bus()
+        conn = self.connections[0]
+        self.assertEqual(conn.queries, [f"LISTEN {CACHE_BUS_CHANNEL}"])
+        conn.send(event('ads', active=True, at=time.time() - 0.5))
+        conn.send(event('ads', active=True, origin=bus.origin))
+        wait_for(lambda: bus.stats['events'] == 2)
+        self.assertEqual([e['table'] for e in self.applied], ['ads'])
+        self.assertEqual(bus.stats['skipped'], 1)
+        self.assertGreaterEqual(bus.last_lag, 0)
+
+    def test_reconnect_flushes_everything(self):
+        bus = self.make_bus()
+        self.assertEqual(self.flushes, 1)
+        self.connections[0].drop()
+        wait_for(lambda: len(self.connections) == 2 and bus.connected.is_set())
+        self.assertEqual(self.flushes, 2)
+        self.assertEqual(bus.stats['disconnects'], 1)
+        self.connections[1].send(event('searches', op='insert', ids=[5]))
+        wait_for(lambda: self.applied)
+        self.assertEqual(self.applied[0]['ids'], [5])
+
+    def test_broken_payload_is_counted(self):
+        bus = self.make_bus()
+        self.connections[0].send('not json')
+        wait_for(lambda: bus.stats['errors'] == 1)
+        self.assertEqual(self.applied, [])
+
+def replica(schema, commands, results):
+    # Второй процесс бота: свой пул, свои кэши и своя шина
+    import database
+    from benchmarks.common import bench_connect
+    from cache_bus import start_cache_bus, stop_cache_bus
+    database.init_pool(connect=bench_connect(schema))
+    start_cache_bus()
+    cache_bus.wait_connected()
+    cache_bus.build_search_index()
+    results.put('ready')
+    for command, args in iter(commands.get, None):
+        if command == 'search':
+            results.put(len(utils.search_ads_in_db(*args)))
+        elif command == 'subscribers':
+            results.put(utils.find_matching_subscribers(*args))
+    stop_cache_bus()
+    database.close_pool()
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestCacheBusAcrossProcesses(unittest.TestCase):
+    def ask(self, command, *args):
+        self.commands.put((command, args))
+        return self.results.get(timeout=10)
+
+    def eventually(self, expected, command, *args):
+        deadline = time.monotonic() + 10
+        while (value := self.ask(command, *args)) != expected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(value, expected)
+
+    def test_write_in_one_process_evicts_caches_of_another(self):
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        use_bench_schema('test_cache_bus')
+        context = multiprocessing.get_context('spawn')
+        self.commands, self.results = context.Queue(), context.Queue()
+        process = context.Process(target=replica, args=('test_cache_bus', self.commands, self.results))
+        try:
+            utils.init_db()
+            user_id = utils.create_user(5001, 'owner', 'Имя', 'Фамилия')
+            process.start()
+            self.assertEqual(self.results.get(timeout=60), 'ready')
+
+            # Кэш поиска второго процесса (TTL 60 с) сбрасывается публикацией в этом процессе
+            self.assertEqual(self.ask('search', 'шуба'), 0)
+            ad_id = utils.create_ad(user_id, 'Шуба норковая', 5000, 'Москва', '@owner')
+            utils.set_ads_status([ad_id], 'active')
+            self.eventually(1, 'search', 'шуба')
+
+            # Поиск, сохраненный здесь, попадает в индекс второго процесса
+            self.assertEqual(self.ask('subscribers', 'Шуба', 'Казань', 5000), [])
+            utils.create_search(user_id, keyword='шуба')
+            self.eventually([5001], 'subscribers', 'Шуба', 'Казань', 5000)
+            execute_query("DELETE FROM searches")
+            self.eventually([], 'subscribers', 'Шуба', 'Казань', 5000)
+        finally:
+            self.commands.put(None)
+            process.join(30)
+            if process.is_alive():
+                process.kill()
+            drop_bench_schema('test_cache_bus')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import io
+import os
+import csv
+import json
+import datetime
+import unittest
+from decimal import Decimal
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+from catalog_io import CopyStream, validate_record, import_catalog, export_catalog
+
+VALID = {'telegram_id': '1001', 'username': 'partner', 'first_name': 'Анна', 'last_name': '',
+         'title': 'Платье вечернее', 'price': '1500', 'location': 'г. Москва', 'contact': '@anna'}
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+        self.copied = None
+        self.rowcount = 0
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        self.rowcount = len(self.statements)
+
+    def copy_expert(self, sql, stream):
+        self.statements.append(sql)
+        # Как psycopg2: чтение небольшими кусками
+        chunks = []
+        while True:
+            chunk = stream.read(64)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.copied = list(csv.reader(io.StringIO(''.join(chunks))))
+
+class TestValidateRecord(unittest.TestCase):
+    def test_valid_row_is_normalized(self):
+        row, error = validate_record(VALID)
+        self.assertIsNone(error)
+        self.assertEqual(row, (1001, 'partner', 'Анна', None, 'Платье вечернее', '1500.0',
+                               'г. Москва', 'москва', '@anna', 'moderation'))
+
+    def test_same_rules_as_submit_ad(self):
+        for field, value in [('price', 'дорого'), ('price', 'inf'), ('contact', '+79111111111'),
+                             ('contact', '8911111111'), ('telegram_id', 'abc'), ('title', '  '),
+                             ('title', 'x' * 256), ('location', None), ('location', 'г.'),
+                             ('location', ' . '), ('status', 'deleted')]:
+            row, error = validate_record({**VALID, field: value})
+            self.assertIsNone(row, (field, value))
+            self.assertTrue(error.startswith(field), error)
+
+    def test_status_from_row_or_default(self):
+        self.assertEqual(validate_record(VALID, 'active')[0][-1], 'active')
+        self.assertEqual(validate_record({**VALID, 'status': 'rejected'}, 'active')[0][-1], 'rejected')
+
+class TestImport(unittest.TestCase):
+    def run_import(self, text, fmt):
+        cursor = FakeCursor()
+
+        @contextmanager
+        def transaction():
+            yield cursor
+
+        rejects = io.StringIO()
+        with patch('catalog_io.transaction', transaction):
+            stats = import_catalog(io.StringIO(text), fmt, rejects=csv.writer(rejects, lineterminator='\n'))
+        return cursor, stats, rejects.getvalue().splitlines()
+
+    def test_csv_rows_are_validated_and_copied_in_one_transaction(self):
+        rows = [VALID, {**VALID, 'price': 'abc'}, {**VALID, 'telegram_id': '1002', 'contact': '89111111111'}]
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(VALID), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+        cursor, stats, rejects = self.run_import(text.getvalue(), 'csv')
+
+        self.assertEqual([row[0] for row in cursor.copied], ['2', '4'])
+        self.assertEqual(cursor.copied[1][1], '1002')
+        # Пустое значение в COPY csv - NULL
+        self.assertEqual(cursor.copied[0][4], '')
+        self.assertEqual(rejects, ['3,price: ожидается число'])
+        self.assertEqual((stats['staged'], stats['rejected']), (2, 1))
+        self.assertTrue(cursor.statements[0].startswith("CREATE TEMP TABLE ad_import"))
+        self.assertIn("INSERT INTO ads", cursor.statements[-1])
+
+    def test_jsonl_accepts_numbers_and_reports_broken_lines(self):
+        text = json.dumps({**VALID, 'telegram_id': 1001, 'price': 99.5}) + '\n\n{broken\n[1, 2]\n'
+        cursor, stats, rejects = self.run_import(text, 'jsonl')
+        self.assertEqual(cursor.copied[0][6], '99.5')
+        self.assertEqual(rejects, ['3,строка не разобрана', '4,строка не разобрана'])
+
+    def test_copy_stream_returns_all_data_in_chunks(self):
+        lines = [f"{i},строка\n" for i in range(1000)]
+        stream = CopyStream(lines)
+        data = []
+        while chunk := stream.read(100):
+            self.assertLessEqual(len(chunk), 100)
+            data.append(chunk)
+        self.assertEqual(''.join(data), ''.join(lines))
+
+class TestExport(unittest.TestCase):
+    def test_catalog_is_streamed_through_named_cursor(self):
+        created = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        rows = [(1, 1001, 'partner', 'Анна', None, 'Платье', Decimal('1500'), 'Москва', '@anna', 'active', created)]
+        cursor = MagicMock()
+        cursor.__enter__.return_value = cursor
+        cursor.__iter__.return_value = iter(rows)
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        pool = MagicMock()
+        pool.connection.return_value.__enter__.return_value = conn
+
+        out = io.StringIO()
+        with patch('catalog_io.get_pool', return_value=pool):
+            self.assertEqual(export_catalog(out, 'jsonl', status='active', batch_size=500), 1)
+        conn.cursor.assert_called_once_with(name='catalog_export')
+        self.assertEqual(cursor.itersize, 500)
+        self.assertEqual(cursor.execute.call_args.args[1], ('active',))
+        record = json.loads(out.getvalue())
+        self.assertEqual((record['price'], record['created_at']), (1500.0, '2024-01-02T03:04:05'))
+        # Выгрузка снова проходит проверку импорта
+        self.assertIsNone(validate_record(record)[1])
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestCatalogAgainstDatabase(unittest.TestCase):
+    def test_import_then_export_round_trip(self):
+        import utils
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        use_bench_schema('test_catalog_io')
+        try:
+            utils.init_db()
+            utils.create_user(1001, 'existing', 'Иван', None)
+            records = [VALID, {**VALID, 'telegram_id': '1002', 'location': 'мск', 'status': 'active'},
+                       {**VALID, 'contact': 'нет'}]
+            text = '\n'.join(json.dumps(record, ensure_ascii=False) for record in records)
+            stats = import_catalog(io.StringIO(text), 'jsonl')
+            self.assertEqual((stats['imported'], stats['users_created'], stats['rejected']), (2, 1, 1))
+            # Профиль существующего пользователя не перезаписан, синоним свернут в одно местоположение
+            self.assertEqual(execute_query("SELECT username FROM users WHERE telegram_id = 1001", fetch=True),
+                             [('existing',)])
+            self.assertEqual(execute_query("SELECT count(DISTINCT location_id) FROM ads", fetch=True), [(1,)])
+
+            out = io.StringIO()
+            self.assertEqual(export_catalog(out, 'csv', batch_size=1), 2)
+            exported = list(csv.DictReader(io.StringIO(out.getvalue())))
+            self.assertEqual([row['telegram_id'] for row in exported], ['1001', '1002'])
+            self.assertEqual(exported[1]['status'], 'active')
+        finally:
+            drop_bench_schema('test_catalog_io')
+
+if __name__ == '__main__':
+    unittest.main()
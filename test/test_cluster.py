@@ -0,0 +1,78 @@
+import os
+import asyncio
+import functools
+import unittest
+from telegram.ext import Application, MessageHandler, filters
+import cluster
+from cluster import Cluster, routing_key
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+async def reply_with_pid(update, context):
+    await update.message.reply_text(f"{update.message.text} {os.getpid()}")
+
+def echo_application(token, base_url, index):
+    # Создается в рабочем процессе, поэтому объявлена на уровне модуля
+    application = Application.builder().token(token).base_url(base_url).build()
+    application.add_handler(MessageHandler(filters.TEXT, reply_with_pid))
+    return application
+
+class TestRoutingKey(unittest.TestCase):
+    def test_user_is_taken_from_any_update_type(self):
+        self.assertEqual(routing_key(command_update(1, '/help', 42)), 42)
+        callback = {'update_id': 2, 'callback_query': {'id': '1', 'from': {'id': 42}, 'data': 'x'}}
+        self.assertEqual(routing_key(callback), 42)
+        channel_post = {'update_id': 3, 'channel_post': {'chat': {'id': -100}}}
+        self.assertEqual(routing_key(channel_post), -100)
+        self.assertEqual(routing_key({'update_id': 4}), 4)
+
+class TestCluster(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await FakeBotApi().start()
+        self.factory = functools.partial(echo_application, self.api.token, self.api.base_url)
+
+    async def asyncTearDown(self):
+        await self.api.stop()
+
+    async def test_user_is_served_by_one_worker_and_dead_worker_is_restarted(self):
+        pool = Cluster(self.factory, workers=2)
+        pool.start()
+        loop = asyncio.get_running_loop()
+        try:
+            for update_id, user in enumerate([1, 2, 1, 2, 1, 2], start=1):
+                await pool.dispatch(command_update(update_id, f'm{update_id}', user))
+            await self.api.wait_sent(6, timeout=60)
+            pids = {}
+            for _, chat_id, text in self.api.sent:
+                pids.setdefault(chat_id, set()).add(text.split()[1])
+            self.assertEqual(len(pids[1]), 1)
+            self.assertEqual(len(pids[2]), 1)
+            self.assertNotEqual(pids[1], pids[2])
+            self.assertTrue(pool.healthy())
+
+            victim = pool._processes[pool.worker_for(command_update(0, 'x', 1))]
+            victim.kill()
+            await loop.run_in_executor(None, victim.join)
+            self.assertFalse(pool.healthy())
+            pool.check_workers()
+            self.assertEqual(pool.stats['restarts'], 1)
+
+            await pool.dispatch(command_update(7, 'after', 1))
+            await self.api.wait_sent(7, timeout=60)
+            self.assertNotIn(str(victim.pid), self.api.sent[-1][2])
+        finally:
+            await loop.run_in_executor(None, pool.stop)
+
+    async def test_polling_ingress_stops_cleanly(self):
+        stop = asyncio.Event()
+        task = asyncio.create_task(cluster.serve_cluster(
+            self.factory, self.api.token, base_url=self.api.base_url, workers=1, url=None, stop_event=stop
+        ))
+        await self.api.push_update(command_update(1, 'hello', 5))
+        await self.api.wait_sent(1, timeout=60)
+        stop.set()
+        pool = await asyncio.wait_for(task, 60)
+        self.assertEqual(pool.stats['dispatched'], 1)
+        self.assertEqual(pool.worker_stats()['alive'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+from compact_searches import compact_batch
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.rowcount = 0
+
+    def execute(self, query, params):
+        self.queries.append((query, params))
+        self.rowcount = len(self.queries)
+
+    def fetchall(self):
+        return self.rows
+
+class TestCompactBatch(unittest.TestCase):
+    def test_locations_are_compared_in_canonical_form(self):
+        # Как в create_search: "г. Орёл" и "орел" - один поиск, "г." - без местонахождения
+        cursor = FakeCursor([(1, 'г. Орёл'), (2, ' орел '), (3, None), (4, 'г.')])
+
+        @contextmanager
+        def transaction():
+            yield cursor
+
+        with patch('compact_searches.transaction', transaction):
+            self.assertEqual(compact_batch(10, 20, 5), (2, 3))
+        (_, select), (delete, delete_params), (update, update_params) = cursor.queries
+        self.assertEqual(select, (10, 20))
+        expected = [1, 2, 3, 4], ['орел', 'орел', None, None]
+        self.assertEqual(delete_params, (*expected, 10, 20, 5))
+        self.assertEqual(update_params, expected)
+        self.assertIn("PARTITION BY s.user_id, nullif(lower(btrim(keyword)), ''), CASE", delete)
+        self.assertIn("location = c.location", update)
+
+if __name__ == '__main__':
+    unittest.main()
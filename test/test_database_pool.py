@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import unittest
+from contextlib import aclosing
+from unittest.mock import patch
+import psycopg2
+from database import ConnectionPool, PoolTimeout, iter_query, execute_query
+from async_db import iterate, shutdown_executor
+
+# Поддельное соединение: ровно тот интерфейс psycopg2, которым пользуется пул
+class FakeCursor:
+    def __init__(self, conn, name=None):
+        self.conn = conn
+        self.name = name
+        self.fetches = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        if not self.conn.alive:
+            raise psycopg2.OperationalError("server closed the connection")
+        if self.conn.failures:
+            raise self.conn.failures.pop(0)
+        self.pending = list(self.conn.rows)
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        rows, self.pending = self.pending[:size], self.pending[size:]
+        return rows
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.alive = True
+        self.rollbacks = 0
+        self.rows = []
+        self.cursors = []
+        self.failures = []
+        self.commits = 0
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def commit(self):
+        self.commits += 1
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+class TestConnectionPool(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        self.created = []
+
+        def connect():
+            conn = FakeConnection()
+            self.created.append(conn)
+            return conn
+
+        params = {'min_size': 0, 'max_size': 2, 'timeout': 0.2, 'check_idle': 0, 'max_lifetime': 3600}
+        params.update(kwargs)
+        return ConnectionPool(connect=connect, **params)
+
+    def test_connection_is_reused(self):
+        pool = self.make_pool()
+        for _ in range(5):
+            with pool.connection():
+                pass
+        metrics = pool.metrics()
+        self.assertEqual(metrics['created'], 1)
+        self.assertEqual(metrics['checkouts'], 5)
+        self.assertEqual(metrics['checked_out'], 0)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_fill_creates_min_connections(self):
+        pool = self.make_pool(min_size=2)
+        pool.fill()
+        self.assertEqual(pool.metrics()['created'], 2)
+        self.assertEqual(pool.metrics()['idle'], 2)
+
+    def test_timeout_when_exhausted(self):
+        pool = self.make_pool(max_size=1, check_idle=3600)
+        conn = pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+        self.assertEqual(pool.metrics()['timeouts'], 1)
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.make_pool(max_size=1, timeout=2)
+        conn = pool.getconn()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+        waiter.start()
+        while pool.metrics()['waiting'] == 0:
+            pass
+        pool.putconn(conn)
+        waiter.join()
+        self.assertEqual(got, [conn])
+
+    def test_dead_connection_is_replaced(self):
+        pool = self.make_pool()
+        with pool.connection() as conn:
+            pass
+        conn.alive = False
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, conn)
+        metrics = pool.metrics()
+        self.assertEqual(metrics['failed_checks'], 1)
+        self.assertEqual(metrics['created'], 2)
+        self.assertEqual(metrics['size'], 1)
+
+    def test_connection_recycled_on_operational_error(self):
+        pool = self.make_pool()
+        with self.assertRaises(psycopg2.OperationalError):
+            with pool.connection():
+                raise psycopg2.OperationalError("connection lost")
+        metrics = pool.metrics()
+        self.assertEqual(metrics['recycled'], 1)
+        self.assertEqual(metrics['size'], 0)
+        self.assertTrue(self.created[0].closed)
+
+    def test_connection_kept_on_query_error(self):
+        pool = self.make_pool()
+        with self.assertRaises(psycopg2.ProgrammingError):
+            with pool.connection():
+                raise psycopg2.ProgrammingError("syntax error")
+        self.assertEqual(pool.metrics()['idle'], 1)
+
+class TestIterQuery(unittest.TestCase):
+    make_pool = TestConnectionPool.make_pool
+
+    def setUp(self):
+        self.pool = self.make_pool()
+        patcher = patch('database.get_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connection_rows(self, rows):
+        with self.pool.connection() as conn:
+            conn.rows = rows
+
+    def test_rows_are_read_in_batches_through_named_cursor(self):
+        self.connection_rows([(i,) for i in range(5)])
+        rows = iter_query("SELECT id FROM reviews", batch_size=2)
+        # Соединение занимается только при чтении
+        self.assertEqual(self.pool.metrics()['checked_out'], 0)
+        self.assertEqual(next(rows), (0,))
+        self.assertEqual(self.pool.metrics()['checked_out'], 1)
+        self.assertEqual(list(rows), [(1,), (2,), (3,), (4,)])
+        self.assertEqual(self.pool.metrics()['checked_out'], 0)
+        cursor = self.created[0].cursors[-1]
+        self.assertEqual((cursor.name, cursor.fetches), ('iter_query', [2, 2, 2, 2]))
+
+    def test_connection_returned_when_iteration_stops_early(self):
+        self.connection_rows([(i,) for i in range(1000)])
+
+        async def first_rows():
+            result = []
+            async with aclosing(iterate(iter_query, "SELECT id FROM reviews", batch_size=10)) as rows:
+                async for row in rows:
+                    result.append(row)
+                    if len(result) == 3:
+                        break
+            return result
+
+        try:
+            self.assertEqual(asyncio.run(first_rows()), [(0,), (1,), (2,)])
+        finally:
+            shutdown_executor()
+        self.assertEqual(self.pool.metrics()['checked_out'], 0)
+        self.assertEqual(self.pool.metrics()['idle'], 1)
+
+class TestExecuteQuery(unittest.TestCase):
+    make_pool = TestConnectionPool.make_pool
+
+    def test_serialization_failure_is_retried(self):
+        pool = self.make_pool(max_size=1, check_idle=3600)
+        with pool.connection() as conn:
+            # Строку ads перенес в другую секцию параллельный запрос
+            conn.failures = [psycopg2.errors.SerializationFailure()] * 2
+        with patch('database.get_pool', return_value=pool), patch('database.DB_SERIALIZATION_RETRIES', 3):
+            self.assertTrue(execute_query("UPDATE ads SET status = 'active' WHERE id = 1"))
+        self.assertEqual((conn.rollbacks, conn.commits), (2, 1))
+
+        conn.failures = [psycopg2.errors.SerializationFailure()] * 2
+        with patch('database.get_pool', return_value=pool), patch('database.DB_SERIALIZATION_RETRIES', 1):
+            self.assertIsNone(execute_query("UPDATE ads SET status = 'active' WHERE id = 1"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from http_server import HttpServer
+
+class TestHttpServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+
+        async def handler(request):
+            self.requests.append(request)
+            return 200, request.body
+
+        self.server = await HttpServer(handler, '127.0.0.1', 0).start()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    async def send(self, data):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.server.port)
+        writer.write(data)
+        await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response.decode()
+
+    async def test_body_by_content_length(self):
+        response = await self.send(b"POST /hook HTTP/1.1\r\nContent-Length: 5\r\nConnection: close\r\n\r\nhello")
+        self.assertTrue(response.startswith('HTTP/1.1 200 OK'), response)
+        self.assertTrue(response.endswith('hello'))
+
+    async def test_malformed_request_line_is_bad_request(self):
+        response = await self.send(b"GARBAGE\r\n\r\n")
+        self.assertTrue(response.startswith('HTTP/1.1 400 Bad Request'), response)
+        response = await self.send(b"GET /metrics HTTP/1.1\r\nno colon here\r\n\r\n")
+        self.assertTrue(response.startswith('HTTP/1.1 400 Bad Request'), response)
+        self.assertEqual(self.requests, [])
+
+    async def test_bad_content_length_is_bad_request(self):
+        for length in (b'abc', b'-1', b'1e3'):
+            response = await self.send(b"POST /hook HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n")
+            self.assertTrue(response.startswith('HTTP/1.1 400 Bad Request'), (length, response))
+        self.assertEqual(self.requests, [])
+
+    async def test_only_oversized_body_is_payload_too_large(self):
+        with patch('http_server.MAX_BODY_SIZE', 10):
+            response = await self.send(b"POST /hook HTTP/1.1\r\nContent-Length: 11\r\n\r\n")
+        self.assertTrue(response.startswith('HTTP/1.1 413 Payload Too Large'), response)
+
+    async def test_truncated_body_closes_connection(self):
+        response = await self.send(b"POST /hook HTTP/1.1\r\nContent-Length: 100\r\n\r\nshort")
+        self.assertEqual(response, '')
+        self.assertEqual(self.requests, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+import psycopg2
+import metrics
+from async_db import run_db
+from test.test_database_pool import FakeConnection
+from database import ConnectionPool, execute_query, transaction
+
+def search_helper():
+    return execute_query("SELECT 1")
+
+def transaction_helper():
+    with transaction() as cur:
+        cur.execute("SELECT 1")
+
+class FailingCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        raise psycopg2.errors.UniqueViolation("duplicate key")
+
+class Connection(FakeConnection):
+    def commit(self):
+        pass
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.pool = ConnectionPool(min_size=0, max_size=2, timeout=0.2, check_idle=60,
+                                   connect=Connection)
+        self.patchers = [
+            patch('database._pool', self.pool),
+            patch('metrics.enabled', True),
+            patch.dict('metrics._gauges', clear=True),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        metrics.reset()
+
+    def test_query_is_labeled_by_calling_helper(self):
+        search_helper()
+        transaction_helper()
+        self.assertEqual(metrics.query_duration.count('search_helper'), 1)
+        self.assertEqual(metrics.query_duration.count('transaction_helper'), 1)
+
+    def test_errors_are_counted_by_type(self):
+        with patch.object(Connection, 'cursor', lambda self: FailingCursor()):
+            self.assertIsNone(search_helper())
+        self.assertEqual(metrics.query_errors.value('search_helper', 'UniqueViolation'), 1)
+
+    def test_slow_queries_are_logged(self):
+        with patch('metrics.DB_SLOW_QUERY_MS', 0), self.assertLogs('metrics', 'WARNING') as logs:
+            search_helper()
+        self.assertEqual(metrics.slow_queries.value('search_helper'), 1)
+        self.assertIn('search_helper', logs.output[0])
+
+    def test_queries_per_update_include_thread_pool_calls(self):
+        async def handler(update, context):
+            await run_db(search_helper)
+            await run_db(search_helper)
+            search_helper()
+
+        asyncio.run(metrics.instrument(handler)(None, None))
+        self.assertEqual(metrics.update_queries.count('handler'), 1)
+        self.assertEqual(metrics.update_queries.total('handler'), 3)
+        # Вне обработчика запросы не приписываются обновлению
+        search_helper()
+        self.assertEqual(metrics.update_queries.total('handler'), 3)
+
+    def test_nothing_is_recorded_when_disabled(self):
+        with patch('metrics.enabled', False):
+            search_helper()
+            transaction_helper()
+        self.assertEqual(metrics.query_duration.count('search_helper'), 0)
+        self.assertEqual(metrics.query_duration.count('transaction_helper'), 0)
+
+    def test_prometheus_text(self):
+        search_helper()
+        metrics.register_gauges('bot_db_pool', self.pool.metrics, counters=('created', 'checkouts'))
+        text = metrics.render()
+        self.assertIn('# TYPE bot_db_query_duration_seconds histogram', text)
+        self.assertIn('bot_db_query_duration_seconds_count{helper="search_helper"} 1', text)
+        self.assertIn('bot_db_query_duration_seconds_bucket{helper="search_helper",le="+Inf"} 1', text)
+        # Растущие значения - counter с _total, текущие - gauge
+        self.assertIn('# TYPE bot_db_pool_checkouts_total counter\nbot_db_pool_checkouts_total 1\n', text)
+        self.assertIn('# TYPE bot_db_pool_size gauge\nbot_db_pool_size 1\n', text)
+        self.assertNotIn('bot_db_pool_checkouts ', text)
+
+    def test_http_endpoint(self):
+        async def scrape():
+            server = await metrics.start_server(port=0)
+            port = server.port
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                response = await reader.read()
+                writer.close()
+                return response.decode()
+            finally:
+                await metrics.stop_server()
+
+        search_helper()
+        response = asyncio.run(scrape())
+        self.assertTrue(response.startswith('HTTP/1.1 200 OK'))
+        self.assertIn('bot_db_query_duration_seconds_count{helper="search_helper"} 1', response)
+
+if __name__ == '__main__':
+    unittest.main()
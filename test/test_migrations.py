@@ -0,0 +1,98 @@
+import os
+import unittest
+from unittest.mock import patch
+import migrations
+from migrations import MIGRATIONS, LATEST_VERSION, migrate
+
+class TestMigrations(unittest.TestCase):
+    def test_versions_are_ordered_and_unique(self):
+        versions = [step for step, _, _ in MIGRATIONS]
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertEqual(LATEST_VERSION, versions[-1])
+
+    def test_current_schema_is_checked_with_one_query(self):
+        with patch('migrations.current_version', return_value=LATEST_VERSION), \
+             patch('migrations.transaction') as transaction:
+            self.assertEqual(migrate(), LATEST_VERSION)
+        transaction.assert_not_called()
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestHotPathIndexes(unittest.TestCase):
+    # Проверяется, что планировщик может обслужить частые запросы utils.py индексами
+    @classmethod
+    def setUpClass(cls):
+        from benchmarks.common import use_bench_schema, seed_catalog
+        use_bench_schema('test_migrations')
+        migrate()
+        seed_catalog(5000, users=100)
+        from database import execute_query
+        execute_query("UPDATE ads SET status = 'moderation' WHERE id % 10 = 0")
+        execute_query(
+            "INSERT INTO reviews (user_id, type, ad_id, text) "
+            "SELECT user_id, 'ad', id, 'отзыв' FROM ads WHERE id % 3 = 0"
+        )
+        execute_query("INSERT INTO searches (user_id, keyword) SELECT id, 'платье' FROM users")
+        execute_query("ANALYZE")
+
+    @classmethod
+    def tearDownClass(cls):
+        from benchmarks.common import drop_bench_schema
+        drop_bench_schema('test_migrations')
+
+    def explain(self, query, params=()):
+        from database import transaction
+        with transaction() as cur:
+            cur.execute("SET LOCAL enable_seqscan = off")
+            cur.execute("EXPLAIN " + query, params)
+            return "\n".join(row[0] for row in cur.fetchall())
+
+    def assert_uses(self, index, query, params=()):
+        plan = self.explain(query, params)
+        self.assertIn(index, plan, plan)
+
+    def test_schema_is_current_after_migrate(self):
+        self.assertEqual(migrations.current_version(), LATEST_VERSION)
+        self.assertEqual(migrate(), LATEST_VERSION)
+
+    def test_hot_queries_use_indexes(self):
+        self.assert_uses("users_telegram_id", "SELECT id FROM users WHERE telegram_id = %s", (1000001,))
+        # Индекс ads_user_id_idx секционированной таблицы - по индексу на каждой секции
+        self.assert_uses("ads_active_user_id_idx", "SELECT id, title, status FROM ads WHERE user_id = %s", (1,))
+        self.assert_uses("ads_moderation_idx", "SELECT * FROM ads WHERE status = 'moderation' ORDER BY id")
+        self.assert_uses(
+            "ads_active_price_idx",
+            "SELECT id FROM ads WHERE status = 'active' AND price >= %s AND price <= %s",
+            (1000, 1200)
+        )
+        self.assert_uses(
+            "ads_active_created_idx",
+            "SELECT id FROM ads WHERE status = 'active' ORDER BY created_at DESC, id DESC LIMIT 6"
+        )
+        self.assert_uses(
+            "ads_search_vector_idx",
+            "SELECT id FROM ads WHERE status = 'active' AND search_vector @@ plainto_tsquery('russian', %s)",
+            ('платья',)
+        )
+        self.assert_uses(
+            "ads_active_location_idx",
+            "SELECT id FROM ads WHERE status = 'active' AND location_id = %s ORDER BY created_at DESC, id DESC LIMIT 6",
+            (1,)
+        )
+        self.assert_uses(
+            "reviews_listing_idx",
+            "SELECT created_at, id, text FROM reviews WHERE type = 'ad' AND ad_id = %s "
+            "ORDER BY created_at DESC, id DESC LIMIT 6",
+            (3,)
+        )
+        self.assert_uses("searches_user_id_idx", "SELECT * FROM searches WHERE user_id = %s", (1,))
+
+    def test_active_queries_read_only_active_partition(self):
+        for query in ["SELECT id FROM ads WHERE status = 'active' ORDER BY created_at DESC, id DESC LIMIT 6",
+                      "SELECT id FROM ads WHERE status = 'active' AND search_vector @@ plainto_tsquery('russian', 'платье')",
+                      "SELECT id FROM ads WHERE status = 'moderation' ORDER BY id"]:
+            plan = self.explain(query)
+            self.assertNotIn("ads_rejected", plan, plan)
+            self.assertNotIn("ads_other", plan, plan)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from unittest.mock import patch, AsyncMock
+from telegram.error import RetryAfter, Forbidden, NetworkError
+from notifications import NotificationDispatcher, RateLimiter
+
+class TestNotificationDispatcher(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.patchers = {
+            name: patch(f'notifications.{name}', new_callable=AsyncMock, return_value=True)
+            for name in ('claim_notifications', 'mark_notifications_sent',
+                         'reschedule_notification', 'fail_notification')
+        }
+        self.mocks = {name: patcher.start() for name, patcher in self.patchers.items()}
+
+    def tearDown(self):
+        for patcher in self.patchers.values():
+            patcher.stop()
+
+    def make_dispatcher(self, bot, **kwargs):
+        params = {'global_rate': 1000, 'chat_rate': 1000, 'concurrency': 5, 'batch_size': 10}
+        params.update(kwargs)
+        return NotificationDispatcher(bot, **params)
+
+    async def test_sends_claimed_batch_and_marks_sent(self):
+        bot = AsyncMock()
+        self.mocks['claim_notifications'].return_value = [
+            (1, 100, "Первое", 0),
+            (2, 200, "Второе", 0),
+        ]
+        dispatcher = self.make_dispatcher(bot)
+
+        self.assertEqual(await dispatcher.dispatch_once(), 2)
+        bot.send_message.assert_any_await(chat_id=100, text="Первое")
+        bot.send_message.assert_any_await(chat_id=200, text="Второе")
+        self.mocks['mark_notifications_sent'].assert_awaited_once_with([1, 2])
+
+    async def test_retry_after_reschedules_and_pauses(self):
+        bot = AsyncMock()
+        bot.send_message.side_effect = RetryAfter(3)
+        self.mocks['claim_notifications'].return_value = [(1, 100, "Текст", 0)]
+        dispatcher = self.make_dispatcher(bot)
+
+        await dispatcher.dispatch_once()
+        self.mocks['reschedule_notification'].assert_awaited_once()
+        self.assertEqual(self.mocks['reschedule_notification'].await_args.args[:2], (1, 3.0))
+        self.mocks['mark_notifications_sent'].assert_awaited_once_with([])
+        loop_time = asyncio.get_running_loop().time()
+        self.assertGreater(dispatcher.global_limiter._next, loop_time + 2)
+
+    async def test_blocked_bot_fails_without_retry(self):
+        bot = AsyncMock()
+        bot.send_message.side_effect = Forbidden("bot was blocked by the user")
+        self.mocks['claim_notifications'].return_value = [(1, 100, "Текст", 0)]
+        dispatcher = self.make_dispatcher(bot)
+
+        await dispatcher.dispatch_once()
+        self.mocks['fail_notification'].assert_awaited_once()
+        self.mocks['reschedule_notification'].assert_not_awaited()
+
+    async def test_network_error_gives_up_after_max_attempts(self):
+        bot = AsyncMock()
+        bot.send_message.side_effect = NetworkError("timeout")
+        self.mocks['claim_notifications'].return_value = [(1, 100, "Текст", 0), (2, 200, "Текст", 4)]
+        dispatcher = self.make_dispatcher(bot, max_attempts=5)
+
+        await dispatcher.dispatch_once()
+        self.mocks['reschedule_notification'].assert_awaited_once()
+        self.mocks['fail_notification'].assert_awaited_once()
+        self.assertEqual(self.mocks['fail_notification'].await_args.args[0], 2)
+
+    async def test_rate_limiter_spaces_events(self):
+        limiter = RateLimiter(50)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(6):
+            await limiter.acquire()
+        self.assertGreaterEqual(loop.time() - start, 5 / 50 - 0.01)
+
+if __name__ == '__main__':
+    unittest.main()
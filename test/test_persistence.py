@@ -0,0 +1,147 @@
+import unittest
+from unittest.mock import patch
+from telegram import Update
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+import handlers
+from utils import SUBMIT_STATE_TITLE, SUBMIT_STATE_PRICE, SUBMIT_STATE_LOCATION
+from persistence import PostgresPersistence, dumps, loads
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+class MemoryStore:
+    # Таблицы persistence_* в памяти; подменяет функции persistence.py, работающие с БД
+    def __init__(self):
+        self.users = {}
+        self.chats = {}
+        self.conversations = {}
+        self.loads = 0
+        self.writes = 0
+
+    def load_data(self, chat_id=None, user_id=None):
+        self.loads += 1
+        stored = {}
+        if chat_id in self.chats:
+            stored['chat'] = loads(self.chats[chat_id])
+        if user_id in self.users:
+            stored['user'] = loads(self.users[user_id])
+        return stored
+
+    def load_conversations(self, name):
+        return {key: loads(state)[0] for (stored_name, key), state in self.conversations.items() if stored_name == name}
+
+    def write_batch(self, users, chats, conversations):
+        self.writes += 1
+        for table, changes in ((self.users, users), (self.chats, chats), (self.conversations, conversations)):
+            for key, blob in changes.items():
+                if blob is None:
+                    table.pop(key, None)
+                else:
+                    table[key] = blob
+
+    def patch(self):
+        return patch.multiple('persistence', load_data=self.load_data,
+                              load_conversations=self.load_conversations, write_batch=self.write_batch)
+
+class TestPostgresPersistence(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryStore()
+        self.patcher = self.store.patch()
+        self.patcher.start()
+        self.persistence = PostgresPersistence()
+
+    async def asyncTearDown(self):
+        self.patcher.stop()
+
+    async def test_changes_are_written_in_one_batch(self):
+        await self.persistence.update_user_data(1, {'title': 'Платье'})
+        await self.persistence.update_user_data(2, {'title': 'Костюм'})
+        await self.persistence.update_chat_data(1, {'search_seq': 3})
+        await self.persistence.update_conversation('submit_ad', (1, 1), SUBMIT_STATE_PRICE)
+        self.assertEqual(self.store.writes, 0)
+        await self.persistence.flush()
+        self.assertEqual(self.store.writes, 1)
+        self.assertEqual(loads(self.store.users[2]), {'title': 'Костюм'})
+        self.assertEqual(self.store.load_conversations('submit_ad'), {(1, 1): SUBMIT_STATE_PRICE})
+
+    async def test_unchanged_data_is_not_rewritten(self):
+        await self.persistence.update_user_data(1, {'title': 'Платье'})
+        await self.persistence.flush()
+        await self.persistence.update_user_data(1, {'title': 'Платье'})
+        await self.persistence.flush()
+        self.assertEqual(self.store.writes, 1)
+
+    async def test_empty_data_and_finished_conversations_are_deleted(self):
+        self.store.users[1] = dumps({'title': 'Платье'})
+        self.store.conversations[('submit_ad', (1, 1))] = dumps((SUBMIT_STATE_PRICE,))
+        await self.persistence.update_user_data(1, {})
+        await self.persistence.update_conversation('submit_ad', (1, 1), None)
+        await self.persistence.flush()
+        self.assertEqual(self.store.users, {})
+        self.assertEqual(self.store.conversations, {})
+
+    async def test_private_chat_is_loaded_once_with_one_query(self):
+        self.store.users[7] = dumps({'title': 'Платье'})
+        self.store.chats[7] = dumps({'search_seq': 2})
+        user_data, chat_data = {}, {}
+        for _ in range(3):
+            await self.persistence.refresh_chat_data(7, chat_data)
+            await self.persistence.refresh_user_data(7, user_data)
+        self.assertEqual(self.store.loads, 1)
+        self.assertEqual(user_data, {'title': 'Платье'})
+        self.assertEqual(chat_data, {'search_seq': 2})
+
+    async def test_failed_load_is_retried(self):
+        with patch('persistence.load_data', return_value=None):
+            await self.persistence.refresh_user_data(7, {})
+        user_data = {}
+        self.store.users[7] = dumps({'title': 'Платье'})
+        await self.persistence.refresh_user_data(7, user_data)
+        self.assertEqual(user_data, {'title': 'Платье'})
+
+class TestConversationSurvivesRestart(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryStore()
+        self.patcher = self.store.patch()
+        self.patcher.start()
+        self.api = await FakeBotApi().start()
+
+    async def asyncTearDown(self):
+        await self.api.stop()
+        self.patcher.stop()
+
+    async def run_bot(self, messages):
+        application = (
+            Application.builder().token(self.api.token).base_url(self.api.base_url)
+            .persistence(PostgresPersistence()).build()
+        )
+        application.add_handler(ConversationHandler(
+            name="submit_ad",
+            persistent=True,
+            entry_points=[CommandHandler("submit_ad", handlers.submit_ad)],
+            states={
+                SUBMIT_STATE_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.submit_ad_title)],
+                SUBMIT_STATE_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.submit_ad_price)],
+                SUBMIT_STATE_LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.submit_ad_location)],
+            },
+            fallbacks=[]
+        ))
+        await application.initialize()
+        await application.start()
+        for text in messages:
+            update_id = len(self.api.sent) + 1
+            await application.update_queue.put(Update.de_json(command_update(update_id, text, 42), application.bot))
+            await self.api.wait_sent(update_id)
+        await application.stop()
+        await application.shutdown()
+        return application
+
+    async def test_ad_submission_continues_after_restart(self):
+        await self.run_bot(['/submit_ad', 'Платье вечернее'])
+        self.assertEqual(self.store.load_conversations('submit_ad'), {(42, 42): SUBMIT_STATE_PRICE})
+
+        application = await self.run_bot(['1500'])
+        self.assertEqual(self.api.sent[-1][2], "Введите местонахождение товара")
+        self.assertEqual(application.user_data[42], {'title': 'Платье вечернее', 'price': 1500.0})
+        self.assertEqual(self.store.writes, 2)
+
+if __name__ == '__main__':
+    unittest.main()
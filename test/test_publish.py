@@ -0,0 +1,115 @@
+import os
+import datetime
+import unittest
+from unittest.mock import patch, AsyncMock, MagicMock
+from telegram import Update, Message, User, Chat
+import handlers
+import utils
+from search_index import SearchIndex
+
+ADMIN_USERNAME = 'loginTG'
+
+class FakeMessage(Message):
+    pass
+
+def make_update(text):
+    user = User(id=1, first_name='Admin', is_bot=False, username=ADMIN_USERNAME)
+    message = FakeMessage(message_id=1, date=datetime.datetime.now(), chat=Chat(id=1, type='private'),
+                          text=text, from_user=user)
+    with message._unfrozen():
+        message.reply_text = AsyncMock()
+    return Update(update_id=1, message=message)
+
+class FakeDatabase:
+    # Подменяет database._execute: каждый вызов - один обмен с сервером БД
+    def __init__(self, published):
+        self.published = published
+        self.queries = []
+
+    def __call__(self, query, params, fetch):
+        self.queries.append((query, params))
+        if 'UPDATE ads' in query:
+            return self.published
+        return True
+
+class TestPublishRoundTrips(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        utils.search_cache.clear()
+        self.index = SearchIndex()
+        self.index.rebuild([
+            (1, 10, 'платье', None, None, None, None, 2001),
+            (2, 11, None, 1, None, None, None, 2002),
+            (3, 12, 'шуба', None, None, None, None, 2003),
+        ])
+
+    async def publish(self, index, published):
+        database = FakeDatabase(published)
+        with patch('database._execute', database), patch('utils.search_index', index):
+            update = make_update('/add 1-3')
+            await handlers.add_ad(update, MagicMock())
+        return database, update
+
+    def outbox(self, database):
+        query, (chat_ids, texts) = database.queries[-1]
+        self.assertIn('notification_outbox', query)
+        return list(zip(chat_ids, texts))
+
+    async def test_publish_with_index_is_two_round_trips(self):
+        published = [
+            (1, 'Платье', 1500, 'Москва', 'moderation', 1001, 1),
+            (2, 'Шуба', 900, 'Казань', 'moderation', 1002, 2),
+            (3, 'Костюм', 700, 'Москва', 'active', 1003, 1),
+        ]
+        database, update = await self.publish(self.index, published)
+        # Смена статуса с владельцами и одна вставка всех уведомлений
+        self.assertEqual(len(database.queries), 2)
+        self.assertEqual([chat_id for chat_id, _ in self.outbox(database)], [1001, 2001, 2002, 1002, 2003])
+        update.message.reply_text.assert_awaited_with("Опубликовано объявлений: 3 (ID: 1-3)")
+
+    async def test_publish_without_index_matches_in_the_same_statement(self):
+        published = [(1, 'Платье', 1500, 'Москва', 'moderation', 1001, [2001, 2002])]
+        database, update = await self.publish(SearchIndex(), published)
+        self.assertEqual(len(database.queries), 2)
+        self.assertIn('WITH published AS', database.queries[0][0])
+        self.assertEqual([chat_id for chat_id, _ in self.outbox(database)], [1001, 2001, 2002])
+        update.message.reply_text.assert_awaited_with("Опубликовано объявлений: 1 (ID: 1)\nНе найдены: 2-3")
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestPublishAgainstDatabase(unittest.TestCase):
+    def test_one_round_trip_with_and_without_index(self):
+        from database import execute_query
+        from benchmarks.common import CountingCursor, use_bench_schema, drop_bench_schema
+        from backfill_locations import backfill_table
+
+        use_bench_schema('test_publish', cursor_factory=CountingCursor)
+        try:
+            utils.init_db()
+            execute_query("INSERT INTO users (telegram_id) SELECT 1000 + g FROM generate_series(1, 3) g")
+            execute_query(
+                "INSERT INTO ads (user_id, title, price, location, contact, status) "
+                "SELECT id, 'Платье ' || id, 1000, 'г. Москва', '@a', 'moderation' FROM users"
+            )
+            backfill_table('ads')
+            user_ids = [row[0] for row in execute_query("SELECT id FROM users ORDER BY id", fetch=True)]
+            ad_ids = [row[0] for row in execute_query("SELECT id FROM ads ORDER BY id", fetch=True)]
+            utils.create_search(user_ids[0], keyword='платье')
+            utils.create_search(user_ids[1], location='мск')
+
+            built = SearchIndex()
+            with patch('utils.search_index', built):
+                self.assertTrue(utils.build_search_index())
+            results = []
+            # Без индекса подписчики ищутся в том же запросе, с индексом - в памяти
+            for index in (SearchIndex(), built):
+                execute_query("UPDATE ads SET status = 'moderation'")
+                CountingCursor.round_trips = 0
+                with patch('utils.search_index', index):
+                    results.append(utils.publish_ads(ad_ids))
+                self.assertEqual(CountingCursor.round_trips, 1)
+            self.assertEqual(results[0], results[1])
+            self.assertEqual([row[6] for row in results[0]], [[1001, 1002]] * 3)
+        finally:
+            drop_bench_schema('test_publish')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import datetime
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch
+import utils
+from models import ReviewType
+
+class TestReviewQueries(unittest.TestCase):
+    def test_review_and_summary_are_written_by_one_statement(self):
+        with patch('utils.execute_query', return_value=[(3,)]) as execute:
+            self.assertTrue(utils.create_review(1, ReviewType.AD.value, "Хорошо", ad_id=5))
+        execute.assert_called_once()
+        query, params = execute.call_args.args
+        self.assertIn("INSERT INTO reviews", query)
+        self.assertIn("INSERT INTO review_aggregates", query)
+        self.assertEqual(params, (1, 'ad', 5, "Хорошо", 5, 5))
+
+        with patch('utils.execute_query', return_value=None):
+            self.assertFalse(utils.create_review(1, ReviewType.BOT.value, "Ошибка БД"))
+
+    def test_review_of_missing_ad_is_rejected(self):
+        # Объявления нет - строка не вставляется, запрос возвращает пустой результат
+        with patch('utils.execute_query', return_value=[]) as execute:
+            self.assertFalse(utils.create_review(1, ReviewType.AD.value, "Отзыв", ad_id=999))
+        self.assertIn("EXISTS (SELECT 1 FROM ads WHERE id = %s FOR KEY SHARE)", execute.call_args.args[0])
+
+    def test_summary_of_bot_reviews_is_stored_under_zero_ad(self):
+        with patch('utils.execute_query', return_value=[]) as execute:
+            self.assertEqual(utils.get_review_summary(ReviewType.BOT.value), (0, None))
+        self.assertEqual(execute.call_args.args[1], ('bot', 0))
+
+    def test_page_cursor_and_direction(self):
+        created = datetime.datetime(2024, 3, 5)
+        rows = [(created, i, "отзыв") for i in range(3)]
+        with patch('utils.execute_query', return_value=list(rows)) as execute:
+            page, has_more = utils.get_reviews_page(ReviewType.AD.value, 7, after=(created, 10), page_size=2)
+        query, params = execute.call_args.args
+        self.assertIn("ad_id = %s AND (created_at, id) < (%s, %s)", query)
+        self.assertIn("ORDER BY created_at DESC, id DESC LIMIT %s", query)
+        self.assertEqual(params, [utils.REVIEW_PREVIEW_LENGTH + 1, 'ad', 7, created, 10, 3])
+        self.assertEqual((page, has_more), (rows[:2], True))
+
+        # Предыдущая страница читается в обратном порядке и разворачивается
+        with patch('utils.execute_query', return_value=list(rows[:2])) as execute:
+            page, has_more = utils.get_reviews_page(ReviewType.BOT.value, before=(created, 0), page_size=2)
+        query, params = execute.call_args.args
+        self.assertIn("ad_id IS NULL AND (created_at, id) > (%s, %s)", query)
+        self.assertEqual((page, has_more), ([rows[1], rows[0]], False))
+
+class TestContentReports(unittest.TestCase):
+    def test_batches_are_read_in_short_transactions(self):
+        created = datetime.datetime(2024, 3, 5)
+        batches = [[(created, 1, 'a', 'спам'), (created, 2, 'b', 'мошенник')], [(created, 3, 'c', 'спам')]]
+        queries, open_transactions = [], []
+
+        class Cursor:
+            def execute(self, query, params):
+                queries.append((query, params))
+
+            def fetchall(self):
+                return batches[len(queries) - 1]
+
+        @contextmanager
+        def transaction():
+            open_transactions.append(1)
+            try:
+                yield Cursor()
+            finally:
+                open_transactions.pop()
+
+        rows = []
+        with patch('utils.transaction', transaction):
+            for row in utils.iter_content_reports(batch_size=2):
+                # Пока строка обрабатывается (отправляется в Telegram), транзакция закрыта
+                self.assertEqual(open_transactions, [])
+                rows.append(row)
+        self.assertEqual(rows, [('a', 'спам'), ('b', 'мошенник'), ('c', 'спам')])
+        self.assertEqual([params for _, params in queries], [('content', 2), ('content', created, 2, 2)])
+        self.assertIn("AND (r.created_at, r.id) > (%s, %s) ORDER BY r.created_at, r.id LIMIT %s", queries[1][0])
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestReviewsAgainstDatabase(unittest.TestCase):
+    def test_summary_follows_reviews_and_pages_cover_all(self):
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        use_bench_schema('test_reviews')
+        try:
+            utils.init_db()
+            user_id = utils.create_user(7001, 'reviewer', 'Имя', None)
+            ad_id = utils.create_ad(user_id, 'Платье', 1500, 'Москва', '@reviewer')
+            for i in range(7):
+                self.assertTrue(utils.create_review(user_id, ReviewType.AD.value, f"отзыв {i}", ad_id=ad_id))
+            utils.create_review(user_id, ReviewType.BOT.value, "о боте")
+            for i in range(5):
+                utils.create_review(user_id, ReviewType.CONTENT.value, f"жалоба {i}")
+            self.assertEqual(list(utils.iter_content_reports(batch_size=2)),
+                             [('reviewer', f"жалоба {i}") for i in range(5)])
+
+            count, last_review_at = utils.get_review_summary(ReviewType.AD.value, ad_id)
+            self.assertEqual(count, 7)
+            self.assertEqual(last_review_at, execute_query("SELECT max(created_at) FROM reviews WHERE ad_id = %s",
+                                                           (ad_id,), fetch=True)[0][0])
+            self.assertEqual(utils.get_review_summary(ReviewType.BOT.value)[0], 1)
+
+            texts, after = [], None
+            while True:
+                rows, has_more = utils.get_reviews_page(ReviewType.AD.value, ad_id, after=after, page_size=3)
+                texts += [row[2] for row in rows]
+                if not has_more:
+                    break
+                after = rows[-1][:2]
+            self.assertEqual(texts, [f"отзыв {i}" for i in reversed(range(7))])
+
+            # Отзыв о несуществующем объявлении не сохраняется и не меняет сводку
+            self.assertFalse(utils.create_review(user_id, ReviewType.AD.value, "нет такого", ad_id=ad_id + 1000))
+            self.assertEqual(utils.get_review_summary(ReviewType.AD.value, ad_id + 1000), (0, None))
+
+            utils.delete_ad_db(ad_id)
+            self.assertEqual(utils.get_review_summary(ReviewType.AD.value, ad_id), (0, None))
+        finally:
+            drop_bench_schema('test_reviews')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import random
+import unittest
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+from scheduler import UpdateScheduler, ScheduledApplication
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+class Item:
+    def __init__(self, user, seq):
+        self.user = user
+        self.seq = seq
+
+def item_key(item):
+    return item.user
+
+class TestUpdateScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_order_per_user_and_parallelism_across_users(self):
+        rnd = random.Random(5)
+        done = {}
+        running = 0
+        peak = 0
+
+        async def process(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(rnd.random() / 500)
+            done.setdefault(item.user, []).append(item.seq)
+            running -= 1
+
+        scheduler = UpdateScheduler(process, workers=4, max_pending=1000, key=item_key)
+        scheduler.start()
+        items = [Item(rnd.randint(1, 10), seq) for seq in range(300)]
+        for item in items:
+            await scheduler.submit(item)
+        await scheduler.join()
+        await scheduler.stop()
+
+        for user, seqs in done.items():
+            self.assertEqual(seqs, sorted(seqs), user)
+        self.assertEqual(sum(len(seqs) for seqs in done.values()), len(items))
+        self.assertGreater(peak, 1)
+        self.assertLessEqual(peak, 4)
+
+    async def test_one_user_never_runs_concurrently(self):
+        running = 0
+        overlap = False
+
+        async def process(item):
+            nonlocal running, overlap
+            running += 1
+            overlap = overlap or running > 1
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        scheduler = UpdateScheduler(process, workers=8, max_pending=100, key=item_key)
+        scheduler.start()
+        for seq in range(30):
+            await scheduler.submit(Item(1, seq))
+        await scheduler.join()
+        await scheduler.stop()
+        self.assertFalse(overlap)
+
+    async def test_submit_waits_when_queue_is_full(self):
+        release = asyncio.Event()
+
+        async def process(item):
+            await release.wait()
+
+        scheduler = UpdateScheduler(process, workers=1, max_pending=2, key=item_key)
+        scheduler.start()
+        await scheduler.submit(Item(1, 1))
+        await scheduler.submit(Item(2, 2))
+        blocked = asyncio.create_task(scheduler.submit(Item(3, 3)))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+        self.assertEqual(scheduler.stats()['backpressure_waits'], 1)
+        release.set()
+        await blocked
+        await scheduler.join()
+        await scheduler.stop()
+        self.assertEqual(scheduler.stats()['processed'], 3)
+
+class TestScheduledApplication(unittest.IsolatedAsyncioTestCase):
+    async def test_slow_user_does_not_block_others(self):
+        api = await FakeBotApi().start()
+        application = (
+            Application.builder().token(api.token).base_url(api.base_url)
+            .application_class(ScheduledApplication, {'workers': 4})
+            .build()
+        )
+
+        async def echo(update, context):
+            if update.effective_user.id == 1:
+                await asyncio.sleep(0.2)
+            await update.message.reply_text(update.message.text)
+
+        application.add_handler(MessageHandler(filters.TEXT, echo))
+        await application.initialize()
+        await application.start()
+        try:
+            for update_id, (user, text) in enumerate([(1, 'a1'), (1, 'a2'), (2, 'b1'), (2, 'b2')], start=1):
+                await application.update_queue.put(Update.de_json(command_update(update_id, text, user), application.bot))
+            await api.wait_sent(2)
+            self.assertEqual([text for _, _, text in api.sent], ['b1', 'b2'])
+        finally:
+            # stop() дожидается обновлений, уже принятых планировщиком
+            await application.stop()
+            await application.shutdown()
+            await api.stop()
+        self.assertEqual([text for _, _, text in api.sent], ['b1', 'b2', 'a1', 'a2'])
+        self.assertEqual(application.scheduler.stats()['processed'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
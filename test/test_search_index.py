@@ -0,0 +1,241 @@
+import os
+import random
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+import utils
+from search_index import SearchIndex, PriceIndex, like_to_regex
+
+WORDS = ['платье', 'Платье', 'костюм', 'куртка', 'москва', 'Москва', 'казань', 'ье', 'а',
+         'пла_ье', '100%', 'кур%', '']
+TITLES = ['Платье вечернее', 'Костюм мужской', 'Куртка кожаная', 'платье 100% шелк', 'Шуба']
+CITIES = ['Москва', 'г. Москва', 'Казань', 'Санкт-Петербург', None]
+LOCATION_IDS = [1, 2, 3]
+
+def ilike(text, needle):
+    return text is not None and like_to_regex('%' + needle + '%').fullmatch(text) is not None
+
+def sql_matches(search, title, location, location_id, price):
+    # Эталон: предикат utils.get_matching_searches, вычисленный перебором
+    _, _, keyword, search_location_id, min_price, max_price = search[:6]
+    return (
+        (keyword is not None and (ilike(title, keyword) or ilike(location, keyword)))
+        or (search_location_id is not None and search_location_id == location_id)
+        or ((min_price is not None or max_price is not None) and price is not None
+            and (min_price is None or min_price <= price) and (max_price is None or price <= max_price))
+    )
+
+def random_search(search_id, rnd):
+    lo = Decimal(rnd.randint(0, 5000))
+    hi = lo + Decimal(rnd.randint(-100, 3000))
+    return (
+        search_id,
+        rnd.randint(1, 20),
+        rnd.choice(WORDS + [None] * 4),
+        rnd.choice(LOCATION_IDS + [None] * 3),
+        rnd.choice([lo, None]),
+        rnd.choice([hi, hi, None]),
+    )
+
+class TestSearchIndex(unittest.TestCase):
+    def assert_same_as_sql(self, index, searches, rnd, checks=300):
+        for _ in range(checks):
+            title = rnd.choice(TITLES)
+            location = rnd.choice(CITIES)
+            location_id = rnd.choice(LOCATION_IDS + [None])
+            price = rnd.choice([Decimal(rnd.randint(0, 9000)), None])
+            expected = [s for s in searches if sql_matches(s, title, location, location_id, price)]
+            self.assertEqual(index.match(title, location, price, location_id), sorted(expected),
+                             (title, location, location_id, price))
+
+    def test_matches_sql_semantics_on_random_data(self):
+        rnd = random.Random(42)
+        searches = [random_search(i, rnd) for i in range(1, 400)]
+        index = SearchIndex()
+        index.rebuild(searches)
+        self.assert_same_as_sql(index, searches, rnd)
+
+    def test_incremental_add_and_remove(self):
+        rnd = random.Random(7)
+        searches = {i: random_search(i, rnd) for i in range(1, 100)}
+        index = SearchIndex()
+        index.rebuild(searches.values())
+        for i in range(100, 600):
+            searches[i] = random_search(i, rnd)
+            index.add(searches[i])
+        for i in rnd.sample(sorted(searches), 250):
+            index.remove(i)
+            del searches[i]
+        self.assertEqual(len(index), len(searches))
+        self.assert_same_as_sql(index, sorted(searches.values()), rnd)
+
+    def test_open_price_range(self):
+        index = SearchIndex()
+        index.rebuild([(1, 1, None, None, 1000, None), (2, 1, None, None, None, 500), (3, 1, None, None, 400, 600)])
+        self.assertEqual([row[0] for row in index.match('Шуба', None, Decimal(450))], [2, 3])
+        self.assertEqual([row[0] for row in index.match('Шуба', None, Decimal(5000))], [1])
+
+    def test_readded_interval_does_not_match_through_old_tree_entry(self):
+        prices = PriceIndex()
+        for i in range(200):
+            prices.add(0, 1 + i, i)
+        prices.match(0.5, set())  # буфер переполнен - интервалы уходят в дерево
+        prices.remove(0)
+        prices.add(100, 101, 0)
+        found = set()
+        prices.match(0.5, found)
+        self.assertNotIn(0, found)
+        found = set()
+        prices.match(100.5, found)
+        self.assertIn(0, found)
+
+    def test_keyword_matches_substring_case_insensitive(self):
+        index = SearchIndex()
+        index.rebuild([(1, 1, 'ПЛАТЬ', None, None, None), (2, 1, 'шуба', None, None, None)])
+        self.assertEqual([row[0] for row in index.match('Платье вечернее', 'Москва', 100)], [1])
+
+class TestCreateSearch(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.rebuild([(5, 1, 'шуба', None, None, None, None)])
+        self.patcher = patch('utils.search_index', self.index)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_normalizes_and_applies_evictions_to_index(self):
+        row = (9, 1, 'платье', 3, None, None, None, 1001, [5])
+        with patch('utils.execute_query', return_value=[row]) as query, \
+                patch('utils.get_or_create_location_id', return_value=3) as location:
+            self.assertTrue(utils.create_search(1, keyword='  Платье ', location='г. МОСКВА'))
+        location.assert_called_once_with('москва')
+        params = query.call_args.args[1]
+        self.assertEqual(params[:6], (1, 'платье', 'москва', 3, None, None))
+        self.assertEqual(params[7], utils.SEARCH_LIMIT_PER_USER - 1)
+        self.assertEqual([r[0] for r in self.index.match('Шуба', 'Москва', None, 3)], [9])
+
+    def test_blank_text_is_stored_as_null(self):
+        self.assertIsNone(utils.normalize_search_text('   '))
+
+    def test_subscribers_come_from_index_without_queries(self):
+        self.index.rebuild([(5, 1, 'шуба', None, None, None, None, 1001), (6, 2, None, 7, None, None, None, 1002)])
+        utils.location_cache.set('москва', 7)
+        with patch('utils.execute_query', side_effect=AssertionError("запрос к БД")):
+            self.assertEqual(utils.find_matching_subscribers('Шуба', 'г. Москва', 100), [1001, 1002])
+
+class TestLocations(unittest.TestCase):
+    def setUp(self):
+        utils.location_cache.clear()
+
+    def test_canonical_location(self):
+        for text in ['Москва', ' москва ', 'г. Москва', 'г.Москва', 'город  Москва', 'МОСКВА.']:
+            self.assertEqual(utils.canonical_location(text), 'москва', text)
+        self.assertEqual(utils.canonical_location('Орёл'), 'орел')
+        self.assertEqual(utils.canonical_location('Горно-Алтайск'), 'горно-алтайск')
+        self.assertEqual(utils.canonical_location('Нижний  Новгород'), 'нижний новгород')
+        self.assertIsNone(utils.canonical_location(' г. '))
+
+    def test_known_location_is_looked_up_once(self):
+        with patch('utils.execute_query', return_value=[(4,)]) as query:
+            self.assertEqual(utils.find_location_id('Москва'), 4)
+            self.assertEqual(utils.find_location_id('г. москва'), 4)
+            self.assertEqual(utils.get_or_create_location_id('МОСКВА'), 4)
+        query.assert_called_once()
+        self.assertEqual(query.call_args.args[1], ('москва', 'москва'))
+
+    def test_unknown_location_is_not_cached(self):
+        with patch('utils.execute_query', return_value=[(None,)]) as query:
+            self.assertIsNone(utils.find_location_id('Тверь'))
+            self.assertIsNone(utils.find_location_id('Тверь'))
+        self.assertEqual(query.call_count, 2)
+
+    def test_search_filters_by_location_id(self):
+        utils.location_cache.set('казань', 5)
+        where, params, _, _ = utils._ad_search_filter(location='г. Казань')
+        self.assertIn("location_id = %s", where)
+        self.assertEqual(params, [5])
+
+class TestSearchPages(unittest.TestCase):
+    def setUp(self):
+        utils.search_cache.clear()
+
+    def test_rank_cursor_is_compared_in_float8(self):
+        # Ключ в выборке и в условии курсора одного типа: значение, вернувшееся из Python,
+        # совпадает с рангом строки точно
+        with patch('utils.execute_query', return_value=[]) as execute:
+            utils.search_ads_page(keyword='платье', after=(0.0607927, 10))
+        query, params = execute.call_args.args
+        rank = "ts_rank(search_vector, plainto_tsquery('russian', %s))::float8"
+        self.assertIn(f"SELECT {rank} AS sort_key", query)
+        self.assertIn(f"AND ({rank}, id) < (%s, %s)", query)
+        self.assertEqual(params[-3:], [0.0607927, 10, utils.SEARCH_PAGE_SIZE + 1])
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestSearchPagesAgainstDatabase(unittest.TestCase):
+    def test_equal_rank_rows_are_paged_once(self):
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        use_bench_schema('test_search_pages')
+        try:
+            utils.init_db()
+            utils.search_cache.clear()
+            user_id = utils.create_user(7002, 'seller', 'Имя', None)
+            for i in range(23):
+                utils.create_ad(user_id, 'Платье вечернее', 1000 + i, 'Москва', '@seller')
+            execute_query("UPDATE ads SET status = 'active'")
+            expected = [row[0] for row in execute_query("SELECT id FROM ads ORDER BY id DESC", fetch=True)]
+
+            pages, after = [], None
+            while True:
+                rows, has_more = utils.search_ads_page(keyword='платье', after=after, page_size=5)
+                pages.append(rows)
+                if not has_more:
+                    break
+                after = rows[-1][:2]
+            self.assertEqual([row[1] for rows in pages for row in rows], expected)
+
+            # Назад от последней страницы - те же страницы
+            for i in range(len(pages) - 1, 0, -1):
+                rows, _ = utils.search_ads_page(keyword='платье', before=pages[i][0][:2], page_size=5)
+                self.assertEqual([row[1] for row in rows], [row[1] for row in pages[i - 1]])
+        finally:
+            drop_bench_schema('test_search_pages')
+
+@unittest.skipUnless(os.getenv('DB_NAME'), "нужна PostgreSQL (переменные DB_* в .env)")
+class TestSearchIndexAgainstDatabase(unittest.TestCase):
+    def test_same_results_as_get_matching_searches(self):
+        from database import execute_query
+        from benchmarks.common import use_bench_schema, drop_bench_schema
+
+        rnd = random.Random(3)
+        use_bench_schema('test_search_index')
+        try:
+            utils.init_db()
+            execute_query(
+                "INSERT INTO users (telegram_id) SELECT g FROM generate_series(1, 20) g"
+            )
+            user_ids = [row[0] for row in execute_query("SELECT id FROM users", fetch=True)]
+            for i in range(300):
+                _, _, keyword, _, min_price, max_price = random_search(i, rnd)
+                location = rnd.choice(CITIES + ['мск'] + [None] * 4)
+                utils.create_search(rnd.choice(user_ids), keyword, location, min_price, max_price)
+            self.assertTrue(utils.build_search_index())
+            for _ in range(100):
+                title = rnd.choice(TITLES)
+                location = rnd.choice([c for c in CITIES if c])
+                price = Decimal(rnd.randint(0, 9000))
+                self.assertEqual(
+                    utils.find_matching_searches(title, location, price),
+                    sorted(utils.get_matching_searches(title, location, price))
+                )
+                # Подписчики: по индексу (telegram_id в строке поиска) и запросом к БД
+                subscribers = utils.find_matching_subscribers(title, location, price)
+                with patch('utils.search_index', SearchIndex()):
+                    self.assertEqual(utils.find_matching_subscribers(title, location, price), subscribers)
+        finally:
+            drop_bench_schema('test_search_index')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+import httpx
+from telegram.ext import Application, CommandHandler
+import webhook
+from handlers import help_command
+from benchmarks.fake_bot_api import FakeBotApi, command_update
+
+class TestWebhook(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.api = await FakeBotApi().start()
+        self.application = Application.builder().token(self.api.token).base_url(self.api.base_url).build()
+        self.application.add_handler(CommandHandler("help", help_command))
+        self.stop = asyncio.Event()
+        self.task = asyncio.create_task(webhook.serve(
+            self.application, host='127.0.0.1', port=0, secret='test-secret', stop_event=self.stop
+        ))
+        while not self.api.webhook_url:
+            await asyncio.sleep(0.01)
+
+    async def asyncTearDown(self):
+        self.stop.set()
+        await self.task
+        await self.api.stop()
+
+    async def test_update_is_processed_by_handlers(self):
+        self.assertEqual(self.api.webhook_secret, 'test-secret')
+        self.assertEqual(await self.api.push_update(command_update(1, '/help', 42)), 200)
+        await self.api.wait_sent(1)
+        _, chat_id, text = self.api.sent[0]
+        self.assertEqual(chat_id, 42)
+        self.assertIn('/submit_ad', text)
+
+    async def test_wrong_secret_is_rejected(self):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(self.api.webhook_url, json=command_update(1, '/help', 42),
+                                         headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            self.assertEqual(response.status_code, 403)
+            response = await client.post(self.api.webhook_url, json=command_update(2, '/help', 42))
+            self.assertEqual(response.status_code, 403)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.api.sent, [])
+
+    async def test_health_endpoint(self):
+        async with httpx.AsyncClient() as client:
+            response = await client.get(self.api.webhook_url.rstrip('/') + '/healthz')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_pending_updates_are_processed_on_shutdown(self):
+        for update_id in range(1, 6):
+            await self.api.push_update(command_update(update_id, '/help', 42))
+        self.stop.set()
+        await self.task
+        self.assertEqual(len(self.api.sent), 5)
+        self.assertFalse(self.application.running)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
-from database import execute_query
+import os
+import re
+import math
+from database import execute_query, transaction, ITER_BATCH_SIZE
 from models import AdStatus, ReviewType
+from search_index import search_index
+from cache import LRUCache, MISSING, rows_size
+from migrations import migrate
 
 # Уникальные состояния для каждого диалога
 # Создание объявления
@@ -16,63 +22,71 @@ from models import AdStatus, ReviewType
 # Отчеты
 REPORT_STATE_TEXT = 0
 
+# Столбцы объявления в порядке, на который опираются обработчики (ad[0]..ad[8])
+AD_COLUMNS = "id, user_id, title, price, location, contact, status, created_at, updated_at"
+
+# Столбцы сохраненного поиска (s[0]..s[6]); местонахождение - id из справочника locations
+SEARCH_COLUMNS = "id, user_id, keyword, location_id, min_price, max_price, created_at"
+
+# Сохраненный поиск с telegram_id владельца (s[7]): так поиски хранятся в индексе,
+# и рассылке по совпавшим поискам не нужно искать владельцев в БД
+SUBSCRIPTION_COLUMNS = "s.id, s.user_id, s.keyword, s.location_id, s.min_price, s.max_price, s.created_at, u.telegram_id"
+
+# Сколько сохраненных поисков хранится на пользователя
+SEARCH_LIMIT_PER_USER = int(os.getenv('SEARCH_LIMIT_PER_USER', 20))
+
+# Конфигурация полнотекстового поиска (морфология русского языка)
+SEARCH_CONFIG = 'russian'
+
+# Постраничный вывод результатов поиска
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 5))
+
+# Границы ценовых диапазонов, по которым считается число найденных объявлений
+PRICE_FACETS = [float(bound) for bound in os.getenv('PRICE_FACETS', '1000,3000,5000,10000').split(',') if bound]
+
+# Модерация: сколько объявлений показывает /moderated и сколько можно изменить одной командой
+MODERATION_PAGE_SIZE = int(os.getenv('MODERATION_PAGE_SIZE', 20))
+MODERATION_BATCH_LIMIT = int(os.getenv('MODERATION_BATCH_LIMIT', 1000))
+
+# Постраничный вывод отзывов; длинный отзыв в списке обрезается, чтобы страница
+# помещалась в одно сообщение Telegram (4096 символов)
+REVIEWS_PAGE_SIZE = int(os.getenv('REVIEWS_PAGE_SIZE', 5))
+REVIEW_PREVIEW_LENGTH = 3500 // REVIEWS_PAGE_SIZE
+
+# Кэш telegram_id -> (users.id,)
+user_cache = LRUCache(max_entries=int(os.getenv('USER_CACHE_SIZE', 10000)))
+
+# Кэш справочника местоположений: каноническое название -> locations.id
+location_cache = LRUCache(max_entries=int(os.getenv('LOCATION_CACHE_SIZE', 10000)))
+
+# Кэш результатов поиска: значение - (строки, есть_еще). Сбрасывается целиком,
+# когда меняется набор активных объявлений (см. _invalidate_active_ads)
+search_cache = LRUCache(
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', 1000)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 60)),
+    max_size=int(os.getenv('SEARCH_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    sizeof=lambda value: rows_size(value[0])
+)
+
 def init_db():
-    queries = [
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT UNIQUE NOT NULL,
-            username VARCHAR(255),
-            first_name VARCHAR(255),
-            last_name VARCHAR(255),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS ads (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) NOT NULL,
-            title VARCHAR(255) NOT NULL,
-            price NUMERIC NOT NULL,
-            location VARCHAR(255) NOT NULL,
-            contact VARCHAR(50) NOT NULL,
-            status VARCHAR(20) DEFAULT 'moderation',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS searches (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) NOT NULL,
-            keyword VARCHAR(255),
-            location VARCHAR(255),
-            min_price NUMERIC,
-            max_price NUMERIC,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """,
-        """
-        CREATE TABLE IF NOT EXISTS reviews (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER REFERENCES users(id) NOT NULL,
-            type VARCHAR(20) NOT NULL,
-            ad_id INTEGER REFERENCES ads(id),
-            text TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    ]
-    
-    for query in queries:
-        execute_query(query)
+    # Схема создается и обновляется миграциями (migrations.py)
+    return migrate()
 
 def get_user(telegram_id):
+    # Соответствие telegram_id -> users.id не меняется, поэтому кэшируется без TTL
+    user = user_cache.get(telegram_id)
+    if user is not MISSING:
+        return user
+    return load_user(telegram_id)
+
+def load_user(telegram_id):
     result = execute_query(
         "SELECT id FROM users WHERE telegram_id = %s", 
         (telegram_id,), 
         fetch=True
     )
+    if result:
+        user_cache.set(telegram_id, result[0])
     return result[0] if result else None
 
 def get_user_by_id(user_id):
@@ -84,17 +98,96 @@ def get_user_by_id(user_id):
     return result[0] if result else None
 
 def create_user(telegram_id, username, first_name, last_name):
-    execute_query(
+    # Один запрос и для нового, и для существующего пользователя: возвращает id
+    # (заодно обновляет имя пользователя, если оно сменилось) и прогревает кэш
+    result = execute_query(
         "INSERT INTO users (telegram_id, username, first_name, last_name) "
-        "VALUES (%s, %s, %s, %s) ON CONFLICT (telegram_id) DO NOTHING",
-        (telegram_id, username, first_name, last_name)
+        "VALUES (%s, %s, %s, %s) ON CONFLICT (telegram_id) DO UPDATE SET "
+        "username = EXCLUDED.username, first_name = EXCLUDED.first_name, last_name = EXCLUDED.last_name "
+        "RETURNING id",
+        (telegram_id, username, first_name, last_name),
+        fetch=True
+    )
+    if not result:
+        return None
+    user_cache.set(telegram_id, result[0])
+    return result[0][0]
+
+# ===== Справочник местоположений =====
+_LOCATION_PREFIX = re.compile(r'^(?:г|гор|город)(?:\.\s*|\s+)')
+
+def canonical_location(text):
+    # "  г. Москва " -> "москва": нижний регистр, е вместо ё, один пробел между словами,
+    # без "г."/"город" в начале и знаков препинания по краям. None - пустое название
+    if text is None:
+        return None
+    text = ' '.join(text.lower().replace('ё', 'е').split())
+    return _LOCATION_PREFIX.sub('', text).strip(' .,;') or None
+
+# id местоположения по каноническому названию: сначала синонимы ("мск" -> Москва)
+_LOCATION_ID = (
+    "coalesce((SELECT location_id FROM location_aliases WHERE alias = %s), "
+    "(SELECT id FROM locations WHERE name = %s))"
+)
+
+def find_location_id(text):
+    # id по справочнику; None - местоположение неизвестно (или ошибка БД).
+    # id не меняется, поэтому найденные кэшируются без TTL, а неизвестные - нет:
+    # местоположение может появиться с новым объявлением
+    name = canonical_location(text)
+    if name is None:
+        return None
+    location_id = location_cache.get(name)
+    if location_id is not MISSING:
+        return location_id
+    result = execute_query(f"SELECT {_LOCATION_ID}", (name, name), fetch=True)
+    if not result or result[0][0] is None:
+        return None
+    location_cache.set(name, result[0][0])
+    return result[0][0]
+
+def get_or_create_location_id(text):
+    # То же, но неизвестное местоположение добавляется в справочник (одним запросом)
+    name = canonical_location(text)
+    if name is None:
+        return None
+    location_id = location_cache.get(name)
+    if location_id is not MISSING:
+        return location_id
+    result = execute_query(
+        f"WITH found AS (SELECT {_LOCATION_ID} AS id), created AS ("
+        "    INSERT INTO locations (name) SELECT %s FROM found WHERE found.id IS NULL "
+        # Параллельная вставка того же названия: DO UPDATE, чтобы вернуть его id
+        "    ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name RETURNING id"
+        ") SELECT coalesce((SELECT id FROM found), (SELECT id FROM created))",
+        (name, name, name),
+        fetch=True
     )
+    if not result or result[0][0] is None:
+        return None
+    location_cache.set(name, result[0][0])
+    return result[0][0]
+
+# ===== Проверка полей объявления (бот и импорт каталога) =====
+def parse_price(text):
+    # Стоимость - конечное число; None - неверный формат
+    try:
+        price = float(text)
+    except (TypeError, ValueError):
+        return None
+    return price if math.isfinite(price) else None
+
+def is_valid_contact(contact):
+    # Телефон 89111111111 или @username
+    return contact.startswith('@') or (contact.startswith('89') and len(contact) == 11 and contact.isdigit())
 
 def create_ad(user_id, title, price, location, contact):
+    # Новое объявление уходит на модерацию и не влияет на кэш поиска
     result = execute_query(
-        "INSERT INTO ads (user_id, title, price, location, contact, status) "
-        "VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-        (user_id, title, price, location, contact, AdStatus.MODERATION.value),
+        "INSERT INTO ads (user_id, title, price, location, location_id, contact, status) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+        (user_id, title, price, location, get_or_create_location_id(location), contact,
+         AdStatus.MODERATION.value),
         fetch=True
     )
     return result[0][0] if result else None
@@ -108,106 +201,525 @@ def get_user_ads(user_id):
 
 def get_ad_details(ad_id):
     result = execute_query(
-        "SELECT * FROM ads WHERE id = %s",
+        f"SELECT {AD_COLUMNS} FROM ads WHERE id = %s",
         (ad_id,),
         fetch=True
     )
     return result[0] if result else None
 
+def _invalidate_active_ads(*statuses):
+    # Результаты поиска зависят только от активных объявлений
+    if AdStatus.ACTIVE.value in statuses:
+        search_cache.clear()
+
 def update_ad_field(ad_id, field_num, new_value):
     fields = ['title', 'price', 'location', 'contact']
     field = fields[field_num - 1]
-    return execute_query(
-        f"UPDATE ads SET {field} = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-        (new_value, ad_id)
-    ) is not None
+    assignments, params = f"{field} = %s", [new_value]
+    if field == 'location':
+        assignments += ", location_id = %s"
+        params.append(get_or_create_location_id(new_value))
+    result = execute_query(
+        f"UPDATE ads SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING status",
+        params + [ad_id],
+        fetch=True
+    )
+    if result:
+        _invalidate_active_ads(result[0][0])
+    return result is not None
 
 def delete_ad_db(ad_id):
-    execute_query("DELETE FROM reviews WHERE ad_id = %s", (ad_id,))
-    return execute_query("DELETE FROM ads WHERE id = %s", (ad_id,)) is not None
+    execute_query(
+        "WITH summary AS (DELETE FROM review_aggregates WHERE type = %s AND ad_id = %s) "
+        "DELETE FROM reviews WHERE ad_id = %s",
+        (ReviewType.AD.value, ad_id, ad_id)
+    )
+    result = execute_query("DELETE FROM ads WHERE id = %s RETURNING status", (ad_id,), fetch=True)
+    if result:
+        _invalidate_active_ads(result[0][0])
+    return result is not None
+
+def normalize_search_text(value):
+    # Сохраненные поиски хранятся в нижнем регистре без пробелов по краям
+    if value is None:
+        return None
+    return value.strip().lower() or None
 
 def create_search(user_id, keyword=None, location=None, min_price=None, max_price=None):
-    return execute_query(
-        "INSERT INTO searches (user_id, keyword, location, min_price, max_price) "
-        "VALUES (%s, %s, %s, %s, %s)",
-        (user_id, keyword, location, min_price, max_price)
-    ) is not None
+    # Повторный поиск не создает новую строку, а обновляет время существующей.
+    # Новый поиск сверх лимита вытесняет самые старые поиски пользователя.
+    keyword = normalize_search_text(keyword)
+    location = canonical_location(location)
+    result = execute_query(
+        "WITH upsert AS ("
+        "    INSERT INTO searches (user_id, keyword, location, location_id, min_price, max_price) "
+        "    VALUES (%s, %s, %s, %s, %s, %s) "
+        "    ON CONFLICT (user_id, keyword, location, min_price, max_price) "
+        "    DO UPDATE SET created_at = CURRENT_TIMESTAMP "
+        f"    RETURNING {SEARCH_COLUMNS}, (xmax = 0) AS inserted"
+        "), evicted AS ("
+        "    DELETE FROM searches WHERE id IN ("
+        "        SELECT id FROM searches WHERE user_id = %s AND (SELECT inserted FROM upsert) "
+        "        ORDER BY created_at DESC, id DESC OFFSET %s"
+        "    ) RETURNING id"
+        f") SELECT {SEARCH_COLUMNS}, (SELECT telegram_id FROM users WHERE id = upsert.user_id), "
+        "(SELECT array_agg(id) FROM evicted) FROM upsert",
+        # Вставленная строка не видна подзапросу DELETE, поэтому смещение на 1 меньше лимита
+        (user_id, keyword, location, get_or_create_location_id(location), min_price, max_price,
+         user_id, max(SEARCH_LIMIT_PER_USER - 1, 0)),
+        fetch=True
+    )
+    if not result:
+        return False
+    row, evicted = result[0][:-1], result[0][-1]
+    if search_index.ready:
+        search_index.add(row)
+        for search_id in evicted or ():
+            search_index.remove(search_id)
+    return True
+
+def build_search_index():
+    rows = execute_query(f"SELECT {SUBSCRIPTION_COLUMNS} FROM searches s JOIN users u ON u.id = s.user_id", fetch=True)
+    if rows is None:
+        return False
+    search_index.rebuild(rows)
+    return True
+
+def refresh_search_index(search_ids):
+    # Поиски, измененные другим процессом: перечитываются из БД,
+    # строки, которых уже нет, удаляются из индекса
+    rows = execute_query(
+        f"SELECT {SUBSCRIPTION_COLUMNS} FROM searches s JOIN users u ON u.id = s.user_id WHERE s.id = ANY(%s)",
+        (list(search_ids),),
+        fetch=True
+    )
+    if rows is None:
+        return False
+    for row in rows:
+        search_index.add(row)
+    for search_id in set(search_ids) - {row[0] for row in rows}:
+        search_index.remove(search_id)
+    return True
+
+def _search_matches(title, location, location_id, price):
+    # Условие "сохраненный поиск s подходит под объявление" (та же семантика у SearchIndex);
+    # аргументы - SQL-выражения: заполнители %s или столбцы. Местонахождение сравнивается
+    # по id справочника, диапазон цены может быть открытым.
+    return (
+        f"((s.keyword IS NOT NULL AND ({title} ILIKE '%%' || s.keyword || '%%' OR {location} ILIKE '%%' || s.keyword || '%%')) "
+        f"OR s.location_id = {location_id} "
+        "OR ((s.min_price IS NOT NULL OR s.max_price IS NOT NULL) "
+        f"AND {price} BETWEEN coalesce(s.min_price, '-infinity') AND coalesce(s.max_price, 'infinity')))"
+    )
 
 def get_matching_searches(title, location, price):
     return execute_query(
-        "SELECT * FROM searches "
-        "WHERE (keyword IS NOT NULL AND (%s ILIKE '%%' || keyword || '%%' OR %s ILIKE '%%' || keyword || '%%')) "
-        "OR (location IS NOT NULL AND %s ILIKE '%%' || location || '%%') "
-        "OR (min_price IS NOT NULL AND max_price IS NOT NULL AND %s BETWEEN min_price AND max_price)",
-        (title, location, location, price),
+        f"SELECT {SUBSCRIPTION_COLUMNS} FROM searches s JOIN users u ON u.id = s.user_id "
+        f"WHERE {_search_matches('%s', '%s', '%s', '%s')}",
+        (title, location, find_location_id(location), price),
         fetch=True
     )
 
-def search_ads_in_db(keyword=None, location=None, min_price=None, max_price=None):
-    query = "SELECT * FROM ads WHERE status = 'active'"
-    conditions = []
+def find_matching_searches(title, location, price):
+    # Сопоставление по индексу в памяти; до его построения - запрос к БД
+    if search_index.ready:
+        return search_index.match(title, location, price, find_location_id(location))
+    return get_matching_searches(title, location, price)
+
+def find_matching_subscribers(title, location, price):
+    # telegram_id подписчиков, чьи сохраненные поиски подходят под объявление
+    location_id = find_location_id(location)
+    if search_index.ready:
+        return sorted({search[7] for search in search_index.match(title, location, price, location_id)})
+    result = execute_query(
+        "SELECT DISTINCT u.telegram_id FROM searches s JOIN users u ON u.id = s.user_id "
+        f"WHERE {_search_matches('%s', '%s', '%s', '%s')} ORDER BY u.telegram_id",
+        (title, location, location_id, price),
+        fetch=True
+    )
+    return [row[0] for row in result] if result else []
+
+def _ad_search_filter(keyword=None, location=None, min_price=None, max_price=None):
+    # Условия поиска по активным объявлениям и ключ сортировки с его параметрами
+    conditions = ["status = 'active'"]
     params = []
+    sort_key, sort_params = "created_at", []
     
     if keyword:
-        conditions.append("(title ILIKE %s OR location ILIKE %s)")
-        params.extend([f'%{keyword}%', f'%{keyword}%'])
+        # Поиск по словоформам: "платья" находит "платье"; результаты по релевантности
+        conditions.append(f"search_vector @@ plainto_tsquery('{SEARCH_CONFIG}', %s)")
+        params.append(keyword)
+        # ts_rank возвращает real; курсор возвращается из Python числом и сравнивался бы
+        # в double precision, поэтому равные по рангу строки на границе страницы
+        # терялись или повторялись. Ключ сразу приводится к float8, как и курсор
+        sort_key = f"ts_rank(search_vector, plainto_tsquery('{SEARCH_CONFIG}', %s))::float8"
+        sort_params = [keyword]
     
     if location:
-        conditions.append("location ILIKE %s")
-        params.append(f'%{location}%')
+        # Равенство по справочнику (индекс ads_active_location_idx):
+        # неизвестное местоположение (None) не совпадает ни с одним объявлением
+        conditions.append("location_id = %s")
+        params.append(find_location_id(location))
     
-    if min_price is not None and max_price is not None:
-        conditions.append("price = %s")
+    # Диапазон цены с открытыми границами (индекс ads_active_price_idx)
+    if min_price is not None:
+        conditions.append("price >= %s")
         params.append(min_price)
+    if max_price is not None:
+        conditions.append("price <= %s")
+        params.append(max_price)
     
-    if conditions:
-        query += " AND " + " AND ".join(conditions)
-    
-    return execute_query(query, params, fetch=True)
+    return " AND ".join(conditions), params, sort_key, sort_params
 
-def create_review(user_id, review_type, text, ad_id=None):
-    try:
-        execute_query(
-            "INSERT INTO reviews (user_id, type, ad_id, text) VALUES (%s, %s, %s, %s)",
-            (user_id, review_type, ad_id, text)
+_PRICE_NUMBER = r'(\d+(?:\.\d+)?)'
+_PRICE_RANGE = re.compile(rf'^(?:от)?{_PRICE_NUMBER}?(?:-|до){_PRICE_NUMBER}?$')
+_PRICE_BOUND = re.compile(rf'^(от|до)?{_PRICE_NUMBER}$')
+
+def parse_price_range(text):
+    # "1000-3000", "от 1000 до 3000", "1000-" или "от 1000", "-3000", "до 3000" или "3000".
+    # Возвращает (min_price, max_price), одна из границ может быть None; None - неверный формат
+    text = text.lower().replace(' ', '').replace(',', '.').replace('–', '-').replace('—', '-')
+    match = _PRICE_RANGE.match(text)
+    if match:
+        low, high = (float(value) if value else None for value in match.groups())
+        if low is None and high is None:
+            return None
+    else:
+        match = _PRICE_BOUND.match(text)
+        if not match:
+            return None
+        # Одно число - верхняя граница: "не дороже"
+        low, high = (float(match.group(2)), None) if match.group(1) == 'от' else (None, float(match.group(2)))
+    if low is not None and high is not None and low > high:
+        return None
+    return low, high
+
+def price_ranges(bounds=PRICE_FACETS):
+    # [1000, 3000] -> [(None, 1000), (1000, 3000), (3000, None)]
+    edges = [None] + list(bounds) + [None]
+    return list(zip(edges, edges[1:]))
+
+def _search_cache_key(keyword, location, min_price, max_price, *extra):
+    # Полнотекстовый поиск не зависит от регистра и лишних пробелов,
+    # местонахождение - от написания, приводимого canonical_location
+    if keyword:
+        keyword = ' '.join(keyword.lower().split())
+    return (keyword or None, canonical_location(location), min_price, max_price) + extra
+
+def _cached_search(key, load):
+    value = search_cache.get(key)
+    if value is not MISSING:
+        rows, has_more = value
+        return list(rows), has_more
+    generation = search_cache.generation
+    rows, has_more = load()
+    if rows is not None:
+        search_cache.set(key, (tuple(rows), has_more), generation=generation)
+    return rows, has_more
+
+def search_ads_in_db(keyword=None, location=None, min_price=None, max_price=None):
+    def load():
+        where, params, sort_key, sort_params = _ad_search_filter(keyword, location, min_price, max_price)
+        rows = execute_query(
+            f"SELECT {AD_COLUMNS} FROM ads WHERE {where} ORDER BY {sort_key} DESC, id DESC",
+            params + sort_params,
+            fetch=True
         )
-        return True
-    except Exception as e:
-        print(f"Ошибка при создании отзыва: {e}")
-        return False
+        return rows, None
+    
+    key = _search_cache_key(keyword, location, min_price, max_price, 'all')
+    return _cached_search(key, load)[0]
+
+def search_ads_page(keyword=None, location=None, min_price=None, max_price=None,
+                    after=None, before=None, page_size=SEARCH_PAGE_SIZE):
+    # Keyset-пагинация: курсор - пара (ключ сортировки, id) крайней строки страницы.
+    # after - следующая страница после курсора, before - предыдущая перед ним.
+    # Возвращает (строки, есть_еще); строка: (ключ, id, title, price, location, contact)
+    key = _search_cache_key(keyword, location, min_price, max_price, 'page', after, before, page_size)
+    return _cached_search(
+        key, lambda: _load_search_page(keyword, location, min_price, max_price, after, before, page_size)
+    )
 
-def get_reviews(review_type, ad_id=None):
-    if ad_id:
-        return execute_query(
-            "SELECT * FROM reviews WHERE type = %s AND ad_id = %s",
-            (review_type, ad_id),
+def search_price_facets(keyword=None, location=None, min_price=None, max_price=None):
+    # Число найденных объявлений по ценовым диапазонам одним агрегирующим запросом:
+    # [(min_price, max_price, число)]. Границы включаются, как в фильтре цены, поэтому
+    # число совпадает с выдачей после выбора диапазона
+    ranges = price_ranges()
+    
+    def load():
+        where, params, _, _ = _ad_search_filter(keyword, location, min_price, max_price)
+        counts, count_params = [], []
+        for low, high in ranges:
+            bounds = []
+            if low is not None:
+                bounds.append("price >= %s")
+                count_params.append(low)
+            if high is not None:
+                bounds.append("price <= %s")
+                count_params.append(high)
+            counts.append(f"count(*) FILTER (WHERE {' AND '.join(bounds) or 'TRUE'})")
+        rows = execute_query(
+            f"SELECT {', '.join(counts)} FROM ads WHERE {where}",
+            count_params + params,
             fetch=True
         )
-    return execute_query(
-        "SELECT * FROM reviews WHERE type = %s",
-        (review_type,),
+        if rows is None:
+            return None, None
+        return [(low, high, count) for (low, high), count in zip(ranges, rows[0])], None
+    
+    key = _search_cache_key(keyword, location, min_price, max_price, 'facets')
+    return _cached_search(key, load)[0]
+
+def _load_search_page(keyword, location, min_price, max_price, after, before, page_size):
+    where, params, sort_key, sort_params = _ad_search_filter(keyword, location, min_price, max_price)
+    order = "DESC"
+    if after is not None:
+        where += f" AND ({sort_key}, id) < (%s, %s)"
+        params = params + sort_params + list(after)
+    elif before is not None:
+        where += f" AND ({sort_key}, id) > (%s, %s)"
+        params = params + sort_params + list(before)
+        order = "ASC"
+    
+    rows = execute_query(
+        f"SELECT {sort_key} AS sort_key, id, title, price, location, contact FROM ads "
+        f"WHERE {where} ORDER BY sort_key {order}, id {order} LIMIT %s",
+        sort_params + params + [page_size + 1],
+        fetch=True
+    )
+    if rows is None:
+        return None, False
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if order == "ASC":
+        rows.reverse()
+    return rows, has_more
+
+def create_review(user_id, review_type, text, ad_id=None):
+    # Отзыв и сводка (review_aggregates) меняются одним запросом, то есть в одной транзакции.
+    # Внешнего ключа на секционированную ads нет (миграция 11), поэтому объявление
+    # проверяется здесь и блокируется от удаления до конца транзакции, как это делал ключ;
+    # отзыв о несуществующем объявлении не сохраняется (False)
+    result = execute_query(
+        "WITH review AS ("
+        "    INSERT INTO reviews (user_id, type, ad_id, text) "
+        "    SELECT %s, %s, %s, %s "
+        "    WHERE %s::integer IS NULL OR EXISTS (SELECT 1 FROM ads WHERE id = %s FOR KEY SHARE) "
+        "    RETURNING type, ad_id, created_at"
+        ") "
+        "INSERT INTO review_aggregates (type, ad_id, review_count, last_review_at) "
+        "SELECT type, coalesce(ad_id, 0), 1, created_at FROM review "
+        "ON CONFLICT (type, ad_id) DO UPDATE SET "
+        "    review_count = review_aggregates.review_count + 1, "
+        "    last_review_at = greatest(review_aggregates.last_review_at, EXCLUDED.last_review_at) "
+        "RETURNING review_count",
+        (user_id, review_type, ad_id, text, ad_id, ad_id),
         fetch=True
     )
+    return bool(result)
 
-def get_ads_for_moderation():
+def get_review_summary(review_type, ad_id=None):
+    # (число отзывов, время последнего) одним чтением по первичному ключу
+    rows = execute_query(
+        "SELECT review_count, last_review_at FROM review_aggregates WHERE type = %s AND ad_id = %s",
+        (review_type, ad_id or 0),
+        fetch=True
+    )
+    return rows[0] if rows else (0, None)
+
+def get_reviews_page(review_type, ad_id=None, after=None, before=None, page_size=REVIEWS_PAGE_SIZE):
+    # Новые первыми, keyset-пагинация как в search_ads_page: курсор - (created_at, id)
+    # крайней строки страницы. Возвращает (строки, есть_еще); строка: (created_at, id, текст).
+    # Текст читается не длиннее REVIEW_PREVIEW_LENGTH + 1, чтобы было видно, что он обрезан
+    where = "type = %s AND ad_id " + ("= %s" if ad_id else "IS NULL")
+    params = [REVIEW_PREVIEW_LENGTH + 1, review_type] + ([ad_id] if ad_id else [])
+    order = "DESC"
+    if after is not None:
+        where += " AND (created_at, id) < (%s, %s)"
+        params += list(after)
+    elif before is not None:
+        where += " AND (created_at, id) > (%s, %s)"
+        params += list(before)
+        order = "ASC"
+    
+    rows = execute_query(
+        f"SELECT created_at, id, left(text, %s) FROM reviews WHERE {where} "
+        f"ORDER BY created_at {order}, id {order} LIMIT %s",
+        params + [page_size + 1],
+        fetch=True
+    )
+    if rows is None:
+        return None, False
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if order == "ASC":
+        rows.reverse()
+    return rows, has_more
+
+def get_ads_for_moderation(limit=None):
     return execute_query(
-        "SELECT * FROM ads WHERE status = %s",
-        (AdStatus.MODERATION.value,),
+        f"SELECT {AD_COLUMNS} FROM ads WHERE status = %s ORDER BY id LIMIT %s",
+        (AdStatus.MODERATION.value, limit),
         fetch=True
     )
 
-def update_ad_status(ad_id, status):
+def parse_ad_ids(args, limit=MODERATION_BATCH_LIMIT):
+    # Аргументы команды модерации: "5", "5,7,9", "10-20" в любом сочетании.
+    # None - если есть что-то кроме номеров и диапазонов или номеров больше limit
+    ad_ids = set()
+    for part in ','.join(args).split(','):
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        if not first.isdigit() or (dash and not last.isdigit()):
+            return None
+        first = int(first)
+        last = int(last) if dash else first
+        if first > last or last - first >= limit:
+            return None
+        ad_ids.update(range(first, last + 1))
+        if len(ad_ids) > limit:
+            return None
+    return sorted(ad_ids) or None
+
+def format_ad_ids(ad_ids):
+    # [1, 2, 3, 7] -> "1-3, 7"
+    ranges = []
+    for ad_id in sorted(ad_ids):
+        if ranges and ranges[-1][1] == ad_id - 1:
+            ranges[-1][1] = ad_id
+        else:
+            ranges.append([ad_id, ad_id])
+    return ', '.join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+# Смена статуса пачки объявлений (с from_status - только объявлений в этом статусе).
+# Возвращает (id, title, price, location, прежний статус, telegram_id владельца, location_id);
+# location_id нужен только для поиска подписчиков и наружу не отдается. Строка переносится
+# в секцию ads нового статуса самой БД; updated_at - время смены статуса (archive_ads.py)
+_SET_ADS_STATUS = (
+    "UPDATE ads SET status = %s, updated_at = CURRENT_TIMESTAMP FROM ("
+    "    SELECT a.id, a.status, u.telegram_id FROM ads a JOIN users u ON u.id = a.user_id "
+    "    WHERE a.id = ANY(%s) AND (%s IS NULL OR a.status = %s) FOR UPDATE OF a"
+    ") old WHERE ads.id = old.id "
+    "RETURNING ads.id, ads.title, ads.price, ads.location, old.status AS old_status, old.telegram_id, "
+    "ads.location_id"
+)
+
+def _status_changed(rows, status):
+    # Прежний статус нужен, чтобы понять, изменился ли набор активных объявлений
+    changed = {row[4] for row in rows if row[4] != status}
+    if changed:
+        _invalidate_active_ads(status, *changed)
+
+def set_ads_status(ad_ids, status, from_status=None):
+    # Одним запросом; None - ошибка БД
+    rows = execute_query(_SET_ADS_STATUS, (status, list(ad_ids), from_status, from_status), fetch=True)
+    if rows is None:
+        return None
+    _status_changed(rows, status)
+    return sorted(row[:6] for row in rows)
+
+def publish_ads(ad_ids, from_status=None):
+    # Публикация одним запросом: строки set_ads_status и telegram_id подписчиков (row[6]),
+    # чьи поиски подходят под объявление. Подписчики ищутся только для впервые
+    # опубликованных объявлений: по индексу в памяти, до его построения - в том же запросе
+    status = AdStatus.ACTIVE.value
+    params = (status, list(ad_ids), from_status, from_status)
+    if search_index.ready:
+        rows = execute_query(_SET_ADS_STATUS, params, fetch=True)
+    else:
+        rows = execute_query(
+            f"WITH published AS ({_SET_ADS_STATUS}) "
+            "SELECT p.id, p.title, p.price, p.location, p.old_status, p.telegram_id, ARRAY("
+            "    SELECT DISTINCT u.telegram_id FROM searches s JOIN users u ON u.id = s.user_id "
+            f"    WHERE p.old_status <> %s AND {_search_matches('p.title', 'p.location', 'p.location_id', 'p.price')} "
+            "    ORDER BY u.telegram_id"
+            ") FROM published p",
+            params + (status,),
+            fetch=True
+        )
+    if rows is None:
+        return None
+    _status_changed(rows, status)
+    if search_index.ready:
+        rows = [
+            row[:6] + ([] if row[4] == status else
+                       sorted({search[7] for search in search_index.match(row[1], row[3], row[2], row[6])}),)
+            for row in rows
+        ]
+    return sorted(rows)
+
+def iter_content_reports(batch_size=ITER_BATCH_SIZE):
+    # (username автора, текст) потоком; автор берется тем же запросом, а не по жалобе.
+    # Пачки читаются keyset-запросами по (created_at, id) (индекс reviews_listing_idx),
+    # каждая в своей короткой транзакции: пока обработчик отправляет строки в Telegram,
+    # соединение и транзакция не заняты. Ошибки пробрасываются, как у iter_query
+    after = ()
+    while True:
+        with transaction() as cur:
+            cur.execute(
+                "SELECT r.created_at, r.id, u.username, r.text FROM reviews r JOIN users u ON u.id = r.user_id "
+                "WHERE r.type = %s AND r.ad_id IS NULL"
+                + (" AND (r.created_at, r.id) > (%s, %s)" if after else "") +
+                " ORDER BY r.created_at, r.id LIMIT %s",
+                (ReviewType.CONTENT.value, *after, batch_size)
+            )
+            rows = cur.fetchall()
+        for row in rows:
+            yield row[2:]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][:2]
+
+# ===== Очередь уведомлений =====
+def enqueue_notifications(messages):
+    # messages: [(chat_id, text)]; вся пачка вставляется одним запросом
+    if not messages:
+        return True
+    chat_ids = [chat_id for chat_id, _ in messages]
+    texts = [text for _, text in messages]
     return execute_query(
-        "UPDATE ads SET status = %s WHERE id = %s",
-        (status, ad_id)
+        "INSERT INTO notification_outbox (chat_id, text) "
+        "SELECT * FROM unnest(%s::bigint[], %s::text[])",
+        (chat_ids, texts)
     ) is not None
 
-def get_content_reports():
+def claim_notifications(limit, lease_seconds):
+    # Захват пачки готовых к отправке уведомлений. На время аренды они не видны
+    # другим процессам; если процесс упадет, после аренды их отправит кто-то еще
     return execute_query(
-        "SELECT * FROM reviews WHERE type = %s",
-        (ReviewType.CONTENT.value,),
+        "UPDATE notification_outbox SET next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' "
+        "WHERE id IN ("
+        "    SELECT id FROM notification_outbox "
+        "    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP "
+        "    ORDER BY next_attempt_at, id LIMIT %s FOR UPDATE SKIP LOCKED"
+        ") RETURNING id, chat_id, text, attempts",
+        (lease_seconds, limit),
         fetch=True
-    )
+    ) or []
+
+def mark_notifications_sent(ids):
+    if not ids:
+        return True
+    return execute_query(
+        "UPDATE notification_outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, "
+        "attempts = attempts + 1 WHERE id = ANY(%s)",
+        (list(ids),)
+    ) is not None
+
+def reschedule_notification(notification_id, delay_seconds, error):
+    return execute_query(
+        "UPDATE notification_outbox SET attempts = attempts + 1, error = %s, "
+        "next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' WHERE id = %s",
+        (error, delay_seconds, notification_id)
+    ) is not None
+
+def fail_notification(notification_id, error):
+    return execute_query(
+        "UPDATE notification_outbox SET status = 'failed', attempts = attempts + 1, error = %s "
+        "WHERE id = %s",
+        (error, notification_id)
+    ) is not None
 
 def is_admin(username):
     from list_admin import admins
@@ -0,0 +1,123 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import logging
+import secrets
+from urllib.parse import urlparse
+from telegram import Update
+from http_server import HttpServer
+
+logger = logging.getLogger(__name__)
+
+# Режим вебхука включается переменной WEBHOOK_URL (публичный адрес, который Telegram
+# будет вызывать). Встроенный сервер слушает WEBHOOK_LISTEN:WEBHOOK_PORT.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+# Секрет, который Telegram передает в заголовке каждого запроса; если не задан,
+# генерируется при запуске (вебхук все равно переустанавливается при старте)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+HEALTH_PATH = '/healthz'
+
+class WebhookServer:
+    # Принимает обновления от Telegram и передает их в deliver(data) - словарь обновления.
+    # is_healthy() определяет ответ /healthz.
+    def __init__(self, deliver, secret, path='/', host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, is_healthy=None):
+        self.deliver = deliver
+        self.is_healthy = is_healthy or (lambda: True)
+        self.secret = secret.encode()
+        self.path = path or '/'
+        self.http = HttpServer(self._handle, host, port)
+
+    @property
+    def port(self):
+        return self.http.port
+
+    async def _handle(self, request):
+        if request.path == HEALTH_PATH:
+            if self.is_healthy():
+                return 200, 'ok\n'
+            return 503, 'unavailable\n'
+        if request.path != self.path:
+            return 404, 'Not found\n'
+        if request.method != 'POST':
+            return 405, ''
+        token = request.headers.get(SECRET_HEADER, '').encode('latin-1')
+        if not hmac.compare_digest(token, self.secret):
+            logger.warning("Запрос к вебхуку с неверным секретом")
+            return 403, ''
+        try:
+            data = json.loads(request.body)
+            if not isinstance(data, dict) or 'update_id' not in data:
+                raise ValueError("нет update_id")
+        except ValueError as e:
+            logger.error(f"Некорректное обновление: {e}")
+            return 400, ''
+        await self.deliver(data)
+        return 200, ''
+
+    async def start(self):
+        await self.http.start()
+        return self
+
+    async def stop(self):
+        await self.http.stop()
+
+async def set_webhook(bot, server, url, secret, drop_pending_updates=False):
+    # Без url адрес строится из адреса встроенного сервера (для тестов)
+    await bot.set_webhook(
+        url=url or f"http://{server.http.host}:{server.port}/",
+        secret_token=secret,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=drop_pending_updates
+    )
+    logger.info(f"Вебхук слушает {server.http.host}:{server.port}")
+
+def stop_on_signals(stop_event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+async def serve(application, url=WEBHOOK_URL, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT,
+                secret=WEBHOOK_SECRET, stop_event=None, drop_pending_updates=False):
+    # Жизненный цикл тот же, что у run_polling: initialize, post_init, start ... stop,
+    # post_stop, shutdown, post_shutdown
+    stop_event = stop_event or asyncio.Event()
+    stop_on_signals(stop_event)
+
+    server = None
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        async def deliver(data):
+            await application.update_queue.put(Update.de_json(data, application.bot))
+
+        server = WebhookServer(deliver, secret, urlparse(url).path if url else '/', host, port,
+                               is_healthy=lambda: application.running)
+        await server.start()
+        await set_webhook(application.bot, server, url, secret, drop_pending_updates)
+        await stop_event.wait()
+    finally:
+        # Сначала перестаем принимать запросы, затем дорабатываем очередь обновлений
+        if server is not None:
+            await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def run_webhook(application, **kwargs):
+    asyncio.run(serve(application, **kwargs))